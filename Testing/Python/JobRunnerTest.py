@@ -0,0 +1,91 @@
+import os, sys, json, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'mpReviewUtils', 'OncoQuant'))
+from JobRunner import Job, JobRunner, getFilesFingerprint
+
+# Tests of JobRunner with a stub command instead of the OncoQuant executables.
+# The stub appends its name to a runs file, so that the tests can count how
+# often each job was run, writes its output file and exits with the given status.
+#
+# Run with: python -m unittest JobRunnerTest
+
+STUB = '''
+import sys
+name, runsFile, outputFile, exitStatus = sys.argv[1:5]
+with open(runsFile, 'a') as f:
+  f.write(name+'\\n')
+if outputFile != '-':
+  with open(outputFile, 'w') as f:
+    f.write(name)
+print('stub '+name)
+sys.exit(int(exitStatus))
+'''
+
+class JobRunnerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.stub = os.path.join(self.tempDir, 'stub.py')
+    with open(self.stub, 'w') as f:
+      f.write(STUB)
+    self.runsFile = os.path.join(self.tempDir, 'runs.txt')
+    self.statusFile = os.path.join(self.tempDir, 'status.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+  def createJob(self, name, exitStatus=0, fingerprint=None, output=None):
+    command = [sys.executable, self.stub, name, self.runsFile, output or '-', exitStatus]
+    return Job(name, command, os.path.join(self.tempDir, name+'.log'), fingerprint=fingerprint,
+               outputs=[output] if output else None)
+
+  def getRuns(self):
+    if not os.path.exists(self.runsFile):
+      return []
+    with open(self.runsFile) as f:
+      return f.read().split()
+
+  def test_success_and_failure(self):
+    exitStatuses = JobRunner(self.statusFile, 2).run([self.createJob('good'), self.createJob('bad', 3)])
+    self.assertEqual(exitStatuses, {'good': 0, 'bad': 3})
+    with open(self.statusFile) as f:
+      status = json.load(f)
+    self.assertEqual(status['good']['ExitStatus'], 0)
+    self.assertEqual(status['bad']['ExitStatus'], 3)
+    with open(os.path.join(self.tempDir, 'good.log')) as f:
+      self.assertIn('stub good', f.read())
+
+  def test_missing_executable(self):
+    job = Job('missing', [os.path.join(self.tempDir, 'does-not-exist')], os.path.join(self.tempDir, 'missing.log'))
+    self.assertEqual(JobRunner(self.statusFile).run([job]), {'missing': -1})
+
+  def test_resume(self):
+    JobRunner(self.statusFile, 2).run([self.createJob('good'), self.createJob('bad', 1)])
+    # only the failed job runs again, it succeeds this time
+    exitStatuses = JobRunner(self.statusFile, 2).run([self.createJob('good'), self.createJob('bad')])
+    self.assertEqual(exitStatuses, {'bad': 0})
+    self.assertEqual(sorted(self.getRuns()), ['bad', 'bad', 'good'])
+    self.assertEqual(JobRunner(self.statusFile).run([self.createJob('good'), self.createJob('bad')]), {})
+    # force runs everything
+    self.assertEqual(len(JobRunner(self.statusFile).run([self.createJob('good')], force=True)), 1)
+
+  def test_changed_fingerprint(self):
+    inputFile = os.path.join(self.tempDir, 'input.txt')
+    with open(inputFile, 'w') as f:
+      f.write('1')
+    JobRunner(self.statusFile).run([self.createJob('job', fingerprint=getFilesFingerprint([inputFile]))])
+    self.assertEqual(JobRunner(self.statusFile).run([self.createJob('job', fingerprint=getFilesFingerprint([inputFile]))]), {})
+    with open(inputFile, 'w') as f:
+      f.write('22')
+    exitStatuses = JobRunner(self.statusFile).run([self.createJob('job', fingerprint=getFilesFingerprint([inputFile]))])
+    self.assertEqual(exitStatuses, {'job': 0})
+
+  def test_missing_output(self):
+    output = os.path.join(self.tempDir, 'job.out')
+    JobRunner(self.statusFile).run([self.createJob('job', output=output)])
+    self.assertEqual(JobRunner(self.statusFile).run([self.createJob('job', output=output)]), {})
+    os.remove(output)
+    self.assertEqual(JobRunner(self.statusFile).run([self.createJob('job', output=output)]), {'job': 0})
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+import vtk, qt, ctk, slicer
+from slicer.ScriptedLoadableModule import *
+from mpReview import mpReviewLogic
+
+
+class mpReviewDICOMwebTest(ScriptedLoadableModule):
+
+  def __init__(self, parent):
+    ScriptedLoadableModule.__init__(self, parent)
+    self.parent.title = "mpReviewDICOMwebTest"
+    self.parent.categories = ["Testing.TestCases"]
+    self.parent.dependencies = ["mpReview"]
+    self.parent.contributors = ["mpReview developers"]
+    self.parent.helpText = """
+    Tests of the DICOMweb helpers of mpReview that do not need a server.
+    """
+    self.parent.acknowledgementText = """
+    Supported by NIH U01CA151261 (PI Fennessy)
+    """
+
+
+class FakeResponse(object):
+  """Streamed response with the given body, returned in chunks of at most maxChunkSize bytes"""
+
+  def __init__(self, body, contentType, maxChunkSize):
+    self.body = body
+    self.headers = {'Content-Type': contentType}
+    self.maxChunkSize = maxChunkSize
+
+  def iter_content(self, chunkSize):
+    size = min(chunkSize, self.maxChunkSize)
+    for start in range(0, len(self.body), size):
+      yield self.body[start:start+size]
+
+
+class mpReviewDICOMwebTestTest(ScriptedLoadableModuleTest):
+
+  # contains CR LF and part of the boundary, which must not end the part
+  CONTENT = b'DICM\r\n--bound\x00\x01' + bytes(range(256))*4
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.fileName = os.path.join(self.tempDir, 'instance')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+  def runTest(self):
+    for test in [self.test_SinglePart, self.test_Multipart, self.test_IncompleteMultipart]:
+      self.setUp()
+      try:
+        test()
+      finally:
+        self.tearDown()
+    self.delayDisplay('Test passed!')
+
+  def readFile(self):
+    with open(self.fileName, 'rb') as f:
+      return f.read()
+
+  def createMultipartBody(self, boundary):
+    return (b'--' + boundary + b'\r\nContent-Type: application/dicom\r\n\r\n' + self.CONTENT +
+            b'\r\n--' + boundary + b'--\r\n')
+
+  def test_SinglePart(self):
+    mpReviewLogic.writeResponseBody(FakeResponse(self.CONTENT, 'application/dicom', 100), self.fileName)
+    self.assertEqual(self.readFile(), self.CONTENT)
+
+  def test_Multipart(self):
+    boundary = b'boundary-1234'
+    contentType = 'multipart/related; type="application/dicom"; boundary="%s"' % boundary.decode()
+    body = self.createMultipartBody(boundary)
+    # chunk sizes that split the headers and the closing delimiter at every offset
+    for maxChunkSize in [1, 3, 7, 16, len(body)]:
+      mpReviewLogic.writeResponseBody(FakeResponse(body, contentType, maxChunkSize), self.fileName, chunkSize=64)
+      self.assertEqual(self.readFile(), self.CONTENT, 'chunk size %i' % maxChunkSize)
+
+  def test_IncompleteMultipart(self):
+    boundary = b'boundary-1234'
+    contentType = 'multipart/related; boundary=%s' % boundary.decode()
+    body = self.createMultipartBody(boundary)[:-len(boundary)-10]
+    with self.assertRaises(IOError):
+      mpReviewLogic.writeResponseBody(FakeResponse(body, contentType, 16), self.fileName)
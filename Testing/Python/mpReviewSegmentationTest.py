@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pydicom
+import vtk, qt, ctk, slicer
+from slicer.ScriptedLoadableModule import *
+from mpReview import mpReviewLogic
+
+
+class mpReviewSegmentationTest(ScriptedLoadableModule):
+
+  def __init__(self, parent):
+    ScriptedLoadableModule.__init__(self, parent)
+    self.parent.title = "mpReviewSegmentationTest"
+    self.parent.categories = ["Testing.TestCases"]
+    self.parent.dependencies = ["mpReview"]
+    self.parent.contributors = ["mpReview developers"]
+    self.parent.helpText = """
+    Round trip of segmentations through the DICOM SEG writer and loader of mpReview.
+    """
+    self.parent.acknowledgementText = """
+    Supported by NIH U01CA151261 (PI Fennessy)
+    """
+
+
+class mpReviewSegmentationTestTest(ScriptedLoadableModuleTest):
+
+  # odd number of columns, so that the bits of the frames do not start on byte boundaries
+  ROWS = 6
+  COLUMNS = 5
+  SLICES = 8
+  PROSTATE = 'Segmentation category and type - DICOM master list~SCT^85756007^Tissue~' \
+             'SCT^41216001^Prostate~^^~Anatomic codes - DICOM master list~^^~^^'
+
+  def setUp(self):
+    slicer.mrmlScene.Clear(0)
+    self.tempDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+  def runTest(self):
+    for test in [self.test_RoundTrip, self.test_FractionalThreshold, self.test_EmptySegmentation]:
+      self.setUp()
+      try:
+        test()
+      finally:
+        self.tearDown()
+    self.delayDisplay('Test passed!')
+
+  def createReferenceSeries(self):
+    """Write an uncompressed single-frame MR series, returns the files and a volume loaded from them"""
+    seriesInstanceUID = pydicom.uid.generate_uid()
+    fileNames = []
+    slices = []
+    for k in range(self.SLICES):
+      fileMeta = pydicom.dataset.FileMetaDataset()
+      fileMeta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'  # MR Image Storage
+      fileMeta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+      fileMeta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+      dataset = pydicom.Dataset()
+      dataset.file_meta = fileMeta
+      dataset.is_little_endian = True
+      dataset.is_implicit_VR = False
+      dataset.SOPClassUID = fileMeta.MediaStorageSOPClassUID
+      dataset.SOPInstanceUID = fileMeta.MediaStorageSOPInstanceUID
+      dataset.StudyInstanceUID = '1.2.3.4'
+      dataset.SeriesInstanceUID = seriesInstanceUID
+      dataset.FrameOfReferenceUID = '1.2.3.5'
+      dataset.PatientID = 'mpReviewSegmentationTest'
+      dataset.Modality = 'MR'
+      dataset.SeriesNumber = 1
+      dataset.InstanceNumber = k+1
+      dataset.ImagePositionPatient = [-10., -20., 3.*k]
+      dataset.ImageOrientationPatient = [1., 0., 0., 0., 1., 0.]
+      dataset.PixelSpacing = [0.5, 0.75]
+      dataset.SliceThickness = 3.
+      dataset.Rows = self.ROWS
+      dataset.Columns = self.COLUMNS
+      dataset.SamplesPerPixel = 1
+      dataset.PhotometricInterpretation = 'MONOCHROME2'
+      dataset.BitsAllocated = 16
+      dataset.BitsStored = 16
+      dataset.HighBit = 15
+      dataset.PixelRepresentation = 0
+      dataset.PixelData = np.full((self.ROWS, self.COLUMNS), k, dtype=np.uint16).tobytes()
+      # files in reverse slice order, the writer must sort them
+      fileName = os.path.join(self.tempDir, 'MR%02i.dcm' % (self.SLICES-k))
+      dataset.save_as(fileName, write_like_original=False)
+      fileNames.append(fileName)
+      sliceGeometry = mpReviewLogic.getSliceGeometryFromDataset(dataset)
+      sliceGeometry['Array'] = dataset.pixel_array
+      slices.append(sliceGeometry)
+    volume = mpReviewLogic.createScalarVolumeNodeFromSlices('Reference', slices)
+    return fileNames, volume
+
+  def createSegmentation(self, volume, arrays):
+    """Segmentation node with one segment per (k,j,i) array, the first one with terminology"""
+    segmentationNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
+    segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(volume)
+    colors = [(0.8, 0.2, 0.1), (0.1, 0.5, 0.9)]
+    for index, narray in enumerate(arrays):
+      segmentId = segmentationNode.GetSegmentation().AddEmptySegment('Segment%i' % index, 'Segment%i' % index,
+                                                                     colors[index])
+      if index == 0:
+        segmentationNode.GetSegmentation().GetSegment(segmentId).SetTag(
+          slicer.vtkSegment.GetTerminologyEntryTagName(), self.PROSTATE)
+      slicer.util.updateSegmentBinaryLabelmapFromArray(narray, segmentationNode, segmentId, volume)
+    return segmentationNode
+
+  def saveSegmentation(self, dataset):
+    fileName = os.path.join(self.tempDir, 'SEG.dcm')
+    dataset.save_as(fileName, write_like_original=False)
+    return fileName
+
+  def test_RoundTrip(self):
+    fileNames, volume = self.createReferenceSeries()
+    shape = (self.SLICES, self.ROWS, self.COLUMNS)
+    first = np.zeros(shape, dtype=np.uint8)
+    first[2, 0, 0] = 1
+    first[2, 1:4, 2:5] = 1
+    first[4, 5, 4] = 1
+    second = np.zeros(shape, dtype=np.uint8)
+    second[6, 2, 1:3] = 1
+    segmentationNode = self.createSegmentation(volume, [first, second])
+
+    dataset = mpReviewLogic.createDICOMSegmentation(segmentationNode, volume, fileNames, 'Test')
+    self.assertIsNotNone(dataset)
+    self.assertEqual(dataset.SegmentationType, 'BINARY')
+    # only the non-empty slices of each segment are stored, slice 3 of the first one is skipped
+    self.assertEqual(int(dataset.NumberOfFrames), 3)
+    self.assertEqual([list(fg.FrameContentSequence[0].DimensionIndexValues) for fg in dataset.PerFrameFunctionalGroupsSequence],
+                     [[1, 3], [1, 5], [2, 7]])
+    # the first pixel of the first frame is the least significant bit of the first byte
+    self.assertEqual(dataset.PixelData[0] & 1, 1)
+    self.assertEqual(len(dataset.PixelData), 2*((3*self.ROWS*self.COLUMNS+15)//16))
+
+    loadedNode = mpReviewLogic.loadDICOMSegmentation(self.saveSegmentation(dataset), volume)
+    self.assertIsNotNone(loadedNode)
+    segmentation = segmentationNode.GetSegmentation()
+    loadedSegmentation = loadedNode.GetSegmentation()
+    self.assertEqual(loadedSegmentation.GetNumberOfSegments(), 2)
+    for index, expected in enumerate([first, second]):
+      segment = segmentation.GetNthSegment(index)
+      loadedSegmentId = loadedSegmentation.GetNthSegmentID(index)
+      loadedSegment = loadedSegmentation.GetSegment(loadedSegmentId)
+      loaded = slicer.util.arrayFromSegmentBinaryLabelmap(loadedNode, loadedSegmentId, volume)
+      np.testing.assert_array_equal(loaded != 0, expected != 0)
+      self.assertEqual(loadedSegment.GetName(), segment.GetName())
+      np.testing.assert_allclose(loadedSegment.GetColor(), segment.GetColor(), atol=0.01)
+    loadedEntry = vtk.mutable('')
+    loadedSegmentation.GetNthSegment(0).GetTag(slicer.vtkSegment.GetTerminologyEntryTagName(), loadedEntry)
+    self.assertEqual(str(loadedEntry), self.PROSTATE)
+
+  def test_FractionalThreshold(self):
+    fileNames, volume = self.createReferenceSeries()
+    narray = np.zeros((self.SLICES, self.ROWS, self.COLUMNS), dtype=np.uint8)
+    narray[4] = 1
+    segmentationNode = self.createSegmentation(volume, [narray])
+    dataset = mpReviewLogic.createDICOMSegmentation(segmentationNode, volume, fileNames, 'Test')
+
+    # store the single frame as occupancy, half of the maximum value and above is inside
+    occupancy = np.zeros((1, self.ROWS, self.COLUMNS), dtype=np.uint8)
+    occupancy[0, 0, :] = [0, 1, 127, 128, 255]
+    dataset.BitsAllocated = 8
+    dataset.BitsStored = 8
+    dataset.HighBit = 7
+    dataset.SegmentationType = 'FRACTIONAL'
+    dataset.SegmentationFractionalType = 'OCCUPANCY'
+    dataset.MaximumFractionalValue = 255
+    dataset.PixelData = occupancy.tobytes()
+    loadedNode = mpReviewLogic.loadDICOMSegmentation(self.saveSegmentation(dataset), volume)
+
+    loaded = slicer.util.arrayFromSegmentBinaryLabelmap(loadedNode, loadedNode.GetSegmentation().GetNthSegmentID(0), volume)
+    expected = np.zeros_like(narray)
+    expected[4, 0, :] = [0, 0, 0, 1, 1]
+    np.testing.assert_array_equal(loaded != 0, expected != 0)
+
+  def test_EmptySegmentation(self):
+    fileNames, volume = self.createReferenceSeries()
+    segmentationNode = self.createSegmentation(volume, [np.zeros((self.SLICES, self.ROWS, self.COLUMNS), dtype=np.uint8)])
+    self.assertIs(mpReviewLogic.createDICOMSegmentation(segmentationNode, volume, fileNames, 'Test'),
+                  mpReviewLogic.EMPTY_SEGMENTATION)
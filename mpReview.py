@@ -26,6 +26,15 @@ from DICOMwebBrowser import GoogleCloudPlatform
 
 import hashlib 
 import pydicom 
+import numpy as np
+import time
+import collections
+import uuid
+import threading
+import heapq
+import sqlite3
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 import shutil
 
@@ -138,6 +147,128 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     self.logic.createDirectory(self.tempDir, message='Temporary directory location: ' + self.tempDir)
     self.modulePath = os.path.dirname(slicer.util.modulePath(self.moduleName))
 
+    # network and file I/O that does not need to block the GUI runs on worker
+    # threads, completion callbacks are dispatched on the main thread by a timer
+    self.backgroundExecutor = ThreadPoolExecutor(max_workers=4)
+    # whole-series downloads to the local database have their own workers, so that
+    # they never hold up the interactive loading of series
+    self.archiveExecutor = ThreadPoolExecutor(max_workers=2)
+    # DICOMweb requests made from the GUI thread wait for the scheduler on these workers
+    self.requestExecutor = ThreadPoolExecutor(max_workers=2)
+    self.backgroundCallbacks = []
+    self.backgroundTimer = qt.QTimer()
+    self.backgroundTimer.setInterval(100)
+    self.backgroundTimer.connect('timeout()', self.onBackgroundTimer)
+    # seriesInstanceUID -> future of series being archived to the local DICOM database
+    self.pendingArchives = {}
+    # number of nested waits for background tasks, see waitForFuture
+    self.waitDepth = 0
+
+    # QIDO results of remote servers from previous sessions, created when first needed
+    self.metadataCache = None
+    # all DICOMweb requests are rate limited and ordered by priority
+    self.requestScheduler = mpReviewRequestScheduler()
+    # pooled HTTP sessions for DICOMweb requests, and the cached GCP access token
+    self.dicomwebSessions = {}
+    self.gcpTokenProvider = None
+    # cached lists of GCP projects, datasets and DICOM stores, created when first needed
+    self.gcpCatalog = None
+    self.gcpSelectorKeys = {}
+    # DICOM SEG uploads to remote servers, created when first needed
+    self.uploadQueue = None
+    # recently viewed frames of multivolumes, for scrubbing through time points
+    self.frameCache = mpReviewFrameCache()
+    # slice views of the review layout are kept and rebound when the reference changes
+    self.layoutController = mpReviewLayoutController()
+    self.cvLogic = self.layoutController.cvLogic
+    # number of slices retrieved for a first preview in progressive remote loading
+    self.previewSliceCount = 8
+    # image data of series that are not shown is paged out above this budget
+    self.residencyManager = mpReviewResidencyManager(self.getResidentMemoryBudget())
+
+  def getBooleanSetting(self, settingName, default):
+    """Value of a true/false setting, which is a string when read from the settings file"""
+    return str(self.getSetting(settingName, default=default)).lower() == 'true'
+
+  def getResidentMemoryBudget(self):
+    """Memory budget for image data of loaded series in bytes (setting ResidentMemoryBudgetMB)"""
+    try:
+      return int(self.getSetting('ResidentMemoryBudgetMB', default=4096))*1024*1024
+    except (TypeError, ValueError):
+      return 4096*1024*1024
+
+  def updateSeriesResidency(self):
+    """Page in the series that are shown in the slice views, and page out the ones
+    that are not shown if the loaded image data exceeds the memory budget"""
+    if self.refSeriesNumber == '-1':
+      return
+    if self.viewButtonGroup.checkedId() == 2:
+      visibleSeries = [self.refSeriesNumber]
+    else:
+      visibleSeries = list(self.seriesMap.keys())
+    for node in self.residencyManager.update(self.seriesMap, visibleSeries):
+      self.frameCache.removeNode(node)
+
+  def runInBackground(self, function, onFinished=None, executor=None):
+    """Run function on a worker thread (of backgroundExecutor by default). onFinished(future)
+    is called on the main thread once it completes. The function must not access the MRML
+    scene or the DICOM database."""
+    future = (executor or self.backgroundExecutor).submit(function)
+    if onFinished:
+      self.callWhenDone(future, onFinished)
+    return future
+
+  def callWhenDone(self, future, onFinished):
+    """Call onFinished(future) on the main thread once the future completes"""
+    self.backgroundCallbacks.append((future, onFinished))
+    if not self.backgroundTimer.isActive():
+      self.backgroundTimer.start()
+
+  def onBackgroundTimer(self):
+    if self.waitDepth:
+      # completion callbacks must not run in the middle of a handler that waits
+      return
+    callbacks, self.backgroundCallbacks = self.backgroundCallbacks, []
+    for future, onFinished in callbacks:
+      if not future.done():
+        self.backgroundCallbacks.append((future, onFinished))
+        continue
+      try:
+        onFinished(future)
+      except Exception as exc:
+        logging.error('Background task completion failed: %s' % str(exc))
+    if not self.backgroundCallbacks:
+      self.backgroundTimer.stop()
+    queued = sum(self.requestScheduler.getQueueDepth().values())
+    if queued:
+      slicer.util.showStatusMessage('%i DICOMweb request(s) queued' % queued, 1000)
+
+  def waitForFuture(self, future):
+    """Wait for a background task without freezing the GUI, returns its result. Events are
+    processed meanwhile, so the module panel is disabled and completion callbacks are
+    deferred until the wait is over, and handlers check isWaiting() to drop signals
+    that would re-enter them."""
+    self.waitDepth += 1
+    if self.waitDepth == 1:
+      self.parent.setEnabled(False)
+    try:
+      while not future.done():
+        slicer.app.processEvents()
+        time.sleep(0.01)
+    finally:
+      self.waitDepth -= 1
+      if not self.waitDepth:
+        self.parent.setEnabled(True)
+    return future.result()
+
+  def isWaiting(self):
+    return self.waitDepth > 0
+
+  def runRequestOnWorker(self, function):
+    """Run a scheduled DICOMweb request made on the GUI thread on a worker thread, so
+    that waiting for a scheduler slot or a backoff delay does not freeze the GUI"""
+    return self.waitForFuture(self.requestExecutor.submit(function))
+
   def getAllSliceWidgets(self):
     widgetNames = self.layoutManager.sliceViewNames()
     return [self.layoutManager.sliceWidget(wn) for wn in widgetNames]
@@ -199,7 +330,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     self.setTabsEnabled([1,2,3], False)
 
   def onTabWidgetClicked(self, currentIndex):
-    if self.currentTabIndex == currentIndex:
+    if self.currentTabIndex == currentIndex or self.isWaiting():
       return
     setNewIndex = False
     
@@ -392,14 +523,10 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       self.project = currentText.split()[0]
       self.datasetSelectorCombobox.clear()
       self.dicomStoreSelectorCombobox.clear()
-      qt.QTimer.singleShot(0, lambda : self.datasetSelectorCombobox.addItems(self.gcp.datasets(self.project)))
       
       self.datasetSelectorCombobox.setEditable(True)
-      dataset_list = self.gcp.datasets(self.project)
-      self.datasetCompleter = qt.QCompleter(dataset_list)
-      self.datasetCompleter.setCaseSensitivity(0)
-      self.datasetCompleter.setCompletionColumn(0)
-      self.datasetSelectorCombobox.setCompleter(self.datasetCompleter)
+      self.showGCPResources('datasets/'+self.project, self.datasetSelectorCombobox,
+                            self.onDatasetSelected, 'datasetCompleter')
       
   def onDatasetSelected(self):
     currentText = self.datasetSelectorCombobox.currentText
@@ -408,14 +535,62 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       self.dataset = datasetTextList[0]
       self.location = datasetTextList[1]
       self.dicomStoreSelectorCombobox.clear()
-      qt.QTimer.singleShot(0, lambda : self.dicomStoreSelectorCombobox.addItems(self.gcp.dicomStores(self.project, self.dataset)))
       
       self.dicomStoreSelectorCombobox.setEditable(True)
-      dicomStore_list = self.gcp.dicomStores(self.project, self.dataset)
-      self.dicomStoreCompleter = qt.QCompleter(dicomStore_list)
-      self.dicomStoreCompleter.setCaseSensitivity(0)
-      self.dicomStoreCompleter.setCompletionColumn(0)
-      self.dicomStoreSelectorCombobox.setCompleter(self.dicomStoreCompleter)
+      self.showGCPResources('dicomStores/'+self.project+'/'+self.dataset, self.dicomStoreSelectorCombobox,
+                            self.onDICOMStoreSelected, 'dicomStoreCompleter')
+
+  def getDICOMwebSession(self, serverType):
+    """Shared HTTP session for DICOMweb requests to the GCP server ('gcp') or other servers ('other')"""
+    if serverType not in self.dicomwebSessions:
+      auth = None
+      if serverType == 'gcp':
+        if self.gcpTokenProvider is None:
+          self.gcpTokenProvider = mpReviewTokenProvider(lambda: GoogleCloudPlatform().token())
+        auth = mpReviewBearerAuth(self.gcpTokenProvider)
+      self.dicomwebSessions[serverType] = mpReviewLogic.createDICOMwebSession(auth)
+    return self.dicomwebSessions[serverType]
+
+  def showGCPResources(self, key, combobox, onChanged, completerName):
+    """Fill a GCP resource selector from the catalog right away, and again when the
+    catalog entry was refreshed in the background"""
+    self.gcpSelectorKeys[completerName] = key
+    items, fresh = self.gcpCatalog.getCached(key)
+    if items is not None:
+      self.fillGCPSelector(combobox, items, onChanged, completerName)
+    if fresh:
+      return
+
+    def onFetched(future):
+      if future.exception() is not None:
+        logging.error('Failed to list GCP resources %s: %s' % (key, str(future.exception())))
+        return
+      # skip if another project or dataset was selected in the meantime
+      if self.gcpSelectorKeys.get(completerName) == key:
+        self.fillGCPSelector(combobox, future.result(), onChanged, completerName)
+
+    self.runInBackground(lambda: self.gcpCatalog.fetch(key), onFetched)
+
+  def fillGCPSelector(self, combobox, items, onChanged, completerName):
+    """Replace the items of the selector, keeping the current choice if it is still listed"""
+    if [combobox.itemText(i) for i in range(combobox.count)] == items:
+      return
+    currentText = combobox.currentText
+    combobox.blockSignals(True)
+    combobox.clear()
+    combobox.addItems(items)
+    index = combobox.findText(currentText) if currentText else -1
+    combobox.setCurrentIndex(max(index, 0))
+    combobox.blockSignals(False)
+
+    completer = qt.QCompleter(items)
+    completer.setCaseSensitivity(0)
+    completer.setCompletionColumn(0)
+    combobox.setCompleter(completer)
+    setattr(self, completerName, completer)
+
+    if index < 0:
+      onChanged()
 
   def onDICOMStoreSelected(self):
     currentText = self.dicomStoreSelectorCombobox.currentText
@@ -437,7 +612,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
   
   def checkIfProjectExists(self):
      
-    projectList = self.gcp.projects()
+    projectList = self.gcpCatalog.get('projects')
     if not self.project in projectList: 
       return False 
     else: 
@@ -445,8 +620,8 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     
   def checkIfLocationExists(self):
     
-    locationList = self.gcp.locations()
-    if not self.location in locationlist: 
+    locationList = self.gcpCatalog.get('locations')
+    if not self.location in locationList: 
       return False
     else:
       return True 
@@ -454,7 +629,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
   def checkIfDatasetExists(self):
     
     # datasetList = self.gcp.datasets(self.project)
-    datasetList = self.gcp.datasetsOnly(self.project)
+    datasetList = [d.split()[0] for d in self.gcpCatalog.get('datasets/'+self.project) if d]
     if not self.dataset in datasetList:
       return False
     else: 
@@ -462,7 +637,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     
   def checkIfDicomStoreExists(self):
     
-    dicomStoreList = self.gcp.dicomStores(self.project, self.dataset)
+    dicomStoreList = self.gcpCatalog.get('dicomStores/'+self.project+'/'+self.dataset)
     if not self.dicomStore in dicomStoreList: 
       return False 
     else:
@@ -583,10 +758,12 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     from dicomweb_client.api import DICOMwebClient
     effectiveServerUrl = self.serverUrl
 
-    session = None
-    headers = {}
-    headers["Authorization"] = f"Bearer {GoogleCloudPlatform().token()}"
-    self.DICOMwebClient = DICOMwebClient(url=effectiveServerUrl, session=session, headers=headers)
+    # the session adds a cached bearer token to every request
+    session = self.getDICOMwebSession('gcp')
+    self.DICOMwebClient = mpReviewScheduledDICOMwebClient(DICOMwebClient(url=effectiveServerUrl, session=session),
+                                                          self.requestScheduler, session,
+                                                          mainThreadRunner=self.runRequestOnWorker)
+    self.resumePendingUploads(effectiveServerUrl)
 
   def dicomwebOtherAuthorize(self):
 
@@ -595,21 +772,19 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     from dicomweb_client.api import DICOMwebClient
     effectiveServerUrl = self.otherserverUrl 
     
-    session = None
-    self.DICOMwebClient = DICOMwebClient(url=effectiveServerUrl, session=session)
+    session = self.getDICOMwebSession('other')
+    self.DICOMwebClient = mpReviewScheduledDICOMwebClient(DICOMwebClient(url=effectiveServerUrl, session=session),
+                                                          self.requestScheduler, session,
+                                                          mainThreadRunner=self.runRequestOnWorker)
+    self.resumePendingUploads(effectiveServerUrl)
     
   def setupGoogleCloudPlatform(self):
 
-    self.gcp = GoogleCloudPlatform()
-    print('projects: ' + str(self.gcp.projects()))
-      
-    self.projectSelectorCombobox.addItems(self.gcp.projects())
-    
-    project_list = self.gcp.projects()
-    self.projectCompleter = qt.QCompleter(project_list)
-    self.projectCompleter.setCaseSensitivity(0)
-    self.projectCompleter.setCompletionColumn(0)
-    self.projectSelectorCombobox.setCompleter(self.projectCompleter)
+    if self.gcpCatalog is None:
+      self.gcp = GoogleCloudPlatform()
+      self.gcpCatalog = mpReviewGCPCatalog(self.gcp, os.path.join(slicer.app.cachePath, 'mpReviewGCPCatalog.json'))
+
+    self.showGCPResources('projects', self.projectSelectorCombobox, self.onProjectSelected, 'projectCompleter')
 
   def onCancel(self):
 
@@ -1076,6 +1251,8 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     if self.refSeriesNumber == '-1':
       return
 
+    self.updateSeriesResidency()
+
     # Be sure the viewers are linked, they should be but who knows
     self.linkAllSliceWidgets(1)
 
@@ -1088,6 +1265,8 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       layoutNode.SetViewArrangement(layoutNode.SlicerLayoutOneUpRedSliceView)
 
   def onSeriesSelected(self, modelIndex):
+    if self.isWaiting():
+      return
 
     logging.debug('Row selected: '+self.seriesModel.item(modelIndex.row(),0).text())
     selectionModel = self.seriesView.selectionModel()
@@ -1180,6 +1359,13 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
 
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     # username = self.getSetting('UserName')
+
+    # a segmentation saved against a preview would reference slices that were never shown
+    referenceVolumeNode = self.seriesMap[self.refSeriesNumber].get('Volume')
+    if referenceVolumeNode is not None and referenceVolumeNode.GetAttribute(mpReviewLogic.PREVIEW_ATTRIBUTE) == 'true':
+      slicer.util.errorDisplay('The reference series is still loading, please save again once it is complete.',
+                               windowTitle="mpReview")
+      return
     
     if (self.selectLocalDatabaseButton.isChecked()):
       savedMessage = self.saveSegmentations(timestamp, database_type="local")
@@ -1221,14 +1407,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     # segNodesToRemove = None
     # nodes = None
     
-    for i in range(slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLScalarVolumeNode')):
-      node = slicer.mrmlScene.GetNthNodeByClass(0, 'vtkMRMLScalarVolumeNode')
-      node.UnRegister(slicer.mrmlScene)
-      slicer.mrmlScene.RemoveNode(node)
-    for i in range(slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLSegmentationNode')):
-      node = slicer.mrmlScene.GetNthNodeByClass(0, 'vtkMRMLSegmentationNode')
-      node.UnRegister(slicer.mrmlScene)
-      slicer.mrmlScene.RemoveNode(node)
+    self.logic.removeNodesByClass(['vtkMRMLScalarVolumeNode', 'vtkMRMLSegmentationNode'])
     
 
 
@@ -1252,9 +1431,6 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     logging.debug('All label nodes found: ' + str(labelNodes))
     savedMessage = 'Segmentations for the following series were saved:\n\n'
     
-    import DICOMSegmentationPlugin
-    exporter = DICOMSegmentationPlugin.DICOMSegmentationPluginClass()
-    
     success = 0 
     
     db = slicer.dicomDatabase
@@ -1282,68 +1458,33 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
         ### Get the referenced volume node without matching by name ### 
         referenceVolumeNode = label.GetNodeReference('referenceImageGeometryRef')
         
-        shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
-        
-        # set these for now. 
-        # study list could be from different patients. 
-        patientItemID = shNode.CreateSubjectItem(shNode.GetSceneItemID(), self.selectedStudyName)
-        studyItemID = shNode.CreateStudyItem(patientItemID, self.selectedStudyName)
-        volumeShItemID = shNode.GetItemByDataNode(referenceVolumeNode) # set volume node 
-        shNode.SetItemParent(volumeShItemID, studyItemID)
-        segmentationShItem = shNode.GetItemByDataNode(label) # segmentation
-        shNode.SetItemParent(segmentationShItem, studyItemID)
-        
-        
         if (database_type=="local"):
-        
-          # Export to DICOM
-          exportables = exporter.examineForExport(segmentationShItem)
-          for exp in exportables:
-            exp.directory = segmentationsDir
-            exp.setTag('SeriesDescription', labelName)
-            # exp.setTag('ContentCreatorName', username)
-          # exporter.export(exportables)
-          
-          # uniqueID = username + '-' + "SEG" + '-' + timestamp 
-          # labelFileName = os.path.join(segmentationsDir, uniqueID + ".dcm")
-          
-          labelFileName = os.path.join(segmentationsDir, 'subject_hierarchy_export.SEG'+exporter.currentDateTime+".dcm")
-          print ('labelFileName: ' + str(labelFileName))
-     
-          # exporter.export(exportables, labelFileName)
-          exporter.export(exportables)
-          
+          exportDirectory = segmentationsDir
         elif (database_type=="remote"):
-        
-          # Create temporary directory for saving the DICOM SEG file  
-          downloadDirectory = os.path.join(slicer.dicomDatabase.databaseDirectory,'tmp')
-          if not os.path.isdir(downloadDirectory):
-            os.mkdir(downloadDirectory)
-            
-          # Export to DICOM
-          exportables = exporter.examineForExport(segmentationShItem)
-          for exp in exportables:
-            exp.directory = downloadDirectory
-            exp.setTag('SeriesDescription', labelName)
-            # exp.setTag('ContentCreatorName', username)
-          
-          labelFileName = os.path.join(downloadDirectory, 'subject_hierarchy_export.SEG'+exporter.currentDateTime+".dcm")
-          print ('labelFileName: ' + str(labelFileName))
-     
-          exporter.export(exportables)
+          # the SEG references the instances of the series, which are read from the local database
+          self.ensureSeriesArchived(self.selectedStudyNumber, labelSeries)
+          # Export the DICOM SEG file to the staging directory of the upload queue  
+          exportDirectory = self.getUploadQueue().getStagingDirectory()
+
+        labelFileName = self.writeDICOMSegmentation(label, referenceVolumeNode, labelSeries, labelName, exportDirectory)
+        if labelFileName is mpReviewLogic.EMPTY_SEGMENTATION:
+          # the plugin would not write a file either, nothing to index or upload
+          logging.warning('All segments of %s are empty, it was not saved' % label.GetName())
+          slicer.util.warningDisplay('All segments of %s are empty, it was not saved.' % label.GetName(),
+                                     windowTitle="mpReview")
+          continue
+        if labelFileName is None:
+          labelFileName = self.exportDICOMSegmentationWithPlugin(label, referenceVolumeNode, labelName, exportDirectory)
+        print ('labelFileName: ' + str(labelFileName))
           
-          # Upload to remote server 
-          print('uploading seg dcm file to the remote server')
+        if (database_type=="local"):
+          self.indexDatabaseStorageDirectory(segmentationsDir)
+        elif (database_type=="remote"):
+          # Upload to remote server in the background, the queue is kept on disk
+          # until the upload succeeds
+          print('queueing seg dcm file for upload to the remote server')
           self.copySegmentationsToRemoteDicomweb(labelFileName) # this one uses dicomweb client 
           
-          # Now delete the files from the temporary directory 
-          for f in os.listdir(downloadDirectory):
-            os.remove(os.path.join(downloadDirectory, f))
-          # Delete the temporary directory 
-          os.rmdir(downloadDirectory)
-      
-          # also remove from the dicom database - it was added automatically?
-          
         success = 1 
       
         if success:
@@ -1359,14 +1500,78 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     return savedMessage
 
   
+  def writeDICOMSegmentation(self, segmentationNode, referenceVolumeNode, referencedSeriesInstanceUID, seriesDescription, directory):
+    """Write the segmentation as a DICOM SEG file in the directory, without the
+    DICOMSegmentationPlugin. Returns the file name, None if it cannot be written this way,
+    mpReviewLogic.EMPTY_SEGMENTATION if there is nothing to write."""
+    if referenceVolumeNode is None or referenceVolumeNode.GetImageData() is None:
+      return None
+    referenceFiles = slicer.dicomDatabase.filesForSeries(referencedSeriesInstanceUID)
+    dataset = self.logic.createDICOMSegmentation(segmentationNode, referenceVolumeNode, referenceFiles, seriesDescription)
+    if dataset is None or dataset is mpReviewLogic.EMPTY_SEGMENTATION:
+      return dataset
+    fileName = os.path.join(directory, 'SEG'+dataset.ContentDate+dataset.ContentTime+'-'+dataset.SOPInstanceUID+'.dcm')
+    dataset.save_as(fileName, write_like_original=False)
+    return fileName
+
+  def exportDICOMSegmentationWithPlugin(self, segmentationNode, referenceVolumeNode, seriesDescription, directory):
+    """Export the segmentation as a DICOM SEG file in the directory with the DICOMSegmentationPlugin"""
+    exporter = DICOMSegmentationPlugin.DICOMSegmentationPluginClass()
+    shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+        
+    # set these for now. 
+    # study list could be from different patients. 
+    patientItemID = shNode.CreateSubjectItem(shNode.GetSceneItemID(), self.selectedStudyName)
+    studyItemID = shNode.CreateStudyItem(patientItemID, self.selectedStudyName)
+    volumeShItemID = shNode.GetItemByDataNode(referenceVolumeNode) # set volume node 
+    shNode.SetItemParent(volumeShItemID, studyItemID)
+    segmentationShItem = shNode.GetItemByDataNode(segmentationNode) # segmentation
+    shNode.SetItemParent(segmentationShItem, studyItemID)
+
+    # Export to DICOM
+    exportables = exporter.examineForExport(segmentationShItem)
+    for exp in exportables:
+      exp.directory = directory
+      exp.setTag('SeriesDescription', seriesDescription)
+      # exp.setTag('ContentCreatorName', username)
+    exporter.export(exportables)
+    return os.path.join(directory, 'subject_hierarchy_export.SEG'+exporter.currentDateTime+".dcm")
+
   def copySegmentationsToRemoteDicomweb(self, labelFileName):
-    """Uses the dicomweb client to store DICOM SEG instance in the remote server"""
+    """Queues the DICOM SEG instance for upload to the remote server with the dicomweb client"""
     
-    dataset = pydicom.dcmread(labelFileName)
-    self.DICOMwebClient.store_instances(datasets=[dataset])
+    uploadQueue = self.getUploadQueue()
+    entry = uploadQueue.enqueue(labelFileName, self.DICOMwebClient.base_url)
+    self.startUpload(entry, self.DICOMwebClient.withPriority(mpReviewRequestScheduler.BACKGROUND))
 
     return
 
+  def getUploadQueue(self):
+    if self.uploadQueue is None:
+      self.uploadQueue = mpReviewUploadQueue(os.path.join(slicer.dicomDatabase.databaseDirectory, 'mpReviewUploadQueue'))
+    return self.uploadQueue
+
+  def startUpload(self, entry, client):
+    def onUploaded(future):
+      if future.exception() is not None:
+        slicer.util.errorDisplay('Failed to upload segmentation to %s, it will be uploaded again next time '
+                                 'this server is used.\n\n%s' % (entry['ServerURL'], str(future.exception())),
+                                 windowTitle="mpReview")
+      else:
+        logging.info('Uploaded %s to %s' % (entry['FileName'], entry['ServerURL']))
+        # the study has a new series now
+        self.getMetadataCache().invalidateSeries(entry['ServerURL'], future.result())
+    self.callWhenDone(self.getUploadQueue().submit(entry, client), onUploaded)
+
+  def resumePendingUploads(self, serverUrl):
+    """Start uploading the segmentations queued for the server in a previous session"""
+    if slicer.dicomDatabase is None or not slicer.dicomDatabase.isOpen:
+      return
+    uploadQueue = self.getUploadQueue()
+    for entry in uploadQueue.getPendingEntries(serverUrl):
+      logging.info('Resuming upload of %s to %s' % (entry['FileName'], serverUrl))
+      self.startUpload(entry, self.DICOMwebClient.withPriority(mpReviewRequestScheduler.BACKGROUND))
+
   def saveTargets(self, username, timestamp):
     savedMessage = ""
     fiducialsNode = self.fiducialsWidget.currentNode
@@ -1558,9 +1763,10 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       self.serverUrlLineEdit.setReadOnly(True)
       
     
-  def getTagValue(self, study, tag_name):
+  def getTagValue(self, study, tag_name, allValues=False):
     """This function takes as input a single study metadata from dicomweb and 
-      a tag_name, and returns the numeric string for that name"""
+      a tag_name, and returns the numeric string for that name. If allValues is
+      set, all values of a multi-valued tag are returned as a list"""
       
     if tag_name == "PatientID":
       tag_numeric = '00100020'
@@ -1586,9 +1792,33 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       tag_numeric = '00080033'
     elif tag_name == "Modality":
       tag_numeric = '00080060'
+    elif tag_name == "ImagePositionPatient":
+      tag_numeric = '00200032'
+    elif tag_name == "ImageOrientationPatient":
+      tag_numeric = '00200037'
+    elif tag_name == "PixelSpacing":
+      tag_numeric = '00280030'
+    elif tag_name == "Rows":
+      tag_numeric = '00280010'
+    elif tag_name == "Columns":
+      tag_numeric = '00280011'
+    elif tag_name == "SamplesPerPixel":
+      tag_numeric = '00280002'
+    elif tag_name == "NumberOfFrames":
+      tag_numeric = '00280008'
+    elif tag_name == "BitsAllocated":
+      tag_numeric = '00280100'
+    elif tag_name == "PixelRepresentation":
+      tag_numeric = '00280103'
+    elif tag_name == "RescaleIntercept":
+      tag_numeric = '00281052'
+    elif tag_name == "RescaleSlope":
+      tag_numeric = '00281053'
       
     try:
       study_value = study[tag_numeric]['Value']
+      if type(study_value) == list and allValues:
+        return study_value
       if type(study_value) == list:
         study_value = study_value[0]
         if tag_name == "ContentCreatorName": 
@@ -1613,11 +1843,19 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     
     print ('********** Getting the studies to update the study names *******')
     
+    studies = self.searchStudiesRemoteDatabase(self.DICOMwebClient)
+    self.getMetadataCache().updateStudies(self.DICOMwebClient.base_url, studies)
+    return self.getStudiesMapFromStudies(studies)
+
+  def searchStudiesRemoteDatabase(self, client):
+    """ All studies of the server (QIDO-RS), safe to run on a worker thread """
+    
     # Get the studies 
     offset = 0 
     studies = [] 
     while True:
-      subset = self.DICOMwebClient.search_for_studies(offset=offset)
+      # the number of series lets the metadata cache detect studies that changed
+      subset = client.search_for_studies(offset=offset, fields=['NumberOfStudyRelatedSeries'])
       if len(subset) == 0:
         break
       if subset[0] in studies:
@@ -1627,6 +1865,9 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       studies.extend(subset)
       offset += len(subset) 
     # print ('search_for_studies in remote database')
+    return studies
+
+  def getStudiesMapFromStudies(self, studies):
     
     # Iterate over each patient ID, get the appropriate list of studies 
     studiesMap = {} 
@@ -1748,6 +1989,32 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
         
     self.updateSegmentationTabAvailability()  
     
+  def getRemoteSeries(self, studyInstanceUID, revalidate=False):
+    """ [(series, metadata)] of the study on the remote server, from the metadata cache
+        unless the study changed or revalidate is set. Metadata of series seen before is
+        not retrieved again. """
+    metadataCache = self.getMetadataCache()
+    serverUrl = self.DICOMwebClient.base_url
+    cachedSeries = None if revalidate else metadataCache.getSeries(serverUrl, studyInstanceUID)
+    if cachedSeries is not None:
+      return cachedSeries
+    seriesList = self.DICOMwebClient.search_for_series(studyInstanceUID)
+    previousMetadata = metadataCache.getSeriesMetadata(serverUrl, studyInstanceUID)
+    cachedSeries = []
+    for series in seriesList:
+      # need to get metadata, only for series that were not seen before
+      seriesInstanceUID = self.getTagValue(series, 'SeriesInstanceUID')
+      metadata = previousMetadata.get(seriesInstanceUID)
+      if metadata is None:
+        metadata = self.DICOMwebClient.retrieve_series_metadata(study_instance_uid=studyInstanceUID,
+                                                                series_instance_uid=seriesInstanceUID
+                                                                )
+        # the series table only needs series level attributes of the first instance
+        metadata = [{tag: metadata[0][tag] for tag in mpReviewMetadataCache.SERIES_METADATA_TAGS if tag in metadata[0]}]
+      cachedSeries.append((series, metadata))
+    metadataCache.updateSeries(serverUrl, studyInstanceUID, cachedSeries)
+    return cachedSeries
+
   def updateSeriesTableRemote(self):
     
     self.seriesItems = []
@@ -1757,19 +2024,15 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     # Get the studyInstanceUID of the study selected 
     studyInstanceUID = self.selectedStudyNumber
     
-    # Get the series 
+    # Get the series, from the metadata cache if the study did not change 
     print ('******** Getting the series to update the series table remote ******')
-    seriesList = self.DICOMwebClient.search_for_series(studyInstanceUID)
+    cachedSeries = self.getRemoteSeries(studyInstanceUID)
     
-    self.seriesList = seriesList 
+    self.seriesList = [series for series, _ in cachedSeries] 
 
     seriesMap = {} 
-    for series in seriesList: 
-      # need to get metadata
+    for series, metadata in cachedSeries: 
       seriesInstanceUID = self.getTagValue(series, 'SeriesInstanceUID')
-      metadata = self.DICOMwebClient.retrieve_series_metadata(study_instance_uid=studyInstanceUID,
-                                                              series_instance_uid=seriesInstanceUID
-                                                              )
 
       try:
         seriesNumber = str(self.getTagValue(metadata[0], 'SeriesNumber')) 
@@ -1834,8 +2097,52 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     self.studyItems = [] 
     self.studiesModel.clear()
     self.seriesModel.clear()
-    self.studiesMap = self.getStudyNamesRemoteDatabase()
+    # show the studies of the previous session right away, and reconcile them
+    # with the server in the background
+    cachedStudies = self.getMetadataCache().getStudies(self.DICOMwebClient.base_url)
+    if cachedStudies:
+      self.studiesMap = self.getStudiesMapFromStudies(cachedStudies)
+      self.refreshStudiesInBackground()
+    else:
+      self.studiesMap = self.getStudyNamesRemoteDatabase()
     self.setStudiesView()
+
+  def getMetadataCache(self):
+    if self.metadataCache is None:
+      self.metadataCache = mpReviewMetadataCache(os.path.join(slicer.app.cachePath, 'mpReviewMetadataCache.sqlite'))
+    return self.metadataCache
+
+  def refreshStudiesInBackground(self):
+    """ Query the studies of the server again and update the studies table if they changed """
+    client = self.DICOMwebClient
+    serverUrl = client.base_url
+
+    def refreshStudies():
+      studies = self.searchStudiesRemoteDatabase(client)
+      return studies, self.getMetadataCache().updateStudies(serverUrl, studies)
+
+    def onStudiesRefreshed(future):
+      if future.exception() is not None:
+        logging.error('Failed to refresh the studies of %s: %s' % (serverUrl, str(future.exception())))
+        return
+      studies, changed = future.result()
+      if not changed or self.DICOMwebClient is None or self.DICOMwebClient.base_url != serverUrl:
+        return
+      logging.info('Studies of %s changed, updating the studies table' % serverUrl)
+      self.getStudiesMapFromStudies(studies)
+      selectedStudyName = self.selectedStudyName
+      self.studyItems = []
+      selectionModel = self.studiesView.selectionModel()
+      selectionModel.blockSignals(True)
+      self.studiesModel.clear()
+      self.setStudiesView()
+      # keep the study that is being reviewed selected
+      items = self.studiesModel.findItems(selectedStudyName) if selectedStudyName else []
+      if items:
+        selectionModel.setCurrentIndex(items[0].index(), selectionModel.Select)
+      selectionModel.blockSignals(False)
+
+    self.runInBackground(refreshStudies, onStudiesRefreshed)
     
   def setStudiesView(self):
     
@@ -1873,6 +2180,8 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     ModuleWidgetMixin.updateProgressBar(self, progress=self.progress, **kwargs)
 
   def onStudySelected(self, modelIndex):
+    if self.isWaiting():
+      return
     self.studiesGroupBox.collapsed = True
     logging.debug('Row selected: '+self.studiesModel.item(modelIndex.row(),0).text())
     selectionModel = self.studiesView.selectionModel()
@@ -1893,10 +2202,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     # nodes.UnRegister(slicer.mrmlScene)
     # allVolumeNodes = None
     # nodes = None
-    for i in range(slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRML*VolumeNode*')):
-      node = slicer.mrmlScene.GetNthNodeByClass(0, 'vtkMRML*VolumeNode*')
-      node.UnRegister(slicer.mrmlScene)
-      slicer.mrmlScene.RemoveNode(node)
+    self.logic.removeNodesByClass(['vtkMRMLVolumeNode', 'vtkMRMLSegmentationNode'])
     
 
     self.selectedStudyName = self.studiesModel.item(modelIndex.row(),0).text()
@@ -1934,6 +2240,11 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     # seriesInstanceUID = self.seriesMap[seriesNumber]['seriesInstanceUID']
     fileList = db.filesForSeries(seriesInstanceUID)
 
+    # Compressed series are decoded in parallel when they form a volume or a multivolume
+    volume = self.loadCompressedVolume(seriesInstanceUID, fileList)
+    if volume is not None:
+      return volume
+
     # Now load
     import DICOMScalarVolumePlugin
     scalarVolumeReader = DICOMScalarVolumePlugin.DICOMScalarVolumePluginClass()
@@ -1942,71 +2253,367 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     
     return volume 
   
-  def loadVolumeFromRemoteDatabase(self, selectedStudy, selectedSeries):
-    """ Load a series from a remote DICOM server """
-          
-    indexer = ctk.ctkDICOMIndexer()  
-    indexer.backgroundImportEnabled=True    
-    
-    db = slicer.dicomDatabase   
-  
-    # A temporary directory for the downloaded DICOM files from the remote database 
-    downloadDirectory = os.path.join(slicer.dicomDatabase.databaseDirectory, 'tmp')
-    if not os.path.isdir(downloadDirectory):
-      # os.mkdir(downloadDirectory)
-      os.makedirs(downloadDirectory)
-     
-    # Get the instances corresponding to the chosen study and series  
-    print ('********** Searching for instances for volumes from remote database *********')    
-    instances = self.DICOMwebClient.search_for_instances(
-                          study_instance_uid=selectedStudy,
-                          series_instance_uid=selectedSeries
-                          )
-    # print ('slicer process events')
-    # slicer.app.processEvents()
-    # print ('search_for_instances in remote database')
-    
-    # The instances that are already in the DICOM database, no need to download  
-    instancesAlreadyInDatabase = slicer.dicomDatabase.instancesForSeries(selectedSeries)
-    
-    # Download and write the files that are not currently in the DICOM database 
-    print('downloading and writing the files that are currently not in the DICOM database')
-    for instanceIndex, instance in enumerate(instances):
-      # sopInstanceUid = instance['00080018']['Value'][0]
+  def loadCompressedVolume(self, seriesInstanceUID, fileList):
+    """ Decode the pixel data of a compressed single-frame series on all cores and build
+        a scalar volume node, or a multivolume node for series with one regular volume per
+        time point (e.g. DCE), from it. Returns None if the series is not compressed, has
+        another layout, or cannot be decoded by pydicom. """
+    if not len(fileList):
+      return None
+    try:
+      firstDataset = pydicom.dcmread(fileList[0], stop_before_pixels=True)
+      if not firstDataset.file_meta.TransferSyntaxUID.is_compressed:
+        return None
+    except Exception:
+      return None
+
+    startTime = time.time()
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+      try:
+        datasets = [firstDataset]+list(executor.map(lambda f: pydicom.dcmread(f, stop_before_pixels=True), fileList[1:]))
+      except Exception as exc:
+        logging.debug('Could not read the headers of series %s (%s), using the DICOM plugins' %
+                      (seriesInstanceUID, str(exc)))
+        return None
+      slices = [mpReviewLogic.getSliceGeometryFromDataset(ds) for ds in datasets]
+      if None in slices:
+        return None
+      # a series with several slices per position is loaded as a multivolume
+      frameIdentifyingTag = None
+      if mpReviewLogic.getVolumeGeometryFromSlices(slices) is None:
+        frameIdentifyingTag = mpReviewLogic.getFrameIdentifyingTag(datasets, slices)
+        if frameIdentifyingTag is None:
+          return None
+      try:
+        # the first file is decoded on its own, so that a series pydicom has no
+        # decoder for fails once instead of in every worker
+        arrays = [mpReviewLogic.decodePixelArray(fileList[0], slices[0])]
+        arrays += list(executor.map(mpReviewLogic.decodePixelArray, fileList[1:], slices[1:]))
+      except Exception as exc:
+        logging.debug('Could not decode series %s with pydicom (%s), using the DICOM plugins' %
+                      (seriesInstanceUID, str(exc)))
+        return None
+    for sliceGeometry, array in zip(slices, arrays):
+      sliceGeometry['Array'] = array
+
+    if frameIdentifyingTag is None:
+      volume = mpReviewLogic.createScalarVolumeNodeFromSlices(seriesInstanceUID, slices)
+    else:
+      tagName, units = frameIdentifyingTag
+      frameValues = [mpReviewLogic.getFrameIdentifyingValue(ds, tagName) for ds in datasets]
+      volume = mpReviewLogic.createMultiVolumeNodeFromSlices(seriesInstanceUID, slices, frameValues, tagName, units)
+    mpReviewLogic.setVolumeDICOMReferences(volume, seriesInstanceUID, [sg['SOPInstanceUID'] for sg in slices])
+    logging.info('Decoded %i compressed slices of %s in %.1f s' % (len(slices), seriesInstanceUID, time.time()-startTime))
+    return volume
+
+  def loadVolumeFromRemoteDatabase(self, selectedStudy, selectedSeries, priority=None):
+    """ Load a series from a remote DICOM server. Pixel data is streamed directly
+        into a volume node when possible, and the series is archived to the local
+        DICOM database in the background (unless disabled in the settings). Series
+        that are not a single regular volume are imported through the DICOM plugins.
+        Requests use the given scheduling priority, see getSeriesPriority. """
+
+    if priority is None:
+      priority = self.getSeriesPriority(selectedSeries, self.refSeriesNumber)
+    if self.getBooleanSetting('StreamRemoteSeries', default=True):
+      volume = self.streamVolumeFromRemoteDatabase(selectedStudy, selectedSeries, priority)
+      if volume is not None:
+        if self.getBooleanSetting('ArchiveRemoteSeries', default=True):
+          self.archiveSeriesInBackground(selectedStudy, selectedSeries)
+        return volume
+
+    return self.importVolumeFromRemoteDatabase(selectedStudy, selectedSeries, priority)
+
+  def getSliceGeometryFromMetadata(self, instanceMetadata):
+    """ Geometry and pixel format of a single-frame instance from its DICOM JSON metadata,
+        None if the instance cannot be streamed as a plain 2D frame """
+    try:
+      if int(self.getTagValue(instanceMetadata, 'NumberOfFrames') or 1) != 1 or \
+         int(self.getTagValue(instanceMetadata, 'SamplesPerPixel') or 1) != 1:
+        return None
+      return {'SOPInstanceUID': self.getTagValue(instanceMetadata, 'SOPInstanceUID'),
+              'ImagePositionPatient': [float(v) for v in self.getTagValue(instanceMetadata, 'ImagePositionPatient', allValues=True)],
+              'ImageOrientationPatient': [float(v) for v in self.getTagValue(instanceMetadata, 'ImageOrientationPatient', allValues=True)],
+              'PixelSpacing': [float(v) for v in self.getTagValue(instanceMetadata, 'PixelSpacing', allValues=True)],
+              'Rows': int(self.getTagValue(instanceMetadata, 'Rows')),
+              'Columns': int(self.getTagValue(instanceMetadata, 'Columns')),
+              'BitsAllocated': int(self.getTagValue(instanceMetadata, 'BitsAllocated')),
+              'PixelRepresentation': int(self.getTagValue(instanceMetadata, 'PixelRepresentation') or 0),
+              'RescaleSlope': float(self.getTagValue(instanceMetadata, 'RescaleSlope') or 1.),
+              'RescaleIntercept': float(self.getTagValue(instanceMetadata, 'RescaleIntercept') or 0.)}
+    except (TypeError, ValueError):
+      return None
+
+  @staticmethod
+  def getSeriesPriority(selectedSeries, referenceSeries):
+    """ Scheduling priority of requests for the series: the reference series first """
+    if selectedSeries == referenceSeries:
+      return mpReviewRequestScheduler.INTERACTIVE
+    return mpReviewRequestScheduler.SELECTED
+
+  def retrieveFrameArray(self, selectedStudy, selectedSeries, sliceGeometry, priority=None):
+    """ Retrieve the uncompressed pixel data of a single-frame instance as a 2D array.
+        Safe to run on a worker thread. """
+    if priority is None:
+      priority = self.getSeriesPriority(selectedSeries, self.refSeriesNumber)
+    client = self.DICOMwebClient.withPriority(priority)
+    frames = client.retrieve_instance_frames(study_instance_uid=selectedStudy,
+                                             series_instance_uid=selectedSeries,
+                                             sop_instance_uid=sliceGeometry['SOPInstanceUID'],
+                                             frame_numbers=[1],
+                                             media_types=('application/octet-stream',))
+    return mpReviewLogic.frameBytesToArray(frames[0], sliceGeometry)
+
+  def streamVolumeFromRemoteDatabase(self, selectedStudy, selectedSeries, priority):
+    """ Build a scalar volume node from the pixel frames of the series, without writing
+        DICOM files. Returns None if the series cannot be loaded this way. """
+
+    print ('********** Streaming frames of the series from remote database *********')
+    try:
+      metadata = self.DICOMwebClient.withPriority(priority).retrieve_series_metadata(study_instance_uid=selectedStudy,
+                                                              series_instance_uid=selectedSeries)
+    except Exception as exc:
+      logging.error('Failed to retrieve series metadata: %s' % str(exc))
+      return None
+
+    slices = [self.getSliceGeometryFromMetadata(m) for m in metadata]
+    if not len(slices) or None in slices or mpReviewLogic.getVolumeGeometryFromSlices(slices) is None:
+      logging.debug('Series %s is not a regular volume, using the DICOM plugins' % selectedSeries)
+      return None
+
+    # in progressive mode only evenly spaced slices are retrieved before the volume
+    # is shown, the other slices are filled in the background
+    order = mpReviewLogic.getVolumeGeometryFromSlices(slices)[0]
+    if self.getBooleanSetting('ProgressiveRemoteLoading', default=False):
+      previewIndices = mpReviewLogic.getPreviewSliceIndices(order, self.previewSliceCount)
+    else:
+      previewIndices = list(range(len(slices)))
+
+    futures = [self.runInBackground(lambda sg=slices[i]: self.retrieveFrameArray(selectedStudy, selectedSeries, sg, priority))
+               for i in previewIndices]
+    try:
+      for i, future in zip(previewIndices, futures):
+        slices[i]['Array'] = self.waitForFuture(future)
+    except Exception as exc:
+      logging.error('Failed to retrieve frames: %s' % str(exc))
+      for future in futures:
+        future.cancel()
+      return None
+
+    remainingIndices = [i for i in range(len(slices)) if 'Array' not in slices[i]]
+    previewSlices = mpReviewLogic.getPreviewSlices(slices, order)
+    volume = mpReviewLogic.createScalarVolumeNodeFromSlices(selectedSeries, previewSlices)
+    if volume is None:
+      return None
+    if remainingIndices:
+      volume.SetAttribute(mpReviewLogic.PREVIEW_ATTRIBUTE, 'true')
+      slicer.util.showStatusMessage('Showing a preview of series %s, loading the remaining slices' % selectedSeries, 5000)
+      self.completeVolumeInBackground(volume, selectedStudy, selectedSeries, slices, remainingIndices, priority)
+
+    mpReviewLogic.setVolumeDICOMReferences(volume, selectedSeries, [sg['SOPInstanceUID'] for sg in slices])
+    return volume
+
+  def completeVolumeInBackground(self, volume, selectedStudy, selectedSeries, slices, remainingIndices, priority,
+                                 maxAttempts=3):
+    """ Retrieve the slices missing from a preview volume and update its voxels in place
+        once all of them are available. Frames that fail are retried, if some are still
+        missing the series is loaded from the local database once archived instead. """
+    startTime = time.time()
+
+    def retrieveRemainingFrames():
+      for attempt in range(maxAttempts):
+        if attempt:
+          time.sleep(2**attempt)
+        missingIndices = [i for i in remainingIndices if 'Array' not in slices[i]]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+          futures = [(i, executor.submit(self.retrieveFrameArray, selectedStudy, selectedSeries, slices[i], priority))
+                     for i in missingIndices]
+        errors = [future.exception() for _, future in futures if future.exception() is not None]
+        for i, future in futures:
+          if future.exception() is None:
+            slices[i]['Array'] = future.result()
+        if not errors:
+          return
+        logging.warning('Failed to retrieve %i frame(s) of series %s: %s' % (len(errors), selectedSeries, str(errors[0])))
+      raise errors[0]
+
+    def onRemainingFramesRetrieved(future):
+      if volume.GetScene() is None:
+        # the volume was removed in the meantime
+        return
+      if future.exception() is not None:
+        logging.error('Failed to complete series %s: %s' % (selectedSeries, str(future.exception())))
+        self.completeVolumeFromLocalDatabase(volume, selectedStudy, selectedSeries)
+        return
+      order, _ = mpReviewLogic.getVolumeGeometryFromSlices(slices)
+      slicer.util.updateVolumeFromArray(volume, np.stack([slices[i]['Array'] for i in order]))
+      volume.RemoveAttribute(mpReviewLogic.PREVIEW_ATTRIBUTE)
+      logging.info('Series %s completed %.1f s after the preview was shown' % (selectedSeries, time.time()-startTime))
+
+    return self.runInBackground(retrieveRemainingFrames, onRemainingFramesRetrieved)
+
+  def completeVolumeFromLocalDatabase(self, volume, selectedStudy, selectedSeries):
+    """ Replace the voxels of a preview volume with the series loaded from the local
+        database, once it is archived """
+    slicer.util.showStatusMessage('Series %s is still a preview, loading it from the local database' % selectedSeries, 5000)
+
+    def onArchived(future):
+      if volume.GetScene() is None:
+        return
+      loadedVolume = None
+      if future.exception() is None:
+        try:
+          loadedVolume = self.loadVolumeFromLocalDatabase(selectedSeries)
+        except Exception as exc:
+          logging.error('Failed to load series %s from the local database: %s' % (selectedSeries, str(exc)))
+      if loadedVolume is None:
+        slicer.util.showStatusMessage('Series %s could not be completed and is only a preview' % selectedSeries)
+        return
+      volume.CopyOrientation(loadedVolume)
+      volume.SetAndObserveImageData(loadedVolume.GetImageData())
+      slicer.mrmlScene.RemoveNode(loadedVolume)
+      volume.RemoveAttribute(mpReviewLogic.PREVIEW_ATTRIBUTE)
+      slicer.util.showStatusMessage('Series %s completed' % selectedSeries, 5000)
+
+    # the completion callback of the archive (indexing) was registered first, so it has run by then
+    self.callWhenDone(self.archiveSeriesInBackground(selectedStudy, selectedSeries), onArchived)
+
+  @staticmethod
+  def getDatabaseStorageDirectory(selectedStudy, selectedSeries):
+    """ Directory where the DICOM database stores the files of the series """
+    return os.path.join(slicer.dicomDatabase.databaseDirectory, 'dicom', selectedStudy, selectedSeries)
+
+  @staticmethod
+  def getPartialFileDirectory():
+    """ Directory for files being downloaded, outside of the tree indexed from the database
+        storage, on the same file system so that finished files can be renamed into it """
+    return os.path.join(slicer.dicomDatabase.databaseDirectory, 'mpReviewPartial')
+
+  def retrieveInstanceToDatabaseStorage(self, client, selectedStudy, selectedSeries, sopInstanceUid, transferSyntaxUIDs=None):
+    """ Stream a retrieved instance to its final location in the database storage, without
+        parsing it. The file is written to the partial file directory and renamed once
+        complete, so that a truncated file is never found when the storage is indexed. """
+    storageDirectory = self.getDatabaseStorageDirectory(selectedStudy, selectedSeries)
+    partialDirectory = self.getPartialFileDirectory()
+    for directory in [storageDirectory, partialDirectory]:
+      if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    fileName = os.path.join(storageDirectory, sopInstanceUid)
+    partialFileName = os.path.join(partialDirectory, sopInstanceUid+'-'+uuid.uuid4().hex+'.part')
+    try:
+      client.retrieve_instance_to_file(selectedStudy, selectedSeries, sopInstanceUid, partialFileName, transferSyntaxUIDs)
+      os.replace(partialFileName, fileName)
+    except Exception:
+      if os.path.exists(partialFileName):
+        os.remove(partialFileName)
+      raise
+    return fileName
+
+  @staticmethod
+  def indexDatabaseStorageDirectory(storageDirectory):
+    """ Register the files of a storage directory in the DICOM database in place (no copy) """
+    indexer = ctk.ctkDICOMIndexer()
+    indexer.addDirectory(slicer.dicomDatabase, storageDirectory, False)  # index without file copy
+    indexer.waitForImportFinished()
+
+  def retrieveCompressedInstanceToDatabaseStorage(self, client, selectedStudy, selectedSeries, sopInstanceUid):
+    """ Retrieve an instance in a lossless compressed transfer syntax if the server supports it.
+        Whether the server does is found with the first retrieval and kept in the metadata
+        cache for a week. Instances the server refuses to compress are retrieved uncompressed. """
+    metadataCache = self.getMetadataCache()
+    serverUrl = client.base_url
+    supported = metadataCache.getServerCapability(serverUrl, 'CompressedTransferSyntaxes', 7*24*3600)
+    if supported != 'false':
+      try:
+        fileName = self.retrieveInstanceToDatabaseStorage(client, selectedStudy, selectedSeries, sopInstanceUid,
+                                                          mpReviewLogic.COMPRESSED_TRANSFER_SYNTAX_UIDS)
+        if supported is None:
+          metadataCache.setServerCapability(serverUrl, 'CompressedTransferSyntaxes', 'true')
+        return fileName
+      except Exception as exc:
+        # only a refused media type negotiation tells that the server cannot compress,
+        # other errors (timeouts, authorization, truncated responses) are not recorded
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+        if status not in (400, 406, 415):
+          raise
+        if supported is None:
+          logging.info('%s does not provide compressed transfer syntaxes (%s)' % (serverUrl, str(exc)))
+          metadataCache.setServerCapability(serverUrl, 'CompressedTransferSyntaxes', 'false')
+    return self.retrieveInstanceToDatabaseStorage(client, selectedStudy, selectedSeries, sopInstanceUid)
+
+  def downloadSeriesInstances(self, selectedStudy, selectedSeries, instancesAlreadyInDatabase, priority=None):
+    """ Retrieve the instances of the series that are not in the local database and
+        write them to the database storage. Safe to run on a worker thread. """
+    if priority is None:
+      priority = self.getSeriesPriority(selectedSeries, self.refSeriesNumber)
+    client = self.DICOMwebClient.withPriority(priority)
+    storageDirectory = self.getDatabaseStorageDirectory(selectedStudy, selectedSeries)
+    instances = client.search_for_instances(study_instance_uid=selectedStudy,
+                                            series_instance_uid=selectedSeries)
+    fileNames = []
+    for instance in instances:
       sopInstanceUid = self.getTagValue(instance, 'SOPInstanceUID')
       if sopInstanceUid in instancesAlreadyInDatabase:
-        # instance is already in database
         continue
-      fileName = os.path.join(downloadDirectory, hashlib.md5(sopInstanceUid.encode()).hexdigest() + '.dcm')
-      # If the sopinstanceUid is not not already downloaded, download the file 
+      fileName = os.path.join(storageDirectory, sopInstanceUid)
       if not os.path.isfile(fileName):
-        retrievedInstance = self.DICOMwebClient.retrieve_instance(
-                                    study_instance_uid=selectedStudy,
-                                    series_instance_uid=selectedSeries,
-                                    sop_instance_uid=sopInstanceUid)
-        # Write the file to the tmp folder 
-        pydicom.filewriter.write_file(fileName, retrievedInstance)
-    # print ('retrieve_instance(s) in remote database')
-        
-    # Now add the directory to the DICOM database
-    print ('adding the directory to the DICOM database')
-    files_saved = [f for f in os.listdir(downloadDirectory) if f.endswith('.dcm')]
-    if files_saved: 
-      print('add directory')
-      indexer.addDirectory(slicer.dicomDatabase, downloadDirectory, True)  # index with file copy
-      
-      print('indexer wait for import to finish')
-      indexer.waitForImportFinished()
-      print('slicer process events')
+        fileName = self.retrieveCompressedInstanceToDatabaseStorage(client, selectedStudy, selectedSeries, sopInstanceUid)
+      fileNames.append(fileName)
+    return fileNames
+
+  def archiveSeriesInBackground(self, selectedStudy, selectedSeries):
+    """ Add the series to the local DICOM database without blocking the GUI """
+    if selectedSeries in self.pendingArchives:
+      return self.pendingArchives[selectedSeries]
+
+    instancesAlreadyInDatabase = set(slicer.dicomDatabase.instancesForSeries(selectedSeries))
+
+    def onArchiveDownloaded(future):
+      try:
+        if future.exception() is not None:
+          logging.error('Failed to archive series %s: %s' % (selectedSeries, str(future.exception())))
+          return
+        if future.result():
+          self.indexDatabaseStorageDirectory(self.getDatabaseStorageDirectory(selectedStudy, selectedSeries))
+      finally:
+        self.pendingArchives.pop(selectedSeries, None)
+
+    future = self.runInBackground(lambda: self.downloadSeriesInstances(selectedStudy, selectedSeries,
+                                                                       instancesAlreadyInDatabase,
+                                                                       mpReviewRequestScheduler.BACKGROUND),
+                                  onArchiveDownloaded, self.archiveExecutor)
+    self.pendingArchives[selectedSeries] = future
+    return future
+
+  def ensureSeriesArchived(self, selectedStudy, selectedSeries):
+    """ Make sure all instances of the series are in the local DICOM database """
+    future = self.pendingArchives.get(selectedSeries)
+    if future is None:
+      future = self.archiveSeriesInBackground(selectedStudy, selectedSeries)
+    try:
+      self.waitForFuture(future)
+    except Exception:
+      pass
+    # run the completion callback (indexing) right away
+    self.onBackgroundTimer()
+
+  def importVolumeFromRemoteDatabase(self, selectedStudy, selectedSeries, priority=None):
+    """ Load a series from a remote DICOM server through the local DICOM database """
+
+    # The instances that are already in the DICOM database, no need to download
+    instancesAlreadyInDatabase = slicer.dicomDatabase.instancesForSeries(selectedSeries)
+
+    # Download the instances that are not in the DICOM database straight to the
+    # database storage, so that every retrieved file is written only once
+    print ('********** Downloading instances for volumes from remote database *********')
+    fileNames = self.downloadSeriesInstances(selectedStudy, selectedSeries, instancesAlreadyInDatabase, priority)
+
+    # Now register the downloaded files in the DICOM database
+    if fileNames:
+      print ('adding the downloaded files to the DICOM database')
+      self.indexDatabaseStorageDirectory(self.getDatabaseStorageDirectory(selectedStudy, selectedSeries))
       slicer.app.processEvents()
-    
-    # Now delete the files from the temporary directory 
-    print('delete the files from the temporary directory')
-    for f in os.listdir(downloadDirectory):
-      os.remove(os.path.join(downloadDirectory, f))
-    # Delete the temporary directory 
-    os.rmdir(downloadDirectory)
-    
+
     # Now load the newly added files 
     print ('load the newly added files')
     fileList = slicer.dicomDatabase.filesForSeries(selectedSeries)
@@ -2038,6 +2645,9 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     self.labelNodes = {}
     selectedSeriesNumbers = []
     self.refSeriesNumber = '-1'
+    self.frameCache.clear()
+    self.residencyManager.clear()
+    self.layoutController.reset()
 
     logging.debug('Checked items:')
     ref = None
@@ -2054,6 +2664,12 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     # ignore refSelector events until the selector is populated!
     self.refSelectorIgnoreUpdates = True
 
+    # the reference is only chosen once the series are loaded, the series that will
+    # most likely be chosen (as by the heuristic below) is retrieved first
+    intendedReference = next((uid for uid in checkedItemsUIDs
+                              if 'T2' in self.seriesMap[uid]['ShortName'] and 'AX' in self.seriesMap[uid]['ShortName']),
+                             checkedItemsUIDs[0] if checkedItemsUIDs else None)
+
     # Loading progress indicator
     progress = self.createProgressDialog(maximum=len(checkedItems))
     nLoaded = 0
@@ -2084,7 +2700,8 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
         # print ('Loading volume from remote DICOM server')
         studyInstanceUID = self.selectedStudyNumber
         # seriesInstanceUID = self.seriesMap[seriesNumber]['seriesInstanceUID']
-        volume = self.loadVolumeFromRemoteDatabase(studyInstanceUID, seriesInstanceUID)
+        volume = self.loadVolumeFromRemoteDatabase(studyInstanceUID, seriesInstanceUID,
+                                                   self.getSeriesPriority(seriesInstanceUID, intendedReference))
       
       if volume.GetClassName() == 'vtkMRMLScalarVolumeNode':
         self.seriesMap[seriesInstanceUID]['Volume'] = volume
@@ -2199,6 +2816,20 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       self.crosshairNode.SetCrosshairMode(slicer.vtkMRMLCrosshairNode.NoCrosshair)
 
   
+  def loadDICOMSegmentation(self, fileName, ref):
+    """Load the SEG file as the segmentation of the reference series. The SEG is read
+    directly when possible, through the DICOMSegmentationPlugin otherwise."""
+    referenceVolumeNode = self.seriesMap[str(ref)].get('Volume')
+    segmentationNode = self.logic.loadDICOMSegmentation(fileName, referenceVolumeNode)
+    if segmentationNode is None:
+      plugin = slicer.modules.dicomPlugins['DICOMSegmentationPlugin']()
+      loadables = plugin.examineFiles([fileName])
+      plugin.load(loadables[0])
+      # there should only be 1 node in the scene
+      segmentationNode = slicer.util.getNodesByClass('vtkMRMLSegmentationNode')[0]
+    self.seriesMap[str(ref)]['Label'] = segmentationNode
+    return segmentationNode
+
   def getLatestDICOMSEG(self): 
     '''From the reference series number, find the corresponding labels from the 
        DICOM database. Choose the latest one and load that segmentation. '''
@@ -2226,7 +2857,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     # that matches the self.refSeriesNumber 
     seg_fileNames = [] 
     for fileName in fileNames:  
-      dcm = pydicom.dcmread(fileName)
+      dcm = pydicom.dcmread(fileName, stop_before_pixels=True)
       # check if Modality is SEG, then check ReferencedSeriesSequence
       if (dcm.Modality == "SEG"):
         # get referencedSeriesInstanceUID 
@@ -2257,30 +2888,11 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     #   slicer.mrmlScene.RemoveNode(seg_node)
     # seg_nodes_already_exist = None
     # nodes = None
-    for i in range(slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLSegmentationNode')):
-      node = slicer.mrmlScene.GetNthNodeByClass(0, 'vtkMRMLSegmentationNode')
-      node.UnRegister(slicer.mrmlScene)
-      slicer.mrmlScene.RemoveNode(node)
+    self.logic.removeNodesByClass(['vtkMRMLSegmentationNode'])
     
     # Load the segmentation file if present
     if fileName_load: 
-      
-      DICOMSegmentationPlugin = slicer.modules.dicomPlugins['DICOMSegmentationPlugin']()
-      # loadables = DICOMSegmentationPlugin.examineFiles([fileName])
-      loadables = DICOMSegmentationPlugin.examineFiles([fileName_load])
-      DICOMSegmentationPlugin.load(loadables[0])
-      
-      # there should only be 1 node in the scene 
-      seg_nodes = slicer.util.getNodesByClass("vtkMRMLSegmentationNode")
-      # slicer.mrmlScene.getNodesByClass("vtkMRMLSegmentationNode").UnRegister(None)
-      nodes = slicer.mrmlScene.GetNodesByClass('vtkMRMLSegmentationNode')
-      nodes.UnRegister(slicer.mrmlScene)
-      seg_node = seg_nodes[0] 
-      seriesDescription = seg_node.GetName() 
-      refLabel = slicer.util.getNode(seriesDescription)
-      self.seriesMap[str(ref)]['Label'] = refLabel 
-      seg_nodes = None
-      nodes = None
+      self.loadDICOMSegmentation(fileName_load, ref)
     
     return True  
   
@@ -2288,8 +2900,6 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     '''From the reference series number, find the corresponding labels from the 
        remote server. Choose the latest one and load that segmentation. '''
         
-    indexer = ctk.ctkDICOMIndexer()  
-        
     # ref = int(self.refSeriesNumber) 
     ref = self.refSeriesNumber # the SeriesInstanceUID 
     print('ref: ' + str(ref))
@@ -2307,15 +2917,17 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     ContentCreatorTime_list = [] 
     sopInstanceUIDs_list = [] 
     
-    for series in self.seriesList:  
-      # Get the metadata to check 
-      seriesInstanceUID = self.getTagValue(series, 'SeriesInstanceUID')
-      metadata = self.DICOMwebClient.retrieve_series_metadata(study_instance_uid=studyInstanceUID,
-                                                              series_instance_uid=seriesInstanceUID
-                                                              )
-      # Get the Modality and check if SEG, if so, do the next 
-      modality = self.getTagValue(metadata[0], 'Modality')
-      if (modality == "SEG"):
+    # a SEG may have been stored since the series were listed (by a queued upload,
+    # or by another reader), so the series of the study are always queried again
+    remoteSeries = self.getRemoteSeries(studyInstanceUID, revalidate=True)
+    
+    for series, cachedMetadata in remoteSeries:  
+      # Check the cached Modality, the full metadata is only retrieved for SEG series
+      if self.getTagValue(cachedMetadata[0], 'Modality') == "SEG":
+        seriesInstanceUID = self.getTagValue(series, 'SeriesInstanceUID')
+        metadata = self.DICOMwebClient.retrieve_series_metadata(study_instance_uid=studyInstanceUID,
+                                                                series_instance_uid=seriesInstanceUID
+                                                                )
         # Get the referencedSeriesSequence and check if it matches ref 
         referencedSeriesSequence = self.getTagValue(metadata[0], 'ReferencedSeriesSequence') # check this
         print('referencedSeriesSequence: ' + str(referencedSeriesSequence))
@@ -2349,17 +2961,11 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     
     print ('******** Getting the matching DICOM SEG instance from remote *********')
     
-    # Retrieve the instance using the DICOM web client  
-    retrievedInstance = self.DICOMwebClient.retrieve_instance(study_instance_uid=studyInstanceUID,
-                                                              series_instance_uid=seriesInstanceUID, 
-                                                              sop_instance_uid=sopInstanceUID)
     # Save to here for now 
     db = slicer.dicomDatabase
     # labelSeries = label.GetName().split(':')[0] # fix 
     labelSeries = str(ref) # should be right 
   
-    segmentationsDir = os.path.join(slicer.dicomDatabase.databaseDirectory, 'tmp') 
-    self.logic.createDirectory(segmentationsDir)
     
     ### added ###
     # # remove the previous seg nodes with the same name before loading in the latest one.
@@ -2374,54 +2980,21 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
     #   slicer.mrmlScene.RemoveNode(seg_node)
     # seg_nodes_already_exist = None
     # nodes = None
-    for i in range(slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLSegmentationNode')):
-      node = slicer.mrmlScene.GetNthNodeByClass(0, 'vtkMRMLSegmentationNode')
-      node.UnRegister(slicer.mrmlScene)
-      slicer.mrmlScene.RemoveNode(node)
+    self.logic.removeNodesByClass(['vtkMRMLSegmentationNode'])
     
     #############
     
     
-    # Write the SEG file 
-    import DICOMSegmentationPlugin 
-    exporter = DICOMSegmentationPlugin.DICOMSegmentationPluginClass()
-    fileName = os.path.join(segmentationsDir, 'subject_hierarchy_export.SEG'+exporter.currentDateTime+".dcm")
-    # import pydicom 
-    pydicom.filewriter.write_file(fileName, retrievedInstance)
-    
-    # Add the tmp directory to the local DICOM database 
-    indexer.addDirectory(slicer.dicomDatabase, segmentationsDir, True)  # index with file copy
-    indexer.waitForImportFinished()
-    
-    # Now delete the files from the temporary directory 
-    for f in os.listdir(segmentationsDir):
-      os.remove(os.path.join(segmentationsDir, f))
-    # Delete the temporary directory 
-    os.rmdir(segmentationsDir)
+    # Retrieve the SEG file straight to the database storage and register it in place 
+    self.retrieveInstanceToDatabaseStorage(self.DICOMwebClient, studyInstanceUID, seriesInstanceUID, sopInstanceUID)
+    self.indexDatabaseStorageDirectory(self.getDatabaseStorageDirectory(studyInstanceUID, seriesInstanceUID))
     
-    # Now need to load the DICOM SEG from the local DICOM database, and not 
-    # from the file that was just saved out and deleted
+    # Now load the DICOM SEG from the local DICOM database 
     fileList = slicer.dicomDatabase.filesForSeries(seriesInstanceUID)
     fileName = fileList[0]
   
     # Load the SEG file 
-    loadables = exporter.examineFiles([fileName])
-    exporter.load(loadables[0])
-    
-     # there should only be 1 node in the scene 
-    seg_nodes = slicer.util.getNodesByClass("vtkMRMLSegmentationNode")
-    # slicer.mrmlScene.getNodesByClass("vtkMRMLSegmentationNode").UnRegister(None)
-    nodes = slicer.mrmlScene.GetNodesByClass('vtkMRMLSegmentationNode')
-    nodes.UnRegister(slicer.mrmlScene)
-    
-    seg_node = seg_nodes[0] 
-    seriesDescription = seg_node.GetName() 
-    refLabel = slicer.util.getNode(seriesDescription)
-    self.seriesMap[str(ref)]['Label'] = refLabel
-    
-    seg_nodes = None
-    nodes = None
-    refLabel = None
+    self.loadDICOMSegmentation(fileName, ref)
  
     
     return True
@@ -2429,7 +3002,7 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
   def onReferenceChanged(self, id):
     # TODO: when None is selected, viewers and editor should be resetted
     self.labelMapVisibilityButton.checked = False
-    if self.refSelectorIgnoreUpdates:
+    if self.refSelectorIgnoreUpdates or self.isWaiting():
       return
     text = self.refSelector.currentText
     eligible = text not in ["", "None"]
@@ -2446,6 +3019,9 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
 
     logging.debug('Reference series selected: '+str(ref))
 
+    # the reference (and all series, in the view all layout) must be loaded before the views are set up
+    self.updateSeriesResidency()
+
     # volume nodes ordered by series number
     seriesNumbers = [x for x in self.seriesMap.keys()]
     #seriesNumbers.sort()
@@ -2477,7 +3053,6 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       self.seriesMap[ref]['Label'] = refLabel
 
     logging.debug('Volume nodes: '+str(self.viewNames))
-    self.cvLogic = CompareVolumes.CompareVolumesLogic()
 
     nVolumeNodes = float(len(self.volumeNodes))
     self.rows = 0
@@ -2505,12 +3080,8 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
       segment.SetTag(slicer.vtkSegment.GetTerminologyEntryTagName(),
                      self.editorWidget.defaultTerminologyEntry)
 
-    self.cvLogic.viewerPerVolume(self.volumeNodes, background=self.volumeNodes[0], label=refLabel,
-                                 layout=[self.rows,self.cols],viewNames=self.sliceNames,
-                                 orientation=self.currentOrientation)
-    
-    appLogic = slicer.app.applicationLogic()
-    appLogic.FitSliceToAll(True, False)
+    self.layoutController.showVolumes(self.volumeNodes, refLabel, [self.rows,self.cols],
+                                      self.sliceNames, self.currentOrientation)
 
     # Make sure redslice has the ref image (the others were set with viewerPerVolume)
     redSliceWidget = self.layoutManager.sliceWidget('Red')
@@ -2534,23 +3105,6 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
 
     self.multiVolumeExplorer.refreshObservers()
     logging.debug('Exiting onReferenceChanged')
-    
-    # Added
-    # Link the slice views
-    # links the scrolling, but not the zoom and pan 
-    sliceCompositeNodes = slicer.util.getNodesByClass("vtkMRMLSliceCompositeNode")
-    # slicer.mrmlScene.getNodesByClass("vtkMRMLSliceCompositeNode").UnRegister(None)
-    nodes = slicer.mrmlScene.GetNodesByClass('vtkMRMLSliceCompositeNode')
-    nodes.UnRegister(slicer.mrmlScene)
-    for sliceCompositeNode in sliceCompositeNodes:
-      sliceCompositeNode.HotLinkedControlOn()
-      sliceCompositeNode.LinkedControlOn()
-      # sliceCompositeNode.SetHotLinkedControl(True)
-      # sliceCompositeNode.SetLinkedControl(True)
-    
-    sliceCompositeNodes = None
-    nodes = None 
-
 
     return
 
@@ -2582,17 +3136,20 @@ class mpReviewWidget(ScriptedLoadableModuleWidget, ModuleWidgetMixin):
 
   def onSliderChanged(self, newValue):
     newValue = int(newValue)
-    seriesNumber = self.multiVolumeExplorer.getCurrentSeriesNumber()
     seriesInstanceUID = self.multiVolumeExplorer.getCurrentSeriesInstanceUID()
-    # if seriesNumber in self.seriesMap.keys():
     if seriesInstanceUID in self.seriesMap.keys():
-      multiVolumeNode = self.seriesMap[seriesNumber]['MultiVolume']
-      scalarVolumeNode = MVHelper.extractFrame(self.seriesMap[seriesNumber]['Volume'],
-                                                               multiVolumeNode,
-                                                               newValue)
+      self.residencyManager.pageInSeries(self.seriesMap[seriesInstanceUID])
+      multiVolumeNode = self.seriesMap[seriesInstanceUID]['MultiVolume']
+      scalarVolumeNode = self.seriesMap[seriesInstanceUID]['Volume']
+      if scalarVolumeNode is None or scalarVolumeNode.GetImageData() is None:
+        scalarVolumeNode = MVHelper.extractFrame(scalarVolumeNode, multiVolumeNode, newValue)
+      else:
+        # frames are cached, and the displayed volume shares the cached buffer
+        frameArray = self.frameCache.getFrame(multiVolumeNode, newValue)
+        mpReviewLogic.setVolumeScalarsFromArray(scalarVolumeNode, frameArray)
       scalarVolumeNode.SetName(multiVolumeNode.GetName().split('_multivolume')[0])
-      self.seriesMap[seriesNumber]['Volume'] = scalarVolumeNode
-      self.seriesMap[seriesNumber]['FrameNumber'] = newValue
+      self.seriesMap[seriesInstanceUID]['Volume'] = scalarVolumeNode
+      self.seriesMap[seriesInstanceUID]['FrameNumber'] = newValue
       multiVolumeNode.GetDisplayNode().SetFrameComponent(newValue)
 
   def getCreatedStructures(self):
@@ -2645,6 +3202,19 @@ class mpReviewLogic(ScriptedLoadableModuleLogic):
   requiring an instance of the Widget
   """
 
+  # node attribute of volumes that only hold the preview slices of a series, set
+  # until the remaining slices are filled in
+  PREVIEW_ATTRIBUTE = 'mpReview.Preview'
+
+  # Lossless compressed transfer syntaxes requested for instances, in order of preference:
+  # JPEG-LS lossless, JPEG 2000 lossless, deflated explicit VR little endian
+  COMPRESSED_TRANSFER_SYNTAX_UIDS = ['1.2.840.10008.1.2.4.80',
+                                     '1.2.840.10008.1.2.4.90',
+                                     '1.2.840.10008.1.2.1.99']
+
+  # returned instead of a DICOM SEG dataset when all segments are empty
+  EMPTY_SEGMENTATION = 'EmptySegmentation'
+
   @staticmethod
   def wasmpReviewPreprocessed(directory):
     return len(mpReviewLogic.getStudyNames(directory)) > 0
@@ -2906,6 +3476,666 @@ class mpReviewLogic(ScriptedLoadableModuleLogic):
     formatted = datetime.date(int(extractedDate[0:4]), int(extractedDate[4:6]), int(extractedDate[6:8]))
     return formatted.strftime("%Y-%b-%d")
 
+  @staticmethod
+  def getMultipartBoundary(contentType):
+    """Boundary parameter of a multipart content type, None for single part content"""
+    if not contentType.lower().startswith('multipart/'):
+      return None
+    for parameter in contentType.split(';')[1:]:
+      name, _, value = parameter.strip().partition('=')
+      if name.lower() == 'boundary':
+        return value.strip('"').encode()
+    raise ValueError('multipart response without boundary: ' + contentType)
+
+  @staticmethod
+  def writeResponseBody(response, fileName, chunkSize=1024*1024):
+    """Write the body of a streamed requests response to fileName. For a multipart
+    response only the content of the first part is written. The body is processed
+    chunk by chunk and is never held in memory as a whole."""
+    boundary = mpReviewLogic.getMultipartBoundary(response.headers.get('Content-Type', ''))
+    with open(fileName, 'wb') as f:
+      if boundary is None:
+        for chunk in response.iter_content(chunkSize):
+          f.write(chunk)
+        return
+      delimiter = b'\r\n--' + boundary
+      buffer = b''
+      inPart = False
+      for chunk in response.iter_content(chunkSize):
+        buffer += chunk
+        if not inPart:
+          # skip the first boundary line and the part headers
+          start = buffer.find(b'--' + boundary)
+          headersEnd = buffer.find(b'\r\n\r\n', start) if start >= 0 else -1
+          if headersEnd < 0:
+            continue
+          buffer = buffer[headersEnd+4:]
+          inPart = True
+        end = buffer.find(delimiter)
+        if end >= 0:
+          f.write(buffer[:end])
+          return
+        # keep enough bytes to find a delimiter split across chunks
+        keep = len(delimiter)-1
+        if len(buffer) > keep:
+          f.write(buffer[:-keep])
+          buffer = buffer[-keep:]
+    raise IOError('incomplete multipart response for ' + fileName)
+
+  @staticmethod
+  def applyRescale(array, sliceGeometry):
+    """Apply the rescale slope/intercept of the slice to its stored values"""
+    slope = sliceGeometry.get('RescaleSlope', 1.)
+    intercept = sliceGeometry.get('RescaleIntercept', 0.)
+    if slope != 1. or intercept != 0.:
+      array = (array*slope+intercept).astype(np.float32)
+    return array
+
+  @staticmethod
+  def frameBytesToArray(frameBytes, sliceGeometry):
+    """Convert uncompressed frame bytes to a 2D array, applying the rescale slope/intercept"""
+    bitsAllocated = sliceGeometry['BitsAllocated']
+    signed = sliceGeometry['PixelRepresentation'] == 1
+    dtype = np.dtype(('i' if signed else 'u') + str(bitsAllocated // 8)).newbyteorder('<')
+    array = np.frombuffer(frameBytes, dtype=dtype, count=sliceGeometry['Rows']*sliceGeometry['Columns'])
+    array = array.reshape(sliceGeometry['Rows'], sliceGeometry['Columns'])
+    return mpReviewLogic.applyRescale(array, sliceGeometry)
+
+  @staticmethod
+  def decodePixelArray(fileName, sliceGeometry):
+    """Decode the pixel data of a single-frame file with the pydicom pixel data handlers"""
+    dataset = pydicom.dcmread(fileName)
+    array = dataset.pixel_array
+    if array.shape != (sliceGeometry['Rows'], sliceGeometry['Columns']):
+      raise ValueError('unexpected pixel array shape %s in %s' % (str(array.shape), fileName))
+    return mpReviewLogic.applyRescale(array, sliceGeometry)
+
+  @staticmethod
+  def getSliceGeometryFromDataset(dataset):
+    """Same as mpReviewWidget.getSliceGeometryFromMetadata, for a pydicom dataset"""
+    try:
+      if int(dataset.get('NumberOfFrames', 1) or 1) != 1 or int(dataset.get('SamplesPerPixel', 1) or 1) != 1:
+        return None
+      return {'SOPInstanceUID': str(dataset.SOPInstanceUID),
+              'ImagePositionPatient': [float(v) for v in dataset.ImagePositionPatient],
+              'ImageOrientationPatient': [float(v) for v in dataset.ImageOrientationPatient],
+              'PixelSpacing': [float(v) for v in dataset.PixelSpacing],
+              'Rows': int(dataset.Rows),
+              'Columns': int(dataset.Columns),
+              'BitsAllocated': int(dataset.BitsAllocated),
+              'PixelRepresentation': int(dataset.get('PixelRepresentation', 0) or 0),
+              'RescaleSlope': float(dataset.get('RescaleSlope', 1.) or 1.),
+              'RescaleIntercept': float(dataset.get('RescaleIntercept', 0.) or 0.)}
+    except (AttributeError, TypeError, ValueError):
+      return None
+
+  @staticmethod
+  def setVolumeDICOMReferences(volumeNode, seriesInstanceUID, instanceUIDs):
+    """Set the subject hierarchy DICOM UIDs the DICOM plugins set on the volumes they load"""
+    shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+    volumeShItemID = shNode.GetItemByDataNode(volumeNode)
+    shNode.SetItemUID(volumeShItemID, 'DICOM', seriesInstanceUID)
+    shNode.SetItemAttribute(volumeShItemID, 'DICOM.instanceUIDs', ' '.join(instanceUIDs))
+
+  @staticmethod
+  def getVolumeGeometryFromSlices(slices, tolerance=1e-3):
+    """Return (slice order, IJKToRAS matrix as numpy array) for the slices, None if they
+    do not form a single regular volume (for example several frames per position, as in
+    a multivolume). Each slice is a dictionary with ImagePositionPatient,
+    ImageOrientationPatient, PixelSpacing, Rows and Columns."""
+    if not len(slices):
+      return None
+    first = slices[0]
+    orientation = np.array(first['ImageOrientationPatient'], dtype=float)
+    spacing = np.array(first['PixelSpacing'], dtype=float)
+    for s in slices:
+      if s['Rows'] != first['Rows'] or s['Columns'] != first['Columns'] or \
+         not np.allclose(s['ImageOrientationPatient'], orientation, atol=tolerance) or \
+         not np.allclose(s['PixelSpacing'], spacing, atol=tolerance):
+        return None
+    rowDirection = orientation[:3]
+    columnDirection = orientation[3:]
+    normal = np.cross(rowDirection, columnDirection)
+    positions = np.array([s['ImagePositionPatient'] for s in slices], dtype=float)
+    distances = positions.dot(normal)
+    order = np.argsort(distances)
+    sliceSpacing = 1.
+    if len(slices) > 1:
+      gaps = np.diff(distances[order])
+      sliceSpacing = float(np.median(gaps))
+      if np.any(gaps < tolerance) or np.any(np.abs(gaps-sliceSpacing) > max(tolerance, 0.01*sliceSpacing)):
+        return None
+    return order, mpReviewLogic.getIJKToRASMatrix(orientation, spacing, sliceSpacing, positions[order[0]])
+
+  @staticmethod
+  def getIJKToRASMatrix(orientation, pixelSpacing, sliceSpacing, origin):
+    """IJKToRAS matrix (numpy array) of a volume with the given DICOM ImageOrientationPatient,
+    PixelSpacing and ImagePositionPatient of the first slice"""
+    orientation = np.array(orientation, dtype=float)
+    rowDirection = orientation[:3]
+    columnDirection = orientation[3:]
+    # PixelSpacing is (row spacing, column spacing), i moves along the row direction
+    ijkToLPS = np.eye(4)
+    ijkToLPS[:3,0] = rowDirection*pixelSpacing[1]
+    ijkToLPS[:3,1] = columnDirection*pixelSpacing[0]
+    ijkToLPS[:3,2] = np.cross(rowDirection, columnDirection)*sliceSpacing
+    ijkToLPS[:3,3] = origin
+    return np.diag([-1., -1., 1., 1.]).dot(ijkToLPS)
+
+  @staticmethod
+  def getFunctionalGroup(dataset, frameIndex, sequenceName):
+    """Item of the functional group sequence of a frame of a multi-frame dataset, from the
+    per-frame functional groups if present there, from the shared ones otherwise"""
+    perFrame = dataset.PerFrameFunctionalGroupsSequence[frameIndex]
+    if sequenceName in perFrame:
+      return getattr(perFrame, sequenceName)[0]
+    return getattr(dataset.SharedFunctionalGroupsSequence[0], sequenceName)[0]
+
+  @staticmethod
+  def unpackSegmentationFrames(dataset):
+    """All frames of a DICOM SEG as a (frames, rows, columns) uint8 array, with values 0/1
+    for BINARY and 0..MaximumFractionalValue for FRACTIONAL segmentations"""
+    frameCount = int(dataset.get('NumberOfFrames', 1) or 1)
+    rows, columns = int(dataset.Rows), int(dataset.Columns)
+    if dataset.file_meta.TransferSyntaxUID.is_compressed:
+      return dataset.pixel_array.reshape(frameCount, rows, columns).astype(np.uint8)
+    pixelData = np.frombuffer(dataset.PixelData, dtype=np.uint8)
+    if int(dataset.BitsAllocated) == 1:
+      # binary frames are packed back to back, they do not start on a byte boundary
+      pixelData = np.unpackbits(pixelData, count=frameCount*rows*columns, bitorder='little')
+    return pixelData[:frameCount*rows*columns].reshape(frameCount, rows, columns)
+
+  @staticmethod
+  def dicomLabToRGB(dicomLab):
+    """RGB color (0..1) of a DICOM scaled CIELab value, as in RecommendedDisplayCIELabValue"""
+    L = dicomLab[0]*100./65535.
+    a = dicomLab[1]*255./65535.-128.
+    b = dicomLab[2]*255./65535.-128.
+    fy = (L+16.)/116.
+    f = np.array([fy+a/500., fy, fy-b/200.])
+    xyz = np.where(f > 6./29., f**3, 3.*(6./29.)**2*(f-4./29.))*np.array([0.950456, 1., 1.088754])
+    linearRGB = np.array([[3.2404542, -1.5371385, -0.4985314],
+                          [-0.9692660, 1.8760108, 0.0415560],
+                          [0.0556434, -0.2040259, 1.0572252]]).dot(xyz)
+    rgb = np.where(linearRGB > 0.0031308, 1.055*np.power(np.maximum(linearRGB, 0.0031308), 1/2.4)-0.055, 12.92*linearRGB)
+    return np.clip(rgb, 0., 1.).tolist()
+
+  @staticmethod
+  def getSegmentTerminologyEntry(segmentItem):
+    """Terminology entry tag of a segment, in the format used by the Slicer terminologies,
+    from the codes of a SegmentSequence item"""
+    def code(sequenceName, item=segmentItem):
+      if sequenceName not in item or not len(getattr(item, sequenceName)):
+        return '^^'
+      codeItem = getattr(item, sequenceName)[0]
+      return '%s^%s^%s' % (codeItem.CodingSchemeDesignator, codeItem.CodeValue, codeItem.CodeMeaning)
+    typeModifier = '^^'
+    if 'SegmentedPropertyTypeCodeSequence' in segmentItem and len(segmentItem.SegmentedPropertyTypeCodeSequence):
+      typeModifier = code('SegmentedPropertyTypeModifierCodeSequence', segmentItem.SegmentedPropertyTypeCodeSequence[0])
+    regionModifier = '^^'
+    if 'AnatomicRegionSequence' in segmentItem and len(segmentItem.AnatomicRegionSequence):
+      regionModifier = code('AnatomicRegionModifierSequence', segmentItem.AnatomicRegionSequence[0])
+    return '~'.join(['Segmentation category and type - DICOM master list',
+                     code('SegmentedPropertyCategoryCodeSequence'),
+                     code('SegmentedPropertyTypeCodeSequence'), typeModifier,
+                     'Anatomic codes - DICOM master list',
+                     code('AnatomicRegionSequence'), regionModifier])
+
+  @staticmethod
+  def rgbToDICOMLab(rgb):
+    """DICOM scaled CIELab value of an RGB color (0..1), inverse of dicomLabToRGB"""
+    rgb = np.clip(np.array(rgb[:3], dtype=float), 0., 1.)
+    linearRGB = np.where(rgb > 0.04045, np.power((rgb+0.055)/1.055, 2.4), rgb/12.92)
+    xyz = np.array([[0.4124564, 0.3575761, 0.1804375],
+                    [0.2126729, 0.7151522, 0.0721750],
+                    [0.0193339, 0.1191920, 0.9503041]]).dot(linearRGB)/np.array([0.950456, 1., 1.088754])
+    f = np.where(xyz > (6./29.)**3, np.cbrt(xyz), xyz/(3.*(6./29.)**2)+4./29.)
+    lab = [116.*f[1]-16., 500.*(f[0]-f[1]), 200.*(f[1]-f[2])]
+    return [int(round(np.clip(lab[0], 0., 100.)*65535./100.)),
+            int(round(np.clip(lab[1]+128., 0., 255.)*65535./255.)),
+            int(round(np.clip(lab[2]+128., 0., 255.)*65535./255.))]
+
+  @staticmethod
+  def getSegmentCodes(segment):
+    """Codes of the terminology entry tag of a segment, as (CodingSchemeDesignator, CodeValue,
+    CodeMeaning) for Category, Type, TypeModifier, Region and RegionModifier, None if not set"""
+    entry = vtk.mutable('')
+    segment.GetTag(slicer.vtkSegment.GetTerminologyEntryTagName(), entry)
+    fields = str(entry).split('~')
+    if len(fields) < 7:
+      fields = ['']*7
+    def code(field):
+      values = field.split('^')
+      return tuple(values) if len(values) == 3 and all(values) else None
+    return {'Category': code(fields[1]), 'Type': code(fields[2]), 'TypeModifier': code(fields[3]),
+            'Region': code(fields[5]), 'RegionModifier': code(fields[6])}
+
+  @staticmethod
+  def createCodeSequence(code):
+    item = pydicom.Dataset()
+    item.CodingSchemeDesignator, item.CodeValue, item.CodeMeaning = code
+    return pydicom.Sequence([item])
+
+  @staticmethod
+  def createDICOMSegmentation(segmentationNode, referenceVolumeNode, referenceFiles, seriesDescription):
+    """Create a BINARY DICOM SEG dataset in memory from the segments of the segmentation
+    node, referencing the instances of referenceFiles, which must be the files the reference
+    volume was loaded from. Frames are only written for the slices where a segment is not
+    empty. Returns None if the reference is not a single regular volume matching the files,
+    EMPTY_SEGMENTATION if all segments are empty."""
+    referenceDatasets = [pydicom.dcmread(f, stop_before_pixels=True) for f in referenceFiles]
+    slices = [mpReviewLogic.getSliceGeometryFromDataset(d) for d in referenceDatasets]
+    if not len(slices) or None in slices:
+      return None
+    geometry = mpReviewLogic.getVolumeGeometryFromSlices(slices)
+    if geometry is None:
+      return None
+    order, ijkToRAS = geometry
+    referenceIJKToRAS = vtk.vtkMatrix4x4()
+    referenceVolumeNode.GetIJKToRASMatrix(referenceIJKToRAS)
+    if not np.allclose(slicer.util.arrayFromVTKMatrix(referenceIJKToRAS), ijkToRAS, atol=1e-3) or \
+       referenceVolumeNode.GetImageData().GetDimensions() != (slices[0]['Columns'], slices[0]['Rows'], len(slices)):
+      return None
+    sortedDatasets = [referenceDatasets[i] for i in order]
+    reference = sortedDatasets[0]
+    rows, columns = slices[0]['Rows'], slices[0]['Columns']
+
+    segmentation = segmentationNode.GetSegmentation()
+
+    # frames of all segments, as (segment number, slice index, frame), empty frames are not stored
+    segmentSequence = pydicom.Sequence()
+    frames = []
+    for segmentIndex in range(segmentation.GetNumberOfSegments()):
+      segmentNumber = segmentIndex+1
+      segmentId = segmentation.GetNthSegmentID(segmentIndex)
+      segment = segmentation.GetSegment(segmentId)
+      narray = slicer.util.arrayFromSegmentBinaryLabelmap(segmentationNode, segmentId, referenceVolumeNode) != 0
+      for k in np.nonzero(narray.any(axis=(1,2)))[0]:
+        frames.append((segmentNumber, int(k), narray[k]))
+
+      codes = mpReviewLogic.getSegmentCodes(segment)
+      tissue = ('SCT', '85756007', 'Tissue')
+      segmentItem = pydicom.Dataset()
+      segmentItem.SegmentNumber = segmentNumber
+      segmentItem.SegmentLabel = segment.GetName()
+      segmentItem.SegmentAlgorithmType = 'MANUAL'
+      segmentItem.RecommendedDisplayCIELabValue = mpReviewLogic.rgbToDICOMLab(segment.GetColor())
+      segmentItem.SegmentedPropertyCategoryCodeSequence = mpReviewLogic.createCodeSequence(codes['Category'] or tissue)
+      segmentItem.SegmentedPropertyTypeCodeSequence = mpReviewLogic.createCodeSequence(codes['Type'] or tissue)
+      if codes['TypeModifier']:
+        segmentItem.SegmentedPropertyTypeCodeSequence[0].SegmentedPropertyTypeModifierCodeSequence = \
+          mpReviewLogic.createCodeSequence(codes['TypeModifier'])
+      if codes['Region']:
+        segmentItem.AnatomicRegionSequence = mpReviewLogic.createCodeSequence(codes['Region'])
+        if codes['RegionModifier']:
+          segmentItem.AnatomicRegionSequence[0].AnatomicRegionModifierSequence = \
+            mpReviewLogic.createCodeSequence(codes['RegionModifier'])
+      segmentSequence.append(segmentItem)
+    if not frames:
+      return mpReviewLogic.EMPTY_SEGMENTATION
+
+    fileMeta = pydicom.dataset.FileMetaDataset()
+    fileMeta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.66.4'  # Segmentation Storage
+    fileMeta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    fileMeta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+    dataset = pydicom.Dataset()
+    dataset.file_meta = fileMeta
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = False
+
+    # patient, study and frame of reference of the referenced series
+    for keyword in ['PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex', 'StudyInstanceUID',
+                    'StudyDate', 'StudyTime', 'StudyID', 'AccessionNumber', 'ReferringPhysicianName',
+                    'FrameOfReferenceUID']:
+      setattr(dataset, keyword, reference.get(keyword, ''))
+    now = datetime.datetime.now()
+    dataset.SOPClassUID = fileMeta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = fileMeta.MediaStorageSOPInstanceUID
+    dataset.Modality = 'SEG'
+    dataset.SeriesInstanceUID = pydicom.uid.generate_uid()
+    dataset.SeriesNumber = 1000+int(reference.get('SeriesNumber', 0) or 0)
+    dataset.SeriesDescription = seriesDescription
+    dataset.InstanceNumber = 1
+    dataset.ContentDate = now.strftime('%Y%m%d')
+    dataset.ContentTime = now.strftime('%H%M%S')
+    dataset.ContentLabel = 'SEGMENTATION'
+    dataset.ContentDescription = seriesDescription
+    dataset.ContentCreatorName = ''
+    dataset.Manufacturer = '3D Slicer'
+    dataset.ManufacturerModelName = 'mpReview'
+    dataset.DeviceSerialNumber = '1'
+    dataset.SoftwareVersions = slicer.app.applicationVersion
+    dataset.ImageType = ['DERIVED', 'PRIMARY']
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = 'MONOCHROME2'
+    dataset.Rows = rows
+    dataset.Columns = columns
+    dataset.BitsAllocated = 1
+    dataset.BitsStored = 1
+    dataset.HighBit = 0
+    dataset.PixelRepresentation = 0
+    dataset.LossyImageCompression = '00'
+    dataset.SegmentationType = 'BINARY'
+    dataset.SegmentSequence = segmentSequence
+
+    dimensionOrganizationUID = pydicom.uid.generate_uid()
+    dimensionOrganization = pydicom.Dataset()
+    dimensionOrganization.DimensionOrganizationUID = dimensionOrganizationUID
+    dataset.DimensionOrganizationSequence = pydicom.Sequence([dimensionOrganization])
+    dataset.DimensionOrganizationType = '3D'
+    dimensionIndexSequence = pydicom.Sequence()
+    for indexPointer, groupPointer in [(0x0062000B, 0x0062000A), (0x00200032, 0x00209113)]:
+      dimensionIndex = pydicom.Dataset()
+      dimensionIndex.DimensionOrganizationUID = dimensionOrganizationUID
+      dimensionIndex.DimensionIndexPointer = indexPointer
+      dimensionIndex.FunctionalGroupPointer = groupPointer
+      dimensionIndexSequence.append(dimensionIndex)
+    dataset.DimensionIndexSequence = dimensionIndexSequence
+
+    planeOrientation = pydicom.Dataset()
+    planeOrientation.ImageOrientationPatient = reference.ImageOrientationPatient
+    pixelMeasures = pydicom.Dataset()
+    pixelMeasures.PixelSpacing = reference.PixelSpacing
+    sliceSpacing = float(np.linalg.norm(ijkToRAS[:3,2]))
+    pixelMeasures.SliceThickness = reference.get('SliceThickness', sliceSpacing) or sliceSpacing
+    pixelMeasures.SpacingBetweenSlices = round(sliceSpacing, 6)
+    sharedFunctionalGroups = pydicom.Dataset()
+    sharedFunctionalGroups.PlaneOrientationSequence = pydicom.Sequence([planeOrientation])
+    sharedFunctionalGroups.PixelMeasuresSequence = pydicom.Sequence([pixelMeasures])
+    dataset.SharedFunctionalGroupsSequence = pydicom.Sequence([sharedFunctionalGroups])
+
+    perFrameFunctionalGroups = pydicom.Sequence()
+    for segmentNumber, k, frame in frames:
+      sourceImage = pydicom.Dataset()
+      sourceImage.ReferencedSOPClassUID = sortedDatasets[k].SOPClassUID
+      sourceImage.ReferencedSOPInstanceUID = sortedDatasets[k].SOPInstanceUID
+      sourceImage.PurposeOfReferenceCodeSequence = mpReviewLogic.createCodeSequence(
+        ('DCM', '121322', 'Source image for image processing operation'))
+      derivationImage = pydicom.Dataset()
+      derivationImage.SourceImageSequence = pydicom.Sequence([sourceImage])
+      derivationImage.DerivationCodeSequence = mpReviewLogic.createCodeSequence(('DCM', '113076', 'Segmentation'))
+      frameContent = pydicom.Dataset()
+      frameContent.DimensionIndexValues = [segmentNumber, k+1]
+      planePosition = pydicom.Dataset()
+      planePosition.ImagePositionPatient = sortedDatasets[k].ImagePositionPatient
+      segmentIdentification = pydicom.Dataset()
+      segmentIdentification.ReferencedSegmentNumber = segmentNumber
+      frameFunctionalGroups = pydicom.Dataset()
+      frameFunctionalGroups.DerivationImageSequence = pydicom.Sequence([derivationImage])
+      frameFunctionalGroups.FrameContentSequence = pydicom.Sequence([frameContent])
+      frameFunctionalGroups.PlanePositionSequence = pydicom.Sequence([planePosition])
+      frameFunctionalGroups.SegmentIdentificationSequence = pydicom.Sequence([segmentIdentification])
+      perFrameFunctionalGroups.append(frameFunctionalGroups)
+    dataset.PerFrameFunctionalGroupsSequence = perFrameFunctionalGroups
+
+    referencedInstances = pydicom.Sequence()
+    for referenceDataset in sortedDatasets:
+      referencedInstance = pydicom.Dataset()
+      referencedInstance.ReferencedSOPClassUID = referenceDataset.SOPClassUID
+      referencedInstance.ReferencedSOPInstanceUID = referenceDataset.SOPInstanceUID
+      referencedInstances.append(referencedInstance)
+    referencedSeries = pydicom.Dataset()
+    referencedSeries.SeriesInstanceUID = reference.SeriesInstanceUID
+    referencedSeries.ReferencedInstanceSequence = referencedInstances
+    dataset.ReferencedSeriesSequence = pydicom.Sequence([referencedSeries])
+
+    # binary frames are packed back to back, the pixel data is padded to an even length
+    dataset.NumberOfFrames = len(frames)
+    pixelData = np.packbits(np.stack([frame for _, _, frame in frames]).ravel(), bitorder='little').tobytes()
+    if len(pixelData) % 2:
+      pixelData += b'\0'
+    dataset.PixelData = pixelData
+    dataset['PixelData'].VR = 'OB'
+    return dataset
+
+  @staticmethod
+  def loadDICOMSegmentation(fileName, referenceVolumeNode=None):
+    """Load a DICOM SEG into a new segmentation node, reading the file once and filling the
+    binary labelmaps of the segments directly. Every frame is placed on the slice given by
+    its position, so frames may be missing for empty slices. Returns None if the SEG
+    cannot be loaded this way (for example frames of different orientations)."""
+    dataset = pydicom.dcmread(fileName)
+    try:
+      frameCount = int(dataset.get('NumberOfFrames', 1) or 1)
+      orientations = np.array([mpReviewLogic.getFunctionalGroup(dataset, i, 'PlaneOrientationSequence').ImageOrientationPatient
+                               for i in range(frameCount)], dtype=float)
+      positions = np.array([mpReviewLogic.getFunctionalGroup(dataset, i, 'PlanePositionSequence').ImagePositionPatient
+                            for i in range(frameCount)], dtype=float)
+      segmentNumbers = np.array([int(mpReviewLogic.getFunctionalGroup(dataset, i, 'SegmentIdentificationSequence').ReferencedSegmentNumber)
+                                 for i in range(frameCount)])
+      pixelMeasures = mpReviewLogic.getFunctionalGroup(dataset, 0, 'PixelMeasuresSequence')
+      pixelSpacing = [float(v) for v in pixelMeasures.PixelSpacing]
+      sliceSpacing = float(pixelMeasures.get('SpacingBetweenSlices', 0.) or 0.)
+      frames = mpReviewLogic.unpackSegmentationFrames(dataset)
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError) as exc:
+      logging.warning('Cannot load %s directly: %s' % (fileName, str(exc)))
+      return None
+    if not np.allclose(orientations, orientations[0], atol=1e-3):
+      logging.warning('Cannot load %s directly: frames of different orientations' % fileName)
+      return None
+
+    # slice of every frame along the normal of the frames
+    normal = np.cross(orientations[0][:3], orientations[0][3:])
+    distances = positions.dot(normal)
+    if not sliceSpacing:
+      gaps = np.diff(np.unique(np.round(distances, 3)))
+      sliceSpacing = float(gaps.min()) if len(gaps) else float(pixelMeasures.get('SliceThickness', 1.) or 1.)
+    first = int(np.argmin(distances))
+    sliceIndices = np.round((distances-distances[first])/sliceSpacing).astype(int)
+    ijkToRAS = mpReviewLogic.getIJKToRASMatrix(orientations[0], pixelSpacing, sliceSpacing, positions[first])
+    imageToWorld = slicer.util.vtkMatrixFromArray(ijkToRAS)
+
+    threshold = 1
+    if dataset.get('SegmentationType') == 'FRACTIONAL':
+      threshold = max(1, (int(dataset.get('MaximumFractionalValue', 255) or 255)+1)//2)
+    rows, columns = frames.shape[1:]
+
+    from vtk.util import numpy_support
+    name = str(dataset.get('SeriesDescription', '') or 'Segmentation')
+    segmentationNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode', name)
+    wasModifying = segmentationNode.StartModify()
+    if referenceVolumeNode is not None:
+      segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(referenceVolumeNode)
+    segmentationNode.CreateDefaultDisplayNodes()
+    segmentation = segmentationNode.GetSegmentation()
+    for segmentItem in dataset.SegmentSequence:
+      segmentNumber = int(segmentItem.SegmentNumber)
+      segment = slicer.vtkSegment()
+      segment.SetName(str(segmentItem.get('SegmentLabel', segmentNumber)))
+      if 'RecommendedDisplayCIELabValue' in segmentItem:
+        segment.SetColor(mpReviewLogic.dicomLabToRGB(segmentItem.RecommendedDisplayCIELabValue))
+      segment.SetTag(slicer.vtkSegment.GetTerminologyEntryTagName(),
+                     mpReviewLogic.getSegmentTerminologyEntry(segmentItem))
+      labelmap = slicer.vtkOrientedImageData()
+      labelmap.SetImageToWorldMatrix(imageToWorld)
+      frameIndices = np.nonzero(segmentNumbers == segmentNumber)[0]
+      if len(frameIndices):
+        kMin = int(sliceIndices[frameIndices].min())
+        kMax = int(sliceIndices[frameIndices].max())
+        labelmap.SetExtent(0, columns-1, 0, rows-1, kMin, kMax)
+        labelmap.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+        narray = numpy_support.vtk_to_numpy(labelmap.GetPointData().GetScalars()).reshape(kMax-kMin+1, rows, columns)
+        narray[:] = 0
+        narray[sliceIndices[frameIndices]-kMin] = frames[frameIndices] >= threshold
+      else:
+        labelmap.SetExtent(0, -1, 0, -1, 0, -1)
+        labelmap.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+      segment.AddRepresentation(slicer.vtkSegmentationConverter.GetBinaryLabelmapRepresentationName(), labelmap)
+      segmentation.AddSegment(segment)
+    segmentationNode.EndModify(wasModifying)
+
+    mpReviewLogic.setVolumeDICOMReferences(segmentationNode, str(dataset.SeriesInstanceUID), [str(dataset.SOPInstanceUID)])
+    return segmentationNode
+
+  # tags that identify the time point of the slices of a multivolume, in order of preference,
+  # with the units of their values
+  FRAME_IDENTIFYING_TAGS = [('TemporalPositionIdentifier', ''),
+                            ('TriggerTime', 'ms'),
+                            ('AcquisitionTime', 's'),
+                            ('ContentTime', 's')]
+
+  @staticmethod
+  def getFrameIdentifyingValue(dataset, tagName):
+    """Value of the frame identifying tag of the dataset as a number (times in seconds
+    since midnight), None if it is missing"""
+    value = dataset.get(tagName)
+    if value is None or str(value) == '':
+      return None
+    try:
+      if tagName in ['AcquisitionTime', 'ContentTime']:
+        # DICOM TM: HHMMSS.FFFFFF, minutes and seconds are optional
+        value = str(value)
+        return int(value[0:2])*3600+int(value[2:4] or 0)*60+float(value[4:] or 0)
+      return float(value)
+    except ValueError:
+      return None
+
+  @staticmethod
+  def getFrameIdentifyingTag(datasets, slices):
+    """(tag name, units) of the first frame identifying tag for which the slices form a
+    regular volume at each time point, see getMultiVolumeGeometryFromSlices. None if
+    the slices are not a multivolume."""
+    for tagName, units in mpReviewLogic.FRAME_IDENTIFYING_TAGS:
+      frameValues = [mpReviewLogic.getFrameIdentifyingValue(ds, tagName) for ds in datasets]
+      if None not in frameValues and mpReviewLogic.getMultiVolumeGeometryFromSlices(slices, frameValues) is not None:
+        return tagName, units
+    return None
+
+  @staticmethod
+  def getMultiVolumeGeometryFromSlices(slices, frameValues, tolerance=1e-3):
+    """Return (frame values, slice indices of each frame in slice order, IJKToRAS matrix)
+    if the slices with the same frame value form regular volumes with the same geometry
+    for at least two frame values, None otherwise"""
+    values = sorted(set(frameValues))
+    if len(values) < 2:
+      return None
+    frames = []
+    ijkToRAS = None
+    for value in values:
+      indices = [i for i, v in enumerate(frameValues) if v == value]
+      geometry = mpReviewLogic.getVolumeGeometryFromSlices([slices[i] for i in indices], tolerance)
+      if geometry is None:
+        return None
+      order, frameIJKToRAS = geometry
+      if ijkToRAS is None:
+        ijkToRAS = frameIJKToRAS
+      elif len(indices) != len(frames[0]) or not np.allclose(frameIJKToRAS, ijkToRAS, atol=tolerance):
+        return None
+      frames.append([indices[o] for o in order])
+    return values, frames, ijkToRAS
+
+  @staticmethod
+  def createDICOMwebSession(auth=None, poolSize=16):
+    """HTTP session that keeps up to poolSize connections alive, for parallel DICOMweb requests"""
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=poolSize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.auth = auth
+    return session
+
+  @staticmethod
+  def removeNodesByClass(classNames):
+    """Remove all nodes of the given classes from the scene in a single batch, so that
+    observers are notified once instead of after every removal"""
+    scene = slicer.mrmlScene
+    nodes = []
+    for className in classNames:
+      collection = scene.GetNodesByClass(className)
+      collection.UnRegister(scene)
+      for i in range(collection.GetNumberOfItems()):
+        node = collection.GetItemAsObject(i)
+        if node not in nodes:
+          nodes.append(node)
+    if not nodes:
+      return
+    scene.StartState(scene.BatchProcessState)
+    try:
+      for node in nodes:
+        if node.GetScene() is not None:
+          scene.RemoveNode(node)
+    finally:
+      scene.EndState(scene.BatchProcessState)
+
+  @staticmethod
+  def getPreviewSliceIndices(order, count):
+    """Indices of about count slices evenly spaced along the volume, including both ends"""
+    if len(order) <= count:
+      return list(order)
+    positions = np.unique(np.round(np.linspace(0, len(order)-1, count)).astype(int))
+    return [order[p] for p in positions]
+
+  @staticmethod
+  def getPreviewSlices(slices, order):
+    """Copy of the slices where the ones without an 'Array' use the array of the nearest
+    retrieved slice along the volume, so that the preview has the final geometry"""
+    available = [p for p, i in enumerate(order) if 'Array' in slices[i]]
+    previewSlices = [dict(sg) for sg in slices]
+    for p, i in enumerate(order):
+      if 'Array' not in slices[i]:
+        nearest = min(available, key=lambda a: abs(a-p))
+        previewSlices[i]['Array'] = slices[order[nearest]]['Array']
+    return previewSlices
+
+  @staticmethod
+  def createScalarVolumeNodeFromSlices(name, slices):
+    """Create a scalar volume node from 2D slices that each have an 'Array' and the
+    geometry described in getVolumeGeometryFromSlices. Returns None if the slices do
+    not form a single regular volume."""
+    geometry = mpReviewLogic.getVolumeGeometryFromSlices(slices)
+    if geometry is None:
+      return None
+    order, ijkToRAS = geometry
+    volumeArray = np.stack([slices[i]['Array'] for i in order])
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', name)
+    slicer.util.updateVolumeFromArray(volumeNode, volumeArray)
+    volumeNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(ijkToRAS))
+    volumeNode.CreateDefaultDisplayNodes()
+    volumeNode.GetDisplayNode().AutoWindowLevelOn()
+    return volumeNode
+
+  @staticmethod
+  def createMultiVolumeNodeFromSlices(name, slices, frameValues, frameIdentifyingTagName, frameIdentifyingTagUnits):
+    """Create a multivolume node, with the frame labels and attributes the MultiVolumeImporter
+    sets, from 2D slices that each have an 'Array'. Returns None if the slices do not form
+    a multivolume, see getMultiVolumeGeometryFromSlices."""
+    geometry = mpReviewLogic.getMultiVolumeGeometryFromSlices(slices, frameValues)
+    if geometry is None:
+      return None
+    values, frames, ijkToRAS = geometry
+    # one scalar component per frame
+    volumeArray = np.stack([np.stack([slices[i]['Array'] for i in frame]) for frame in frames], axis=-1)
+    multiVolumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMultiVolumeNode', name)
+    displayNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMultiVolumeDisplayNode')
+    displayNode.SetDefaultColorMap()
+    multiVolumeNode.SetAndObserveDisplayNodeID(displayNode.GetID())
+    slicer.util.updateVolumeFromArray(multiVolumeNode, volumeArray)
+    multiVolumeNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(ijkToRAS))
+    labels = vtk.vtkDoubleArray()
+    for value in values:
+      labels.InsertNextValue(value)
+    multiVolumeNode.SetNumberOfFrames(len(values))
+    multiVolumeNode.SetLabelArray(labels)
+    multiVolumeNode.SetLabelName(frameIdentifyingTagName)
+    multiVolumeNode.SetAttribute('MultiVolume.FrameLabels', ','.join([str(v) for v in values]))
+    multiVolumeNode.SetAttribute('MultiVolume.NumberOfFrames', str(len(values)))
+    multiVolumeNode.SetAttribute('MultiVolume.FrameIdentifyingDICOMTagName', frameIdentifyingTagName)
+    multiVolumeNode.SetAttribute('MultiVolume.FrameIdentifyingDICOMTagUnits', frameIdentifyingTagUnits)
+    return multiVolumeNode
+
+  @staticmethod
+  def setVolumeScalarsFromArray(volumeNode, narray):
+    """Make the volume display the contiguous (k,j,i) array without copying it. The
+    array must not be modified while it is shown, the image data keeps a reference to it."""
+    from vtk.util import numpy_support
+    imageData = volumeNode.GetImageData()
+    vtkArray = numpy_support.numpy_to_vtk(narray.ravel(), deep=False)
+    vtkArray.SetName(imageData.GetPointData().GetScalars().GetName())
+    imageData.GetPointData().SetScalars(vtkArray)
+    imageData.Modified()
+    volumeNode.Modified()
+
   def hasImageData(self,volumeNode):
     """This is a dummy logic method that
     returns true if the passed in volume
@@ -2920,6 +4150,715 @@ class mpReviewLogic(ScriptedLoadableModuleLogic):
     return True
 
 
+class mpReviewMetadataCache(object):
+  """QIDO-RS study and series results of DICOMweb servers, kept across sessions
+  in an SQLite database and keyed by server URL, together with capabilities
+  found by probing the servers.
+
+  The studies of a server are replaced by the latest listing. A study whose
+  listing changed (for example its NumberOfStudyRelatedSeries) has its series
+  marked as stale, so that they are queried again when the study is selected;
+  series metadata already known is reused. The cache can be used from any
+  thread, each call opens its own connection.
+  """
+
+  # series level attributes of the first instance used in the series table
+  SERIES_METADATA_TAGS = ['00200011', '00080060', '0008103E']
+
+  def __init__(self, fileName):
+    self.fileName = fileName
+    with self.connect() as connection:
+      connection.execute('CREATE TABLE IF NOT EXISTS Studies (ServerURL TEXT, StudyInstanceUID TEXT, '
+                         'Study TEXT, SeriesValid INTEGER, PRIMARY KEY (ServerURL, StudyInstanceUID))')
+      connection.execute('CREATE TABLE IF NOT EXISTS Series (ServerURL TEXT, StudyInstanceUID TEXT, '
+                         'SeriesInstanceUID TEXT, Series TEXT, Metadata TEXT, '
+                         'PRIMARY KEY (ServerURL, StudyInstanceUID, SeriesInstanceUID))')
+      connection.execute('CREATE TABLE IF NOT EXISTS ServerCapabilities (ServerURL TEXT, Name TEXT, '
+                         'Value TEXT, Updated REAL, PRIMARY KEY (ServerURL, Name))')
+
+  @contextlib.contextmanager
+  def connect(self):
+    """Connection that is committed (or rolled back on errors) and closed at the end of the with block"""
+    with contextlib.closing(sqlite3.connect(self.fileName, timeout=30)) as connection:
+      with connection:
+        yield connection
+
+  @staticmethod
+  def getUID(dataset, tag):
+    return dataset[tag]['Value'][0]
+
+  def getStudies(self, serverUrl):
+    with self.connect() as connection:
+      rows = connection.execute('SELECT Study FROM Studies WHERE ServerURL=?', (serverUrl,)).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+  def updateStudies(self, serverUrl, studies):
+    """Replace the studies of the server, returns True if they changed"""
+    listed = {self.getUID(study, '0020000D'): json.dumps(study, sort_keys=True) for study in studies}
+    with self.connect() as connection:
+      cached = dict(connection.execute('SELECT StudyInstanceUID, Study FROM Studies WHERE ServerURL=?',
+                                       (serverUrl,)).fetchall())
+      removed = [uid for uid in cached.keys() if uid not in listed]
+      changed = [uid for uid, study in listed.items() if cached.get(uid) != study]
+      for uid in removed:
+        connection.execute('DELETE FROM Studies WHERE ServerURL=? AND StudyInstanceUID=?', (serverUrl, uid))
+        connection.execute('DELETE FROM Series WHERE ServerURL=? AND StudyInstanceUID=?', (serverUrl, uid))
+      for uid in changed:
+        connection.execute('INSERT OR REPLACE INTO Studies VALUES (?, ?, ?, 0)', (serverUrl, uid, listed[uid]))
+    return bool(removed or changed)
+
+  def getSeries(self, serverUrl, studyInstanceUID):
+    """[(series, metadata)] of the study, None if they have to be queried again"""
+    with self.connect() as connection:
+      valid = connection.execute('SELECT SeriesValid FROM Studies WHERE ServerURL=? AND StudyInstanceUID=?',
+                                 (serverUrl, studyInstanceUID)).fetchone()
+      if not valid or not valid[0]:
+        return None
+      rows = connection.execute('SELECT Series, Metadata FROM Series WHERE ServerURL=? AND StudyInstanceUID=?',
+                                (serverUrl, studyInstanceUID)).fetchall()
+    return [(json.loads(series), json.loads(metadata)) for series, metadata in rows]
+
+  def getSeriesMetadata(self, serverUrl, studyInstanceUID):
+    """{SeriesInstanceUID: metadata} of the series cached for the study, also if stale"""
+    with self.connect() as connection:
+      rows = connection.execute('SELECT SeriesInstanceUID, Metadata FROM Series WHERE ServerURL=? AND StudyInstanceUID=?',
+                                (serverUrl, studyInstanceUID)).fetchall()
+    return {uid: json.loads(metadata) for uid, metadata in rows}
+
+  def getServerCapability(self, serverUrl, name, maxAge=None):
+    """Value found by probing the server, None if it was not probed yet or if it was
+    probed more than maxAge seconds ago"""
+    with self.connect() as connection:
+      row = connection.execute('SELECT Value, Updated FROM ServerCapabilities WHERE ServerURL=? AND Name=?',
+                               (serverUrl, name)).fetchone()
+    if not row or (maxAge is not None and (row[1] is None or time.time()-row[1] > maxAge)):
+      return None
+    return row[0]
+
+  def setServerCapability(self, serverUrl, name, value):
+    with self.connect() as connection:
+      connection.execute('INSERT OR REPLACE INTO ServerCapabilities VALUES (?, ?, ?, ?)',
+                         (serverUrl, name, value, time.time()))
+
+  def invalidateSeries(self, serverUrl, studyInstanceUID):
+    """Mark the series of the study as stale, for example after storing an instance in it"""
+    with self.connect() as connection:
+      connection.execute('UPDATE Studies SET SeriesValid=0 WHERE ServerURL=? AND StudyInstanceUID=?',
+                         (serverUrl, studyInstanceUID))
+
+  def updateSeries(self, serverUrl, studyInstanceUID, seriesList):
+    """Replace the series of the study by [(series, metadata)] and mark them as valid"""
+    with self.connect() as connection:
+      connection.execute('DELETE FROM Series WHERE ServerURL=? AND StudyInstanceUID=?', (serverUrl, studyInstanceUID))
+      for series, metadata in seriesList:
+        connection.execute('INSERT OR REPLACE INTO Series VALUES (?, ?, ?, ?, ?)',
+                           (serverUrl, studyInstanceUID, self.getUID(series, '0020000E'),
+                            json.dumps(series), json.dumps(metadata)))
+      connection.execute('UPDATE Studies SET SeriesValid=1 WHERE ServerURL=? AND StudyInstanceUID=?',
+                         (serverUrl, studyInstanceUID))
+
+
+class mpReviewRequestScheduler(object):
+  """Runs DICOMweb requests from any thread, highest priority first.
+
+  Requests are rate limited by a token bucket (rate requests per second, up to
+  burst at once) and at most concurrency of them run at the same time. The
+  concurrency is halved when the server throttles (HTTP 429 or 503, the request
+  is then retried after a backoff delay), reduced when latency grows well above
+  the best observed, and otherwise increased by one after every concurrency
+  successful requests. Latency is tracked per request class (e.g. the client
+  method name), so that small queries do not set the baseline for retrievals.
+  """
+
+  INTERACTIVE = 0  # study and series queries, reference series of the current study
+  SELECTED = 1     # other selected series of the current study
+  BACKGROUND = 2   # archiving, prefetch and uploads
+
+  def __init__(self, rate=20., burst=40, maxConcurrency=16, minConcurrency=2, maxAttempts=6):
+    self.rate = rate
+    self.burst = burst
+    self.maxConcurrency = maxConcurrency
+    self.minConcurrency = minConcurrency
+    self.maxAttempts = maxAttempts
+    self.concurrency = maxConcurrency // 2
+    self.condition = threading.Condition()
+    self.tokens = float(burst)
+    self.tokenTime = time.time()
+    self.waiting = []
+    self.sequence = 0
+    self.active = 0
+    self.successes = 0
+    self.latency = {}
+    self.bestLatency = {}
+
+  def refillTokens(self):
+    now = time.time()
+    self.tokens = min(self.burst, self.tokens+(now-self.tokenTime)*self.rate)
+    self.tokenTime = now
+
+  def acquire(self, priority):
+    with self.condition:
+      self.sequence += 1
+      ticket = (priority, self.sequence)
+      heapq.heappush(self.waiting, ticket)
+      while True:
+        self.refillTokens()
+        if self.waiting[0] == ticket and self.active < self.concurrency and self.tokens >= 1:
+          break
+        # wake up at the latest when the next token is available
+        self.condition.wait(max(0.01, (1-self.tokens)/self.rate))
+      heapq.heappop(self.waiting)
+      self.active += 1
+      self.tokens -= 1
+      self.condition.notify_all()
+
+  def release(self, requestClass, latency, throttled):
+    with self.condition:
+      self.active -= 1
+      if throttled:
+        self.concurrency = max(self.minConcurrency, self.concurrency // 2)
+        self.successes = 0
+      elif latency is not None:
+        average = self.latency.get(requestClass)
+        average = latency if average is None else 0.8*average+0.2*latency
+        self.latency[requestClass] = average
+        self.bestLatency[requestClass] = min(self.bestLatency.get(requestClass, average), average)
+        self.successes += 1
+        if average > 3*self.bestLatency[requestClass] and self.concurrency > self.minConcurrency:
+          self.concurrency -= 1
+          self.successes = 0
+        elif self.successes >= self.concurrency and self.concurrency < self.maxConcurrency:
+          self.concurrency += 1
+          self.successes = 0
+      self.condition.notify_all()
+
+  @staticmethod
+  def isThrottled(exc):
+    response = getattr(exc, 'response', None)
+    return response is not None and response.status_code in [429, 503]
+
+  def run(self, priority, function, requestClass='default'):
+    """Call function when a slot is available for the priority, returns its result"""
+    for attempt in range(self.maxAttempts):
+      self.acquire(priority)
+      startTime = time.time()
+      try:
+        result = function()
+      except Exception as exc:
+        throttled = self.isThrottled(exc)
+        self.release(requestClass, None, throttled)
+        if not throttled or attempt == self.maxAttempts-1:
+          raise
+        logging.warning('DICOMweb server is throttling requests, retrying')
+        time.sleep(min(30., 2**attempt))
+        continue
+      self.release(requestClass, time.time()-startTime, False)
+      return result
+
+  def getQueueDepth(self):
+    """Number of requests waiting for each priority"""
+    with self.condition:
+      depth = {self.INTERACTIVE: 0, self.SELECTED: 0, self.BACKGROUND: 0}
+      for priority, _ in self.waiting:
+        depth[priority] += 1
+      return depth
+
+
+class mpReviewScheduledDICOMwebClient(object):
+  """DICOMweb client whose requests all go through a request scheduler, with the
+  given priority. Attributes that are not methods are those of the wrapped client.
+
+  Requests made on the main thread are passed to mainThreadRunner(function), which
+  must run the function elsewhere and return its result, so that the GUI does not
+  block while the request waits for the scheduler."""
+
+  def __init__(self, client, scheduler, session, priority=mpReviewRequestScheduler.INTERACTIVE,
+               mainThreadRunner=None):
+    self.client = client
+    self.scheduler = scheduler
+    self.session = session
+    self.priority = priority
+    self.mainThreadRunner = mainThreadRunner
+
+  def withPriority(self, priority):
+    return mpReviewScheduledDICOMwebClient(self.client, self.scheduler, self.session, priority,
+                                           self.mainThreadRunner)
+
+  def run(self, function, requestClass):
+    scheduled = lambda: self.scheduler.run(self.priority, function, requestClass)
+    if self.mainThreadRunner and threading.current_thread() is threading.main_thread():
+      return self.mainThreadRunner(scheduled)
+    return scheduled()
+
+  def retrieve_instance_to_file(self, study_instance_uid, series_instance_uid, sop_instance_uid, fileName,
+                                transferSyntaxUIDs=None):
+    """Stream an instance (WADO-RS) to fileName as received, without decoding it.
+    transferSyntaxUIDs lists acceptable transfer syntaxes, the server default if None."""
+    url = '%s/studies/%s/series/%s/instances/%s' % (self.client.base_url, study_instance_uid,
+                                                   series_instance_uid, sop_instance_uid)
+    mediaType = 'multipart/related; type="application/dicom"'
+    if transferSyntaxUIDs:
+      accept = ', '.join(['%s; transfer-syntax=%s' % (mediaType, uid) for uid in transferSyntaxUIDs])
+    else:
+      accept = mediaType
+    def retrieve():
+      with self.session.get(url, headers={'Accept': accept}, stream=True) as response:
+        response.raise_for_status()
+        mpReviewLogic.writeResponseBody(response, fileName)
+    return self.run(retrieve, 'retrieve_instance_to_file')
+
+  def __getattr__(self, name):
+    attribute = getattr(self.client, name)
+    if name.startswith('_') or not callable(attribute):
+      return attribute
+    def scheduled(*args, **kwargs):
+      return self.run(lambda: attribute(*args, **kwargs), name)
+    return scheduled
+
+
+class mpReviewTokenProvider(object):
+  """Caches an access token for its lifetime (in seconds).
+
+  getToken() is called to obtain a new token. Once the token is older than
+  lifetime-refreshMargin, a new one is obtained on a background thread while
+  the current one is still used, so requests do not wait for gcloud. Only one
+  refresh runs at a time, threads that need a token while there is no valid
+  one wait for the result of that refresh.
+  """
+
+  def __init__(self, getToken, lifetime=3000, refreshMargin=600):
+    self.getToken = getToken
+    self.lifetime = lifetime
+    self.refreshMargin = refreshMargin
+    self.condition = threading.Condition()
+    self.currentToken = None
+    self.tokenTime = 0
+    self.refreshing = False
+
+  def refresh(self):
+    """Obtain a new token, the caller must have set refreshing"""
+    try:
+      token = self.getToken()
+    except Exception:
+      with self.condition:
+        self.refreshing = False
+        self.condition.notify_all()
+      raise
+    with self.condition:
+      self.currentToken = token
+      self.tokenTime = time.time()
+      self.refreshing = False
+      self.condition.notify_all()
+    return token
+
+  def refreshInBackground(self):
+    def refresh():
+      try:
+        self.refresh()
+      except Exception as exc:
+        logging.error('Failed to refresh access token: %s' % str(exc))
+    threading.Thread(target=refresh, daemon=True).start()
+
+  def invalidate(self, token=None):
+    """Drop the token (only if it is still the current one, when given)"""
+    with self.condition:
+      if token is None or token == self.currentToken:
+        self.currentToken = None
+
+  def token(self):
+    with self.condition:
+      while True:
+        token = self.currentToken
+        age = time.time()-self.tokenTime
+        if token is not None and age <= self.lifetime:
+          startRefresh = age > self.lifetime-self.refreshMargin and not self.refreshing
+          if startRefresh:
+            self.refreshing = True
+          break
+        if not self.refreshing:
+          # no valid token, this thread obtains it and the others wait
+          self.refreshing = True
+          token = None
+          break
+        self.condition.wait()
+    if token is None:
+      return self.refresh()
+    if startRefresh:
+      self.refreshInBackground()
+    return token
+
+
+class mpReviewBearerAuth(object):
+  """requests authentication adding the bearer token of a token provider. A token
+  rejected by the server is dropped, and the request is sent again once with a new
+  token."""
+
+  def __init__(self, tokenProvider):
+    self.tokenProvider = tokenProvider
+
+  def __call__(self, request):
+    request.headers['Authorization'] = 'Bearer ' + self.tokenProvider.token()
+    request.register_hook('response', self.onResponse)
+    return request
+
+  def onResponse(self, response, *args, **kwargs):
+    if response.status_code != 401 or getattr(response.request, 'mpReviewTokenRetried', False):
+      return response
+    rejectedToken = response.request.headers.get('Authorization', '')[len('Bearer '):]
+    self.tokenProvider.invalidate(rejectedToken)
+    # release the connection before sending the request again, as requests does for digest authentication
+    response.content
+    response.close()
+    retry = response.request.copy()
+    retry.headers['Authorization'] = 'Bearer ' + self.tokenProvider.token()
+    retry.mpReviewTokenRetried = True
+    retryResponse = response.connection.send(retry, **kwargs)
+    retryResponse.history.append(response)
+    retryResponse.request = retry
+    return retryResponse
+
+
+class mpReviewGCPCatalog(object):
+  """Lists of GCP projects, datasets, DICOM stores and locations.
+
+  Every gcloud listing takes seconds, so results are cached in a JSON file and
+  reused until they are older than timeToLive (in seconds). Keys are 'projects',
+  'locations', 'datasets/<project>' and 'dicomStores/<project>/<dataset>'.
+  fetch can be called from a worker thread.
+  """
+
+  def __init__(self, gcp, cacheFile, timeToLive=3600):
+    self.gcp = gcp
+    self.cacheFile = cacheFile
+    self.timeToLive = timeToLive
+    self.lock = threading.Lock()
+    self.cache = {}
+    try:
+      with open(self.cacheFile) as f:
+        self.cache = json.load(f)
+    except (OSError, IOError, ValueError):
+      pass
+
+  def save(self):
+    tmpFile = self.cacheFile+'.tmp'
+    try:
+      with open(tmpFile, 'w') as f:
+        json.dump(self.cache, f)
+      os.replace(tmpFile, self.cacheFile)
+    except (OSError, IOError) as exc:
+      logging.error('Failed to save GCP catalog %s: %s' % (self.cacheFile, str(exc)))
+
+  def getCached(self, key):
+    """Returns (items, fresh), items is None if the key was never listed"""
+    with self.lock:
+      entry = self.cache.get(key)
+    if entry is None:
+      return None, False
+    return entry['Items'], time.time()-entry['Time'] < self.timeToLive
+
+  def fetch(self, key):
+    """List the resources with gcloud and update the cache"""
+    parts = key.split('/')
+    if parts[0] == 'projects':
+      items = self.gcp.projects()
+    elif parts[0] == 'locations':
+      items = self.gcp.locations()
+    elif parts[0] == 'datasets':
+      items = self.gcp.datasets(parts[1])
+    elif parts[0] == 'dicomStores':
+      items = self.gcp.dicomStores(parts[1], parts[2])
+    else:
+      raise ValueError('Unknown GCP catalog key: '+key)
+    with self.lock:
+      self.cache[key] = {'Items': items, 'Time': time.time()}
+      self.save()
+    return items
+
+  def get(self, key):
+    """Cached items if fresh, listed again otherwise"""
+    items, fresh = self.getCached(key)
+    return items if fresh else self.fetch(key)
+
+
+class mpReviewUploadQueue(object):
+  """Persistent queue of DICOM files to store on DICOMweb servers.
+
+  Every queued file is kept in the queue directory next to a JSON description
+  with the server it goes to, and is deleted only after the server accepted it.
+  Files that could not be uploaded (including when Slicer exits or crashes)
+  remain in the queue and can be submitted again in a later session. Uploads run
+  one at a time on a worker thread, and are retried with exponential backoff.
+  """
+
+  def __init__(self, queueDirectory, maxAttempts=5, retryDelay=2.):
+    self.queueDirectory = queueDirectory
+    self.maxAttempts = maxAttempts
+    self.retryDelay = retryDelay
+    self.executor = ThreadPoolExecutor(max_workers=1)
+    # file names of the entries that are submitted in this session
+    self.submitted = set()
+    if not os.path.isdir(self.queueDirectory):
+      os.makedirs(self.queueDirectory)
+
+  def getStagingDirectory(self):
+    """Directory where files can be written before they are queued"""
+    stagingDirectory = os.path.join(self.queueDirectory, 'staging')
+    if not os.path.isdir(stagingDirectory):
+      os.makedirs(stagingDirectory)
+    return stagingDirectory
+
+  def enqueue(self, fileName, serverUrl):
+    """Move the file into the queue, returns the queue entry"""
+    name = datetime.datetime.now().strftime("%Y%m%d%H%M%S")+'-'+uuid.uuid4().hex
+    entry = {'FileName': os.path.join(self.queueDirectory, name+'.dcm'),
+             'ServerURL': serverUrl,
+             'Queued': datetime.datetime.now().isoformat()}
+    shutil.move(fileName, entry['FileName'])
+    self.writeEntry(entry)
+    return entry
+
+  @staticmethod
+  def getEntryFileName(entry):
+    return os.path.splitext(entry['FileName'])[0]+'.json'
+
+  def writeEntry(self, entry):
+    entryFileName = self.getEntryFileName(entry)
+    with open(entryFileName+'.tmp', 'w') as f:
+      json.dump(entry, f)
+    os.replace(entryFileName+'.tmp', entryFileName)
+
+  def getPendingEntries(self, serverUrl):
+    """Queued entries for the server that are not being uploaded, oldest first"""
+    entries = []
+    for name in sorted(os.listdir(self.queueDirectory)):
+      if not name.endswith('.json'):
+        continue
+      try:
+        with open(os.path.join(self.queueDirectory, name)) as f:
+          entry = json.load(f)
+      except (OSError, IOError, ValueError):
+        continue
+      if entry.get('ServerURL') == serverUrl and entry['FileName'] not in self.submitted and \
+         os.path.isfile(entry['FileName']):
+        entries.append(entry)
+    return entries
+
+  def submit(self, entry, client):
+    """Upload the entry on the worker thread, returns a future"""
+    self.submitted.add(entry['FileName'])
+    return self.executor.submit(self.upload, entry, client)
+
+  def upload(self, entry, client):
+    try:
+      dataset = pydicom.dcmread(entry['FileName'])
+      for attempt in range(self.maxAttempts):
+        try:
+          client.store_instances(datasets=[dataset])
+          break
+        except Exception as exc:
+          if attempt == self.maxAttempts-1:
+            raise
+          logging.warning('Upload of %s failed (%s), retrying' % (entry['FileName'], str(exc)))
+          time.sleep(self.retryDelay*2**attempt)
+      os.remove(entry['FileName'])
+      os.remove(self.getEntryFileName(entry))
+      return str(dataset.StudyInstanceUID)
+    finally:
+      self.submitted.discard(entry['FileName'])
+
+
+class mpReviewLayoutController(object):
+  """Shows one volume per slice view, over the reference as background.
+
+  Building the layout with CompareVolumes re-creates every slice view. When the
+  volumes to show are the same as in the current layout (only the reference
+  changed), the existing slice views are kept and only their volumes, label and
+  orientation are updated.
+  """
+
+  def __init__(self):
+    self.cvLogic = CompareVolumes.CompareVolumesLogic()
+    self.viewNames = None
+    self.layout = None
+    self.lastBuildTime = None
+
+  def getSliceWidgets(self, viewNames):
+    layoutManager = slicer.app.layoutManager()
+    return [layoutManager.sliceWidget(viewName) for viewName in viewNames]
+
+  def canReuseLayout(self, layout, viewNames):
+    if self.viewNames is None or self.layout != layout or set(self.viewNames) != set(viewNames):
+      return False
+    layoutNode = slicer.util.getNode('*LayoutNode*')
+    if layoutNode.GetViewArrangement() not in [layoutNode.SlicerLayoutUserView, layoutNode.SlicerLayoutOneUpRedSliceView]:
+      return False
+    return None not in self.getSliceWidgets(viewNames)
+
+  def showVolumes(self, volumeNodes, label, layout, viewNames, orientation):
+    """Show volumeNodes[i] in the view viewNames[i], with volumeNodes[0] as background"""
+    startTime = time.time()
+    background = volumeNodes[0]
+    if self.canReuseLayout(layout, viewNames):
+      for volumeNode, sliceWidget in zip(volumeNodes, self.getSliceWidgets(viewNames)):
+        compositeNode = sliceWidget.mrmlSliceCompositeNode()
+        compositeNode.SetBackgroundVolumeID(background.GetID())
+        compositeNode.SetForegroundVolumeID(volumeNode.GetID())
+        compositeNode.SetLabelVolumeID(label.GetID() if label else "")
+        sliceWidget.mrmlSliceNode().SetOrientation(orientation)
+      rebuilt = False
+    else:
+      self.cvLogic.viewerPerVolume(volumeNodes, background=background, label=label,
+                                   layout=layout, viewNames=viewNames, orientation=orientation)
+      # Link the slice views
+      # links the scrolling, but not the zoom and pan
+      for sliceCompositeNode in slicer.util.getNodesByClass("vtkMRMLSliceCompositeNode"):
+        sliceCompositeNode.HotLinkedControlOn()
+        sliceCompositeNode.LinkedControlOn()
+      self.viewNames = list(viewNames)
+      self.layout = list(layout)
+      rebuilt = True
+
+    appLogic = slicer.app.applicationLogic()
+    appLogic.FitSliceToAll(True, False)
+
+    elapsed = time.time()-startTime
+    if rebuilt:
+      self.lastBuildTime = elapsed
+      logging.info('Built layout of %i views in %.3f s' % (len(viewNames), elapsed))
+    else:
+      logging.info('Updated layout of %i views in %.3f s (%.3f s to rebuild it last time)' %
+                   (len(viewNames), elapsed, self.lastBuildTime))
+
+  def reset(self):
+    """Build the layout again on next showVolumes, for example after the scene was cleared"""
+    self.viewNames = None
+    self.layout = None
+
+
+class mpReviewFrameCache(object):
+  """Least recently used cache of frames extracted from multivolume nodes.
+
+  Multivolume frames are interleaved as components of the image data, so a frame
+  cannot be viewed in place: it is copied once into a contiguous array, which is
+  then reused every time the frame is shown again.
+  """
+
+  def __init__(self, maxFrames=32):
+    self.maxFrames = maxFrames
+    self.frames = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def clear(self):
+    self.frames.clear()
+
+  def removeNode(self, node):
+    nodeID = node.GetID()
+    for key in [k for k in self.frames.keys() if k[0] == nodeID]:
+      del self.frames[key]
+
+  def getFrame(self, multiVolumeNode, frameId):
+    imageData = multiVolumeNode.GetImageData()
+    # the modified time invalidates frames of a multivolume whose voxels were replaced
+    key = (multiVolumeNode.GetID(), imageData.GetMTime(), frameId)
+    frameArray = self.frames.get(key)
+    if frameArray is not None:
+      self.frames.move_to_end(key)
+      self.hits += 1
+      return frameArray
+    self.misses += 1
+    frameArray = np.ascontiguousarray(slicer.util.arrayFromVolume(multiVolumeNode)[..., frameId])
+    self.frames[key] = frameArray
+    while len(self.frames) > self.maxFrames:
+      self.frames.popitem(last=False)
+    return frameArray
+
+
+class mpReviewResidencyManager(object):
+  """Keeps the image data of the loaded series within a memory budget.
+
+  When the budget is exceeded, the image data of series that are not shown in any
+  slice view is written to a scratch file and released, least recently shown first.
+  The nodes stay in the scene, so that references to them remain valid, and their
+  image data is restored in place before they are shown again. Preview volumes are
+  never paged out, their remaining slices are written to the image data in place.
+  """
+
+  def __init__(self, budget, storageDirectory=None):
+    self.budget = budget
+    self.storageDirectory = storageDirectory or os.path.join(slicer.app.temporaryPath, 'mpReviewResidency')
+    # node ID -> (scratch file, modified time of the image data restored from it)
+    self.pagedOut = {}
+    self.pagedIn = {}
+    # seriesInstanceUID -> update count when the series was last shown
+    self.lastShown = {}
+    self.updateCount = 0
+
+  def clear(self):
+    for fileName, _ in list(self.pagedOut.values())+list(self.pagedIn.values()):
+      if os.path.isfile(fileName):
+        os.remove(fileName)
+    self.pagedOut = {}
+    self.pagedIn = {}
+    self.lastShown = {}
+
+  @staticmethod
+  def getSeriesNodes(seriesEntry):
+    return [seriesEntry[k] for k in ['MultiVolume', 'Volume'] if seriesEntry.get(k) is not None]
+
+  @staticmethod
+  def getResidentSize(node):
+    imageData = node.GetImageData()
+    return imageData.GetActualMemorySize()*1024 if imageData is not None else 0
+
+  def pageOut(self, node):
+    fileName, restoredMTime = self.pagedIn.pop(node.GetID(), (None, None))
+    # no need to write the voxels again if they did not change since they were restored
+    if fileName is None or node.GetImageData().GetMTime() != restoredMTime:
+      if not os.path.isdir(self.storageDirectory):
+        os.makedirs(self.storageDirectory)
+      fileName = os.path.join(self.storageDirectory, node.GetID()+'.npy')
+      np.save(fileName, slicer.util.arrayFromVolume(node))
+    node.SetAndObserveImageData(None)
+    self.pagedOut[node.GetID()] = (fileName, None)
+
+  def pageIn(self, node):
+    if node.GetID() not in self.pagedOut:
+      return
+    fileName, _ = self.pagedOut.pop(node.GetID())
+    node.SetAndObserveImageData(vtk.vtkImageData())
+    slicer.util.updateVolumeFromArray(node, np.load(fileName))
+    self.pagedIn[node.GetID()] = (fileName, node.GetImageData().GetMTime())
+
+  def pageInSeries(self, seriesEntry):
+    for node in self.getSeriesNodes(seriesEntry):
+      self.pageIn(node)
+
+  def update(self, seriesMap, visibleSeries):
+    """Page in the visible series and page out others while over budget, returns the paged out nodes"""
+    self.updateCount += 1
+    for seriesInstanceUID in visibleSeries:
+      self.lastShown[seriesInstanceUID] = self.updateCount
+      self.pageInSeries(seriesMap[seriesInstanceUID])
+
+    residentSize = sum([self.getResidentSize(n) for entry in seriesMap.values() for n in self.getSeriesNodes(entry)])
+    hidden = sorted([uid for uid in seriesMap.keys() if uid not in visibleSeries],
+                    key=lambda uid: self.lastShown.get(uid, 0))
+    pagedOutNodes = []
+    for seriesInstanceUID in hidden:
+      if residentSize <= self.budget:
+        break
+      for node in self.getSeriesNodes(seriesMap[seriesInstanceUID]):
+        if node.GetImageData() is None or node.GetAttribute(mpReviewLogic.PREVIEW_ATTRIBUTE) == 'true':
+          continue
+        residentSize -= self.getResidentSize(node)
+        self.pageOut(node)
+        pagedOutNodes.append(node)
+    if pagedOutNodes:
+      logging.info('Paged out %i volume(s), %.0f MB of image data resident' % (len(pagedOutNodes), residentSize/1024./1024.))
+    return pagedOutNodes
+
+
 class mpReviewMultiVolumeExplorer(qSlicerMultiVolumeExplorerSimplifiedModuleWidget):
 
   def __init__(self, parent=None):
@@ -1,6 +1,7 @@
 import shutil, string, os, sys, glob, xml.dom.minidom, json
 import SimpleITK as sitk
 import logging
+from DatasetInventory import DatasetInventory, sliceCountsMatch
 
 # Given the location of data and a JSON configuration file that has the following
 # structure:
@@ -114,6 +115,9 @@ totalStudies = 0
 mm = MeasurementsManager()
 mvalue = 0
 
+# image geometry is cached across runs at the root of the data tree
+inventory = DatasetInventory(data)
+
 # read structure to label ID for consistency checking
 colorFile = "../Resources/Colors/PCampReviewColors.csv"
 import csv
@@ -189,7 +193,12 @@ for c in studies:
           #print 'Reading ',imageFile,segmentationFile
 
           label = sitk.ReadImage(str(segmentationFile))
-          image = sitk.ReadImage(imageFile)
+
+          # compare the headers, the image itself is only decoded for resampling
+          if not sliceCountsMatch(inventory.getImageInformation(imageFile),
+                                  inventory.getImageInformation(segmentationFile)):
+            logger.error('Image/label sizes do not match: '+segmentationFile)
+            errorCode = 1
 
           stats = sitk.LabelStatisticsImageFilter()
           stats.Execute(label,label)
@@ -198,10 +207,6 @@ for c in studies:
 
           logger.info('Checking '+segmentationFile+' total labels: '+str(totalLabels))
 
-          if image.GetSize()[2] != label.GetSize()[2]:
-            logger.error('Image/label sizes do not match: '+segmentationFile)
-            errorCode = 1
-
           if totalLabels==1:
             logger.error("Segmentation has only one label:"+str(labelID)+" for "+\
                 segmentationFile)
@@ -239,6 +244,7 @@ for c in studies:
 
           if resampleLabel:
             logger.info('Resampling')
+            image = sitk.ReadImage(imageFile)
             resample = sitk.ResampleImageFilter()
             resample.SetReferenceImage(image)
             resample.SetInterpolator(sitk.sitkNearestNeighbor)
@@ -246,3 +252,5 @@ for c in studies:
             sitk.WriteImage(label,str(segmentationFile),True)
 
           break
+
+inventory.save()
@@ -1,5 +1,6 @@
 import shutil, string, os, sys, glob, xml.dom.minidom, json, logging, argparse
 import SimpleITK as sitk
+from DatasetInventory import DatasetInventory, sliceCountsMatch
 
 # Given the location of data and a JSON configuration file that has the following
 # structure:
@@ -68,6 +69,9 @@ def main(argv):
   # should probably be done once during preprocessing
   resampleLabel = False
 
+  # image geometry is cached across runs at the root of the data tree
+  inventory = DatasetInventory(data)
+
   for c in studies:
 
     try:
@@ -147,6 +151,12 @@ def main(argv):
             logger.error(f"no reconstructions found: {reconstructionsDir}")
             continue
 
+          # compare the headers first, no need to decode a pair that does not match
+          if not resampleLabel and not sliceCountsMatch(inventory.getImageInformation(imageFile),
+                                                        inventory.getImageInformation(segmentationFile)):
+            logger.error(f'Image/label sizes do not match {reconstructionsDir}')
+            continue
+
           label = sitk.ReadImage(str(segmentationFile))
           image = sitk.ReadImage(imageFile)
 
@@ -226,6 +236,8 @@ def main(argv):
 
           #print str(measurements)
 
+  inventory.save()
+
 if __name__ == "__main__":
 
   # n = read4DNIfTI('/Users/fedorov/Downloads/9-3D_DCE/dce.nii')
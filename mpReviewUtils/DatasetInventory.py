@@ -0,0 +1,113 @@
+import os, json, logging, threading
+
+# Inventory of a data tree that follows the mpReview convention:
+#
+# <data>/<Study>/RESOURCES/<Series>/{DICOM,Canonical,Reconstructions,Segmentations,...}
+#
+# Results that are expensive to obtain and only depend on the content of a
+# single file (such as image geometry read from the NRRD/NIfTI header) are
+# cached in a JSON file at the root of the data tree. Cache entries are keyed
+# by the path relative to the data root and are invalidated whenever the
+# modification time or size of the file changes.
+
+logger = logging.getLogger("mpReviewUtil:DatasetInventory")
+
+INVENTORY_FILE_NAME = ".mpReviewInventory.json"
+INVENTORY_VERSION = 1
+
+def getValidDirs(dir):
+  dirs = os.listdir(dir)
+  dirs = [f for f in dirs if os.path.isdir(dir+'/'+f)]
+  dirs = [f for f in dirs if not f.startswith('.')]
+  return dirs
+
+def readImageInformation(fileName):
+  """Read image geometry from the file header without decoding the voxels"""
+  # imported here, so that tools that only read the canonical attributes do not need SimpleITK
+  import SimpleITK as sitk
+  reader = sitk.ImageFileReader()
+  reader.SetFileName(str(fileName))
+  reader.ReadImageInformation()
+  return {'Size': list(reader.GetSize()),
+          'Spacing': list(reader.GetSpacing()),
+          'Origin': list(reader.GetOrigin()),
+          'Direction': list(reader.GetDirection()),
+          'NumberOfComponents': reader.GetNumberOfComponents(),
+          'PixelID': reader.GetPixelID()}
+
+def readCanonicalAttributes(fileName):
+  with open(fileName) as f:
+    return json.load(f)
+
+def sliceCountsMatch(imageInformation, labelInformation):
+  return imageInformation['Size'][2] == labelInformation['Size'][2]
+
+def gridsMatch(imageInformation, labelInformation, tolerance=1e-3):
+  """True if both images have the same size and spacing, so that the label can be
+  put on the image grid by copying the image origin and direction"""
+  return imageInformation['Size'] == labelInformation['Size'] and \
+         all(abs(a-b) <= tolerance*max(1., abs(a)) for a,b in zip(imageInformation['Spacing'], labelInformation['Spacing']))
+
+
+class DatasetInventory(object):
+
+  def __init__(self, dataDir, inventoryFile=None):
+    self.dataDir = os.path.abspath(dataDir)
+    self.inventoryFile = inventoryFile or os.path.join(self.dataDir, INVENTORY_FILE_NAME)
+    self.modified = False
+    self.lock = threading.Lock()
+    self.load()
+
+  def load(self):
+    self.inventory = {'Version': INVENTORY_VERSION, 'Geometry': {}, 'Canonical': {}}
+    try:
+      with open(self.inventoryFile) as f:
+        inventory = json.load(f)
+    except (OSError, IOError, ValueError):
+      return
+    if inventory.get('Version') != INVENTORY_VERSION:
+      logger.info('Ignoring inventory with unsupported version: '+self.inventoryFile)
+      return
+    for section in self.inventory.keys():
+      self.inventory[section] = inventory.get(section, self.inventory[section])
+
+  def save(self):
+    if not self.modified:
+      return
+    tmpFile = self.inventoryFile+'.tmp'
+    try:
+      with self.lock, open(tmpFile, 'w') as f:
+        json.dump(self.inventory, f)
+      os.replace(tmpFile, self.inventoryFile)
+      self.modified = False
+    except (OSError, IOError) as e:
+      logger.error('Failed to save inventory '+self.inventoryFile+': '+str(e))
+
+  def getKey(self, fileName):
+    return os.path.relpath(os.path.abspath(fileName), self.dataDir)
+
+  def getCached(self, section, fileName, compute):
+    """Return compute(fileName), cached in the given section until the file changes"""
+    fileStat = os.stat(fileName)
+    key = self.getKey(fileName)
+    entry = self.inventory[section].get(key)
+    if entry and entry['mtime'] == fileStat.st_mtime and entry['size'] == fileStat.st_size:
+      return entry['Information']
+    information = compute(fileName)
+    with self.lock:
+      self.inventory[section][key] = {'mtime': fileStat.st_mtime, 'size': fileStat.st_size,
+                                      'Information': information}
+      self.modified = True
+    return information
+
+  def getImageInformation(self, fileName):
+    """Return header geometry of the image, reading it only if not cached or stale"""
+    return self.getCached('Geometry', fileName, readImageInformation)
+
+  def getCanonicalType(self, studyDir, series):
+    """Return CanonicalType of the series from Canonical/<series>.json, None if not available"""
+    canonicalFile = os.path.join(studyDir, series, 'Canonical', series+'.json')
+    try:
+      return self.getCached('Canonical', canonicalFile, readCanonicalAttributes).get('CanonicalType')
+    except (OSError, IOError, ValueError):
+      return None
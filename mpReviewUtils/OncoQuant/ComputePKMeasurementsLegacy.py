@@ -1,5 +1,6 @@
 import shutil, string, os, sys, glob, xml.dom.minidom, json
 import SimpleITK as sitk
+import numpy as np
 
 # Given the location of data and a JSON configuration file that has the following
 # structure:
@@ -11,6 +12,7 @@ import SimpleITK as sitk
 #
 # find series that match the list (study and series type), compute all
 # measurement types, for all labels, and save them at the Measurements level.
+# Each label gets one record with the measurements for all PK maps.
 
 data = sys.argv[1]
 
@@ -68,6 +70,64 @@ def getValidDirs(dir):
   dirs = [f for f in dirs if not f.startswith('.')]
   return dirs
 
+def computeLabelStatistics(npLabel, npMaps, measurementTypes, voxelVolume):
+  """Grouped statistics for all non-zero labels and all map components at once
+
+  npLabel is a flat array of label values, npMaps is [voxels, maps]. Returns
+  {labelID: {measurementType: [value for each map]}}.
+  """
+  inside = npLabel != 0
+  labelIDs, groups = np.unique(npLabel[inside], return_inverse=True)
+  values = npMaps[inside].astype(np.float64)
+  nLabels, nMaps = len(labelIDs), values.shape[1]
+
+  counts = np.bincount(groups, minlength=nLabels)
+  sums = np.zeros((nLabels, nMaps))
+  np.add.at(sums, groups, values)
+  means = sums/counts[:,None]
+
+  results = {}
+  for mtype in measurementTypes:
+    if mtype == "Mean":
+      results[mtype] = means
+    elif mtype == "StandardDeviation":
+      # sample standard deviation, same as sitk.LabelStatisticsImageFilter
+      squares = np.zeros((nLabels, nMaps))
+      np.add.at(squares, groups, (values-means[groups])**2)
+      results[mtype] = np.sqrt(squares/np.maximum(counts-1, 1)[:,None])
+    elif mtype == "Minimum":
+      minimums = np.full((nLabels, nMaps), np.inf)
+      np.minimum.at(minimums, groups, values)
+      results[mtype] = minimums
+    elif mtype == "Maximum":
+      maximums = np.full((nLabels, nMaps), -np.inf)
+      np.maximum.at(maximums, groups, values)
+      results[mtype] = maximums
+    elif mtype == "Volume":
+      results[mtype] = np.repeat((counts*voxelVolume)[:,None], nMaps, axis=1)
+
+  # order statistics: sort voxel values within each label, for all maps
+  orderTypes = [m for m in measurementTypes if m == "Median" or m.startswith("Percentile")]
+  if len(orderTypes):
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sortedValues = np.empty_like(values)
+    for m in range(nMaps):
+      sortedValues[:,m] = values[np.lexsort((values[:,m], groups)),m]
+    for mtype in orderTypes:
+      if mtype == "Median":
+        lower = offsets+(counts-1)//2
+        upper = offsets+counts//2
+        results[mtype] = (sortedValues[lower]+sortedValues[upper])/2.
+      else:
+        percent = float(mtype[10:])/100.
+        positions = offsets+np.minimum((counts*percent).astype(np.int64), counts-1)
+        results[mtype] = sortedValues[positions]
+
+  return {int(labelID): {mtype: results[mtype][i] for mtype in measurementTypes if mtype in results}
+          for i, labelID in enumerate(labelIDs)}
+
+mapTypes = ['Ktrans','Ve','TTP','MaxSlope','AUC']
+
 seriesDescription2Count = {}
 seriesDescription2Type = {}
 
@@ -139,96 +199,63 @@ for c in studies:
         # consider only the most recent seg file for the given reader
         segmentationFile = segFiles[-1]
 
-        for mapType in ['Ktrans','Ve','TTP','MaxSlope','AUC']:
-
+        # read all parametric maps once and stack them as components of a
+        # single array, so that statistics for all labels and all maps are
+        # computed in one pass over the voxels
+        mapFiles = []
+        for mapType in mapTypes:
           mapName = settings['OncoQuantVersion']+'-'+settings['AIFType']+'*-'+mapType+'.nrrd'
           mapsPath = os.path.join(studyDir,dceSeries,'OncoQuant',mapName)
           imageFiles = glob.glob(mapsPath)
           imageFiles.sort()
-          imageFile = imageFiles[-1]
-
-          label = sitk.ReadImage(str(segmentationFile))
-          image = sitk.ReadImage(str(imageFile))
-        
-          if resampleLabel:
-            resample = sitk.ResampleImageFilter()
-            resample.SetReferenceImage(image)
-            resample.SetInterpolator(sitk.sitkNearestNeighbor)
-            label = resample.Execute(label)
-
-          image.SetDirection(label.GetDirection())
-          image.SetSpacing(label.GetSpacing())
-          image.SetOrigin(label.GetOrigin())
-
-          if image.GetSize()[2] != label.GetSize()[2]:
-            print 'ERROR: Image/label sizes do not match!'
-            abort()
-
-          stats = sitk.LabelStatisticsImageFilter()
-          stats.Execute(label,label)
-          totalLabels = stats.GetNumberOfLabels()        
-          if totalLabels<2:
-            print segmentationFile
-            print "ERROR: Segmentation should have exactly 2 labels!"
-            continue
-
-          allLabelIDs = list(stats.GetLabels())
-          print allLabelIDs
-          allLabelIDs.sort()
-
-          for labelID in allLabelIDs[1:]:
-            structure = str(labelID)
-            measurements = {}
-            measurements['SegmentationName'] = structure
- 
-            # threshold to label 1
-            thresh = sitk.BinaryThresholdImageFilter()
-            thresh.SetLowerThreshold(labelID)
-            thresh.SetUpperThreshold(labelID)
-            thresh.SetInsideValue(1)
-            thresh.SetOutsideValue(0)
-            thisLabel = thresh.Execute(label)
-
-            stats.Execute(image,thisLabel)
- 
-            for mtype in settings['MeasurementTypes']:
-
-              if mtype == "Mean":
-                measurements["Mean."+mapType] = stats.GetMean(1)
-              if mtype == "Median":
-                measurements["Median."+mapType] = stats.GetMedian(1)
-              if mtype == "StandardDeviation":
-                measurements["StandardDeviation."+mapType] = stats.GetSigma(1)
-              if mtype == "Minimum":
-                measurements["Minimum."+mapType] = stats.GetMinimum(1)
-              if mtype == "Maximum":
-                measurements["Maximum."+mapType] = stats.GetMaximum(1)
-              if mtype == "Volume":
-                spacing = thisLabel.GetSpacing()
-                measurements["Volume."+mapType] = stats.GetCount(1)*spacing[0]*spacing[1]*spacing[2]
-              if mtype.startswith("Percentile"):
-                npImage = sitk.GetArrayFromImage(image)
-                npLabel = sitk.GetArrayFromImage(thisLabel)
-                pixels = npImage[npLabel==1]
-                pixels.sort()
-                percent = float(mtype[10:])/100.
-                measurements[mtype+"."+mapType] = float(pixels[len(pixels)*percent])
-
-            measurementsDir = os.path.join(studyDir,dceSeries,'Measurements')
-            try:
-              os.mkdir(measurementsDir)
-            except:
-              pass
-            statsFileName = dceSeries+'-'+settings['OncoQuantVersion']+'-'+settings['AIFType']+'-'+structure+'-'+reader+'.json'
-            measurementsFile = os.path.join(measurementsDir,statsFileName)
-            f = open(measurementsFile,'w')
-            #print measurements
-            f.write(json.dumps(measurements))
-            f.close()
+          if not len(imageFiles):
+            break
+          mapFiles.append(imageFiles[-1])
+        if len(mapFiles) != len(mapTypes):
+          print('ERROR: not all maps available for '+dceSeries)
+          continue
+
+        label = sitk.ReadImage(str(segmentationFile))
+        maps = [sitk.ReadImage(str(f)) for f in mapFiles]
 
-            #mm.recordMeasurement(study=c,series=s,struct=structure,reader=reader,mtype=mtype,mvalue=mvalue)
-          #mvalue = mvalue+1
+        if resampleLabel:
+          resample = sitk.ResampleImageFilter()
+          resample.SetReferenceImage(maps[0])
+          resample.SetInterpolator(sitk.sitkNearestNeighbor)
+          label = resample.Execute(label)
 
-        #print str(measurements)
+        if any(m.GetSize() != label.GetSize() for m in maps):
+          print('ERROR: Image/label sizes do not match: '+segmentationFile)
+          continue
+
+        npLabel = sitk.GetArrayViewFromImage(label).ravel()
+        npMaps = np.stack([sitk.GetArrayViewFromImage(m).ravel() for m in maps], axis=1)
+
+        spacing = label.GetSpacing()
+        statistics = computeLabelStatistics(npLabel, npMaps, settings['MeasurementTypes'],
+                                            spacing[0]*spacing[1]*spacing[2])
+        if len(statistics) < 1:
+          print(segmentationFile)
+          print("ERROR: Segmentation should have exactly 2 labels!")
+          continue
+
+        measurementsDir = os.path.join(studyDir,dceSeries,'Measurements')
+        try:
+          os.mkdir(measurementsDir)
+        except:
+          pass
+
+        for labelID, labelStatistics in statistics.items():
+          structure = str(labelID)
+          measurements = {}
+          measurements['SegmentationName'] = structure
+          for mtype, values in labelStatistics.items():
+            for mapType, value in zip(mapTypes, values):
+              measurements[mtype+"."+mapType] = float(value)
+
+          statsFileName = dceSeries+'-'+settings['OncoQuantVersion']+'-'+settings['AIFType']+'-'+structure+'-'+reader+'.json'
+          measurementsFile = os.path.join(measurementsDir,statsFileName)
+          with open(measurementsFile,'w') as f:
+            f.write(json.dumps(measurements))
 
-print 'WARNING: ADD RESAMPLING OF THE LABEL TO IMAGE!!!'
+print('WARNING: ADD RESAMPLING OF THE LABEL TO IMAGE!!!')
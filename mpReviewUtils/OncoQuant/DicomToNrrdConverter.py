@@ -1,13 +1,20 @@
-import shutil, string, os, sys, glob, xml.dom.minidom
+import os, sys, json, logging, argparse, hashlib
+from JobRunner import Job, JobRunner
 
 # Iterate over all series in the directory that follows PCampReview convention,
-# use rules defined in getCanonicalType() to 'tag' series according to the
-# types of typical interest.
+# and convert the DICOM data of every DCE series into OncoQuant/<series>.nrrd
+# using the external OncoQuantNrrd.py converter.
+#
+# Conversions run in parallel (at most --jobs at a time). A series is skipped
+# when its NRRD exists and the DICOM folder has not changed since the last
+# successful conversion. The result of every conversion is recorded in the
+# status table.
 #
 # Input argument: directory with the data
 
-data = sys.argv[1]
-# usage: python OncoQuantNrrd.py caseName dicomFolder nrrdDestination 
+logger = logging.getLogger("mpReviewUtil:DicomToNrrdConverter")
+
+# usage: python OncoQuantNrrd.py caseName dicomFolder nrrdDestination
 dicomToNrrdConverter = '/xnat/mehrtash/OncoQuantNrrd.py'
 
 def getValidDirs(dir):
@@ -17,48 +24,77 @@ def getValidDirs(dir):
   dirs = [f for f in dirs if not f.startswith('.')]
   return dirs
 
-def getElementValue(dom,name):
-  elements = dom.getElementsByTagName('element')
-  for e in elements:
-    if e.getAttribute('name') == name:
-      return e.childNodes[0].nodeValue
+def getDirectoryFingerprint(directory):
+  """Hash of names, sizes and modification times of the files in the directory"""
+  md5 = hashlib.md5()
+  entries = sorted((e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in os.scandir(directory) if e.is_file())
+  for entry in entries:
+    md5.update(repr(entry).encode())
+  return md5.hexdigest()
 
-  return None
+def createJobs(data, converter, python):
+  jobs = []
+  for c in getValidDirs(data):
+    studyDir = os.path.join(data,c,'RESOURCES')
+    try:
+      series = os.listdir(studyDir)
+    except OSError:
+      continue
 
-seriesDescription2Count = {}
-seriesDescription2Type = {}
+    for s in series:
+      if s.startswith('.'):
+        continue
+      canonicalPath = os.path.join(studyDir,s,'Canonical')
+      try:
+        with open(os.path.join(canonicalPath,s+'.json'),'r') as f:
+          jsondata = json.load(f)
+      except (OSError, IOError, ValueError):
+        continue
+      if jsondata['CanonicalType']!='DCE':
+        continue
+      dicomFolder = os.path.join(studyDir,s,'DICOM')
+      if not os.path.isdir(dicomFolder):
+        logger.error('study: '+c+' series: '+s+': DICOM folder not found')
+        continue
+      nrrdDestination = os.path.join(studyDir,s,'OncoQuant')
+      if not os.path.exists(nrrdDestination):
+        os.makedirs(nrrdDestination)
+      jobs.append(Job(c+'-'+s, [python, converter, s, dicomFolder, nrrdDestination],
+                      os.path.join(nrrdDestination, 'log_DicomToNrrd.txt'),
+                      fingerprint=getDirectoryFingerprint(dicomFolder),
+                      outputs=[os.path.join(nrrdDestination, s+'.nrrd')]))
+  return jobs
 
-studies = getValidDirs(data)
-totalSeries = 0
-totalStudies = 0
+def main(argv):
 
-for c in studies:
-  studyDir = os.path.join(data,c,'RESOURCES')
   try:
-    series = os.listdir(studyDir)
-  except:
-    continue
+    parser = argparse.ArgumentParser(description="Convert DCE series to NRRD for OncoQuant")
+    parser.add_argument("-i", "--input-folder", dest="input_folder", metavar="PATH",
+                        required=True, help="Folder of input data (is expected to follow mpReview input hierarchy, see https://github.com/SlicerProstate/mpReview")
+    parser.add_argument("-c", "--converter", dest="converter", default=dicomToNrrdConverter,
+                        help="Converter script (default: %(default)s)")
+    parser.add_argument("-p", "--python", dest="python", default="python",
+                        help="Python interpreter used to run the converter (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=None,
+                        help="Number of conversions to run in parallel (default: number of cores)")
+    parser.add_argument("--status-file", dest="status_file", default=None,
+                        help="Conversion status table (default: DicomToNrrd-status.json in the input folder)")
+    parser.add_argument("-f", "--force", dest="force", action="store_true",
+                        help="Convert all series, including the ones that are up to date")
+    args = parser.parse_args(argv)
+  except Exception as e:
+    logger.error("Failed with exception parsing command line arguments: "+str(e))
+    return 1
 
-  totalStudies = totalStudies+1
-  seriesPerStudy = 0
-
-  for s in series:
-    if not s.startswith('.'):
-      canonicalPath = os.path.join(studyDir,s,'Canonical')
-      f = open(os.path.join(canonicalPath,s+'.json'),'r')
-      import json
-      jsondata = json.load(f)
-      f.close()
-      if jsondata['CanonicalType']=='DCE':
-        print '--------------------------------------------------'
-        print 'study: ', c, 'series:',s
-        dicomFolder = os.path.join(studyDir,s,'DICOM') 
-        print dicomFolder
-        if os.path.isdir(dicomFolder):
-          nrrdDestination = os.path.join(studyDir,s,'OncoQuant')
-          if not os.path.exists(nrrdDestination):
-    	    os.makedirs(nrrdDestination)
-          print 'running converter ...'
-          os.system("python "+dicomToNrrdConverter +" "+ s+ " "+ dicomFolder+ " " + nrrdDestination)
+  logger.setLevel(logging.INFO)
+  logger.addHandler(logging.StreamHandler())
+  logging.getLogger("mpReviewUtil:JobRunner").addHandler(logging.StreamHandler())
+  logging.getLogger("mpReviewUtil:JobRunner").setLevel(logging.INFO)
 
+  statusFile = args.status_file or os.path.join(args.input_folder, 'DicomToNrrd-status.json')
+  jobs = createJobs(args.input_folder, args.converter, args.python)
+  exitStatuses = JobRunner(statusFile, args.jobs).run(jobs, force=args.force)
+  return 1 if any(s != 0 for s in exitStatuses.values()) else 0
 
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
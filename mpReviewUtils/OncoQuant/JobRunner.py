@@ -0,0 +1,96 @@
+import os, json, logging, subprocess, threading, datetime, hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Run independent command line jobs on a pool of workers.
+#
+# Every job has a unique name, its output goes to its own log file, and the
+# exit status of every job is recorded in a JSON status table. When the same
+# table is used again, jobs that already finished successfully are skipped,
+# so an interrupted batch can be resumed by re-running the same script.
+
+logger = logging.getLogger("mpReviewUtil:JobRunner")
+
+def getFilesFingerprint(fileNames):
+  """Hash of names, sizes and modification times of the files, missing files included"""
+  md5 = hashlib.md5()
+  for fileName in fileNames:
+    try:
+      fileStat = os.stat(fileName)
+      entry = (fileName, fileStat.st_size, fileStat.st_mtime_ns)
+    except OSError:
+      entry = (fileName, None, None)
+    md5.update(repr(entry).encode())
+  return md5.hexdigest()
+
+class Job(object):
+
+  def __init__(self, name, command, logFile, cwd=None, fingerprint=None, outputs=None):
+    self.name = name
+    self.command = [str(c) for c in command]
+    self.logFile = logFile
+    self.cwd = cwd
+    # if the fingerprint changes, the job is run again even if it succeeded before
+    self.fingerprint = fingerprint
+    # files the job is expected to produce, the job is run again if any is missing
+    self.outputs = outputs or []
+
+
+class JobRunner(object):
+
+  def __init__(self, statusFile, maxWorkers=None):
+    self.statusFile = statusFile
+    self.maxWorkers = maxWorkers or os.cpu_count() or 1
+    self.lock = threading.Lock()
+    self.status = {}
+    try:
+      with open(self.statusFile) as f:
+        self.status = json.load(f)
+    except (OSError, IOError, ValueError):
+      pass
+
+  def saveStatus(self):
+    tmpFile = self.statusFile+'.tmp'
+    with open(tmpFile, 'w') as f:
+      json.dump(self.status, f, indent=2, sort_keys=True)
+    os.replace(tmpFile, self.statusFile)
+
+  def isDone(self, job):
+    previous = self.status.get(job.name)
+    return previous is not None and previous.get('ExitStatus') == 0 and \
+           previous.get('Fingerprint') == job.fingerprint and \
+           all(os.path.exists(o) for o in job.outputs)
+
+  def runJob(self, job):
+    started = datetime.datetime.now().isoformat()
+    logger.info('Starting '+job.name)
+    try:
+      with open(job.logFile, 'w') as log:
+        log.write(' '.join(job.command)+'\n')
+        log.flush()
+        exitStatus = subprocess.call(job.command, cwd=job.cwd, stdout=log, stderr=subprocess.STDOUT)
+    except OSError as e:
+      logger.error('Failed to start '+job.name+': '+str(e))
+      exitStatus = -1
+    record = {'Command': job.command, 'LogFile': job.logFile, 'ExitStatus': exitStatus,
+              'Fingerprint': job.fingerprint, 'Started': started,
+              'Finished': datetime.datetime.now().isoformat()}
+    with self.lock:
+      self.status[job.name] = record
+      self.saveStatus()
+    if exitStatus == 0:
+      logger.info('Finished '+job.name)
+    else:
+      logger.error('Job '+job.name+' failed with exit status '+str(exitStatus)+', see '+job.logFile)
+    return exitStatus
+
+  def run(self, jobs, force=False):
+    """Run all jobs that have not completed yet, returns {name: exit status}"""
+    pending = [j for j in jobs if force or not self.isDone(j)]
+    skipped = len(jobs)-len(pending)
+    if skipped:
+      logger.info('Skipping %i job(s) completed in a previous run' % skipped)
+    with ThreadPoolExecutor(max_workers=max(1, self.maxWorkers)) as executor:
+      exitStatuses = dict(zip([j.name for j in pending], executor.map(self.runJob, pending)))
+    failed = [n for n, s in exitStatuses.items() if s != 0]
+    logger.info('%i job(s) run, %i failed, %i skipped' % (len(pending), len(failed), skipped))
+    return exitStatuses
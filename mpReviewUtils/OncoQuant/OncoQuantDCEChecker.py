@@ -1,61 +1,108 @@
-import shutil, string, os, sys, glob, xml.dom.minidom
+import os, sys, json, csv, logging, argparse, importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+def importSiblingModule(name, relativePath):
+  """Import a module of mpReviewUtils by its path relative to this file"""
+  spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(os.path.abspath(__file__)), relativePath))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+DatasetInventoryModule = importSiblingModule('DatasetInventory', os.path.join('..', 'DatasetInventory.py'))
+DatasetInventory = DatasetInventoryModule.DatasetInventory
+getValidDirs = DatasetInventoryModule.getValidDirs
 
 # Iterate over all series in the directory that follows PCampReview convention,
-# use rules defined in getCanonicalType() to 'tag' series according to the
-# types of typical interest.
+# and check that every DCE series has the inputs needed by OncoQuant
+# (OncoQuant/<series>.nrrd and OncoQuant/<series>-parameters.txt).
+#
+# Canonical types come from the dataset inventory, each OncoQuant directory is
+# listed once with os.scandir and all studies are checked concurrently. The
+# result is written as a CSV or JSON report (by extension of the output file).
 #
 # Input argument: directory with the data
 
-data = sys.argv[1]
-
-def getValidDirs(dir):
-  #dirs = [f for f in os.listdir(dir) if (not f.startswith('.')) and (not os.path.isfile(f))]
-  dirs = os.listdir(dir)
-  dirs = [f for f in dirs if os.path.isdir(dir+'/'+f)]
-  dirs = [f for f in dirs if not f.startswith('.')]
-  return dirs
+logger = logging.getLogger("mpReviewUtil:OncoQuantDCEChecker")
 
-seriesDescription2Count = {}
-seriesDescription2Type = {}
+REPORT_FIELDS = ['Study', 'Series', 'Status', 'NRRDSize', 'ParametersSize']
 
-studies = getValidDirs(data)
-totalSeries = 0
-totalStudies = 0
+def scanSizes(directory):
+  """Sizes of all regular files in the directory, None if it does not exist"""
+  try:
+    with os.scandir(directory) as entries:
+      return {e.name: e.stat().st_size for e in entries if e.is_file()}
+  except (FileNotFoundError, NotADirectoryError):
+    return None
 
-for c in studies:
+def checkStudy(inventory, data, c):
   studyDir = os.path.join(data,c,'RESOURCES')
-
   try:
     series = os.listdir(studyDir)
-  except:
-    continue
-
-  totalStudies = totalStudies+1
-  seriesPerStudy = 0
+  except OSError:
+    return []
 
+  records = []
   for s in series:
-    if not s.startswith('.'):
-      canonicalPath = os.path.join(studyDir,s,'Canonical')
-      f = open(os.path.join(canonicalPath,s+'.json'),'r')
-      import json
-      jsondata = json.load(f)
-      f.close()
-      if jsondata['CanonicalType']=='DCE':
-        print '--------------------------------------------------'
-        print 'study: ', c,'series:',s
-        oncoQuantDir = os.path.join(studyDir,s,'OncoQuant')
-        if os.path.exists(oncoQuantDir):
-          nrrdFilePath = os.path.join(oncoQuantDir, s+ '.nrrd' )
-          paramFilePath = os.path.join(oncoQuantDir, s+ '-parameters.txt' )
-          if os.path.isfile(nrrdFilePath):
-            print 'nrrd size: ',os.stat(nrrdFilePath).st_size
-          else:
-            print 'nrrd file not available'
-          if os.path.isfile(paramFilePath):
-            print 'param size: ',os.stat(paramFilePath).st_size
-          else:
-            print 'param file not available'
-        else:
-          print 'OncoQuant directory is not present'
+    if s.startswith('.') or inventory.getCanonicalType(studyDir, s) != 'DCE':
+      continue
+    record = {'Study': c, 'Series': s, 'NRRDSize': None, 'ParametersSize': None}
+    sizes = scanSizes(os.path.join(studyDir,s,'OncoQuant'))
+    if sizes is None:
+      record['Status'] = 'NO_ONCOQUANT_DIR'
+    else:
+      record['NRRDSize'] = sizes.get(s+'.nrrd')
+      record['ParametersSize'] = sizes.get(s+'-parameters.txt')
+      if record['NRRDSize'] is None:
+        record['Status'] = 'NO_NRRD'
+      elif record['ParametersSize'] is None:
+        record['Status'] = 'NO_PARAMETERS'
+      elif record['NRRDSize'] == 0 or record['ParametersSize'] == 0:
+        record['Status'] = 'EMPTY'
+      else:
+        record['Status'] = 'COMPLETE'
+    records.append(record)
+  return records
+
+def writeReport(records, fileName):
+  if fileName.endswith('.json'):
+    with open(fileName, 'w') as f:
+      json.dump(records, f, indent=2)
+  else:
+    with open(fileName, 'w', newline='') as f:
+      writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+      writer.writeheader()
+      writer.writerows(records)
+
+def main(argv):
+
+  try:
+    parser = argparse.ArgumentParser(description="Check that DCE series are ready for OncoQuant")
+    parser.add_argument("-i", "--input-folder", dest="input_folder", metavar="PATH",
+                        required=True, help="Folder of input data (is expected to follow mpReview input hierarchy, see https://github.com/SlicerProstate/mpReview")
+    parser.add_argument("-o", "--output-file", dest="output_file", default="DCECompleteness.csv",
+                        help="Report file, .csv or .json (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=32,
+                        help="Number of studies checked concurrently (default: %(default)s)")
+    args = parser.parse_args(argv)
+  except Exception as e:
+    logger.error("Failed with exception parsing command line arguments: "+str(e))
+    return
+
+  logger.setLevel(logging.INFO)
+  logger.addHandler(logging.StreamHandler())
+
+  data = args.input_folder
+  inventory = DatasetInventory(data)
+
+  with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+    perStudy = executor.map(lambda c: checkStudy(inventory, data, c), sorted(getValidDirs(data)))
+    records = [r for studyRecords in perStudy for r in studyRecords]
+
+  inventory.save()
+  writeReport(records, args.output_file)
 
+  complete = len([r for r in records if r['Status'] == 'COMPLETE'])
+  logger.info('%i of %i DCE series complete, report saved to %s' % (complete, len(records), args.output_file))
 
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -1,15 +1,28 @@
-import shutil, string, os, sys, glob, xml.dom.minidom
+import os, sys, glob, json, logging, argparse
 import datetime
+from JobRunner import Job, JobRunner, getFilesFingerprint
 
 # Iterate over all series in the directory that follows PCampReview convention,
-# use rules defined in getCanonicalType() to 'tag' series according to the
-# types of typical interest.
+# find the DCE series prepared by DicomToNrrdConverter and run OncoQuant on
+# each of them for every AIF choice (Auto, Model, left and right artery ROI).
+#
+# Every (study, AIF) combination is an independent job. Jobs run in parallel,
+# each with its own log in the OncoQuant directory of the series, and exit
+# statuses are recorded in a status table so that re-running the script only
+# runs the jobs that did not complete.
 #
 # Input argument: directory with the data
 
-data = sys.argv[1]
-#reader = sys.argv[2]
-reader = 'fionafennessy'
+logger = logging.getLogger("mpReviewUtil:PKModelling")
+
+binPath = '/xnat/fedorov/GE/bin/'
+#OncoQuantVersion = '2015_0327'
+OncoQuantVersion = '13.38.05'
+OncoQuantExecutable = 'OncoQuantExec_' + OncoQuantVersion
+OncoQuantExecutablePath = os.path.join(binPath,OncoQuantExecutable)
+xmlConfigFilePath = '/xnat/mehrtash/OncoQuant_Nov2011_TwoParameter.xml'
+
+AIFChoices = ['Auto','Model','ManualLeftArteryROI', 'ManualRightArteryROI']
 
 def getValidDirs(dir):
   #dirs = [f for f in os.listdir(dir) if (not f.startswith('.')) and (not os.path.isfile(f))]
@@ -33,101 +46,118 @@ def getArteryROIs(segmentationsPath,reader):
     arteryRoiFile[artery] = os.path.join(segmentationsPath,segFiles[0])
   return arteryRoiFile
 
-seriesDescription2Count = {}
-seriesDescription2Type = {}
+def collectStudies(data, reader):
+  studiesDictionary = {}
+  for c in getValidDirs(data):
+    studyDir = os.path.join(data,c,'RESOURCES')
 
-studies = getValidDirs(data)
-totalSeries = 0
-totalStudies = 0
+    try:
+      series = os.listdir(studyDir)
+    except OSError:
+      continue
 
-binPath = '/xnat/fedorov/GE/bin/'
-#OncoQuantVersion = '2015_0327'
-OncoQuantVersion = '13.38.05'
-OncoQuantExecutable = 'OncoQuantExec_' + OncoQuantVersion
-OncoQuantExecutablePath = os.path.join(binPath,OncoQuantExecutable)
-xmlConfigFilePath = '/xnat/mehrtash/OncoQuant_Nov2011_TwoParameter.xml' 
-print os.path.isfile(xmlConfigFilePath)
+    dic = {}
+    for s in series:
+      if not s.startswith('.'):
+        canonicalPath = os.path.join(studyDir,s,'Canonical')
+        with open(os.path.join(canonicalPath,s+'.json'),'r') as f:
+          jsondata = json.load(f)
+        if jsondata['CanonicalType']=='DCE' and c not in ['14','4','12','24']:
+          oncoQuantDir = os.path.join(studyDir,s,'OncoQuant')
+          dic['OncoQuantDir'] = oncoQuantDir
+          dic['DCESeriesNumber'] = s
+        if jsondata['CanonicalType']=='SUB':
+          segmentationsDir = os.path.join(studyDir,s,'Segmentations')
+          dic['arteryRoiFile'] = getArteryROIs(segmentationsDir,reader)
+    studiesDictionary[c] = dic
+  return studiesDictionary
+
+def getAIFArguments(aifChoice, arteryRoiFile):
+  """Return OncoQuant -aif arguments for the choice, None if not available for the study"""
+  if aifChoice == 'Auto':
+    return ['0']
+  if aifChoice == 'Model':
+    return ['1']
+  artery = {'ManualLeftArteryROI': 'LeftArteryROI', 'ManualRightArteryROI': 'RightArteryROI'}[aifChoice]
+  if arteryRoiFile and arteryRoiFile[artery]:
+    return ['4', arteryRoiFile[artery]]
+  return None
 
-studiesDictionary = {}
-for c in studies:
-  studyDir = os.path.join(data,c,'RESOURCES')
+def createJobs(studiesDictionary, executable, xmlConfig, timestamp):
+  jobs = []
+  for c in sorted(studiesDictionary.keys()):
+    dic = studiesDictionary[c]
+    if not 'OncoQuantDir' in dic:
+      continue
+    oncoQuantDir = dic['OncoQuantDir']
+    if not os.path.exists(oncoQuantDir):
+      logger.error('study '+c+': OncoQuant directory is not present')
+      continue
+    s = dic['DCESeriesNumber']
+    nrrdFilePath = os.path.join(oncoQuantDir, s+ '.nrrd' )
+    paramFilePath = os.path.join(oncoQuantDir, s+ '-parameters.txt' )
+    if not (os.path.isfile(nrrdFilePath) and os.path.isfile(paramFilePath)):
+      logger.error('study '+c+': nrrd or parameters file not available')
+      continue
+    for aifChoice in AIFChoices:
+      aifArguments = getAIFArguments(aifChoice, dic.get('arteryRoiFile'))
+      if aifArguments is None:
+        continue
+      # inputs of the job, it is run again if any of them changes
+      inputFiles = [nrrdFilePath, paramFilePath, xmlConfig] + aifArguments[1:]
+      suffix = OncoQuantVersion + '-' + aifChoice + '-' +  timestamp
+      command = [executable,
+                 '-d', nrrdFilePath,
+                 '-q', paramFilePath,
+                 '-s',
+                 '-aif'] + aifArguments + \
+                ['-o', suffix,
+                 '-v', xmlConfig,
+                 '-t']
+      jobs.append(Job(c+'-'+s+'-'+aifChoice, command, os.path.join(oncoQuantDir, 'log_'+suffix+'.txt'),
+                      cwd=oncoQuantDir, fingerprint=getFilesFingerprint(inputFiles)))
+  return jobs
+
+def main(argv):
 
   try:
-    series = os.listdir(studyDir)
-  except:
-    continue
-
-  totalStudies = totalStudies+1
-  seriesPerStudy = 0
-
-  dic = {}
-  for s in series:
-    if not s.startswith('.'):
-      canonicalPath = os.path.join(studyDir,s,'Canonical')
-      f = open(os.path.join(canonicalPath,s+'.json'),'r')
-      import json
-      jsondata = json.load(f)
-      f.close()
-      if jsondata['CanonicalType']=='DCE' and c not in ['14','4','12','24']:
-        oncoQuantDir = os.path.join(studyDir,s,'OncoQuant')
-        dic['OncoQuantDir'] = oncoQuantDir
-        dic['DCESeriesNumber'] = s
-      if jsondata['CanonicalType']=='SUB':
-        segmentationsDir = os.path.join(studyDir,s,'Segmentations')
-        arteryRoiFile = getArteryROIs(segmentationsDir,reader)
-        dic['arteryRoiFile'] = arteryRoiFile
-  studiesDictionary[c] = dic
-print studiesDictionary
-for c in studies:
-  print 'study:', c
-for c in studies:
-  print '-----------------------------------'
-  print 'study:', c
-  print '-----------------------------------'
-  if 'OncoQuantDir' in studiesDictionary[c]:
-    if os.path.exists(studiesDictionary[c]['OncoQuantDir']):
-      oncoQuantDir = studiesDictionary[c]['OncoQuantDir']
-      s = studiesDictionary[c]['DCESeriesNumber']
-      nrrdFilePath = os.path.join(oncoQuantDir, s+ '.nrrd' )
-      paramFilePath = os.path.join(oncoQuantDir, s+ '-parameters.txt' )
-      print nrrdFilePath
-      if os.path.isfile(nrrdFilePath) and os.path.isfile(paramFilePath):
-        for aifChoice in ['Auto','Model','ManualLeftArteryROI', 'ManualRightArteryROI']:
-          if aifChoice == 'Auto':
-            aifChoiceNumber = '0'
-            aifMap = ' '
-          elif aifChoice == 'Model':
-            aifChoiceNumber = '1'
-          elif aifChoice == 'ManualLeftArteryROI':
-            if segmentationsDir and arteryRoiFile['LeftArteryROI']:
-            #if 'arteryRoiFile' in studiesDictionary[c]:
-              aifChoiceNumber = '4'
-              aifMapFilePath = studiesDictionary[c]['arteryRoiFile']['LeftArteryROI']
-              aifMap = ' ' + aifMapFilePath + ' '
-            else:
-              break
-          elif aifChoice == 'ManualRightArteryROI':
-            if segmentationsDir and arteryRoiFile['RightArteryROI']:
-              aifChoiceNumber = '4'
-              aifMapFilePath = studiesDictionary[c]['arteryRoiFile']['RightArteryROI']
-              aifMap = ' ' + aifMapFilePath + ' '
-            else:
-              break
-          timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-          suffix = OncoQuantVersion + '-' + aifChoice + '-' +  timestamp 
-          command = '(cd '+ oncoQuantDir +'; '+ OncoQuantExecutablePath +\
-                    ' -d ' + nrrdFilePath +\
-                    ' -q ' + paramFilePath +\
-                    ' -s'+\
-                    ' -aif '+ aifChoiceNumber + aifMap +\
-                    '-o ' + suffix +\
-                    ' -v ' + xmlConfigFilePath +\
-                    ' -t |tee log_'+suffix+'.txt)'
-          print command
-          os.system(command)
-      else:
-        print 'nrrd or parameters file not available'
-    else:
-      print 'OncoQuant directory is not present'
+    parser = argparse.ArgumentParser(description="Run OncoQuant PK modelling for all DCE series")
+    parser.add_argument("-i", "--input-folder", dest="input_folder", metavar="PATH",
+                        required=True, help="Folder of input data (is expected to follow mpReview input hierarchy, see https://github.com/SlicerProstate/mpReview")
+    parser.add_argument("-r", "--reader", dest="reader", default='fionafennessy',
+                        help="Reader whose artery ROIs are used for the manual AIF")
+    parser.add_argument("-e", "--executable", dest="executable", default=OncoQuantExecutablePath,
+                        help="OncoQuant executable (default: %(default)s)")
+    parser.add_argument("-x", "--xml-config", dest="xml_config", default=xmlConfigFilePath,
+                        help="OncoQuant XML configuration (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=None,
+                        help="Number of jobs to run in parallel (default: number of cores)")
+    parser.add_argument("--status-file", dest="status_file", default=None,
+                        help="Job status table (default: PKModelling-status.json in the input folder)")
+    parser.add_argument("-f", "--force", dest="force", action="store_true",
+                        help="Run all jobs, including the ones that completed in a previous run")
+    args = parser.parse_args(argv)
+  except Exception as e:
+    logger.error("Failed with exception parsing command line arguments: "+str(e))
+    return 1
+
+  logger.setLevel(logging.INFO)
+  logger.addHandler(logging.StreamHandler())
+  logging.getLogger("mpReviewUtil:JobRunner").addHandler(logging.StreamHandler())
+  logging.getLogger("mpReviewUtil:JobRunner").setLevel(logging.INFO)
+
+  if not os.path.isfile(args.xml_config):
+    logger.error('OncoQuant configuration not found: '+args.xml_config)
+    return 1
+
+  statusFile = args.status_file or os.path.join(args.input_folder, 'PKModelling-status.json')
+  timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+  studiesDictionary = collectStudies(args.input_folder, args.reader)
+  jobs = createJobs(studiesDictionary, args.executable, args.xml_config, timestamp)
 
+  exitStatuses = JobRunner(statusFile, args.jobs).run(jobs, force=args.force)
+  return 1 if any(s != 0 for s in exitStatuses.values()) else 0
 
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
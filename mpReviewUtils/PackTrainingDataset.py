@@ -0,0 +1,201 @@
+import os, sys, glob, json, logging, argparse, csv
+import numpy as np
+import SimpleITK as sitk
+import h5py # not included in Slicer
+from DatasetInventory import DatasetInventory, gridsMatch
+
+# Given the location of data, an output file and a JSON configuration file that
+# has the following structure:
+#
+# Studies: <list>
+# SeriesTypes: <list of canonical names>
+# Structures: <list of canonical structure types>
+# Readers: <list of reader IDs>
+# Spacing: <target voxel spacing in mm, [x, y, z]>
+# Size: <target grid size in voxels, [x, y, z]>
+#
+# find series that match the list (study and series type), select the latest
+# segmentation for each structure and reader (same rules as SelectSegmentations),
+# resample the reconstruction and the label to a common grid centered on the
+# reconstruction, and pack everything in a single chunked, compressed HDF5 file:
+#
+#   /images  float32 [nImages, z, y, x]  one entry per series
+#   /labels  uint8   [nLabels, z, y, x]  one entry per (series, structure, reader)
+#   /index   one row per label: study, series, type, structure, reader, image row
+#
+# The index is also written as CSV next to the HDF5 file. Data loaders can read
+# patches directly from the chunks without decoding the gzip NRRD files.
+
+logger = logging.getLogger("mpReviewUtil:PackTrainingDataset")
+
+DEFAULT_SPACING = [0.5, 0.5, 3.0]
+DEFAULT_SIZE = [256, 256, 32]
+
+def getValidDirs(dir):
+  dirs = os.listdir(dir)
+  dirs = [f for f in dirs if os.path.isdir(dir+'/'+f)]
+  dirs = [f for f in dirs if not f.startswith('.')]
+  return dirs
+
+def collectPairs(data, settings):
+  """Return the list of series to pack, each with the latest segmentations"""
+  allStructures = settings.get('Structures', ['WholeGland','PeripheralZone','TumorROI_PZ_1',
+                                              'TumorROI_CGTZ_1',
+                                              'BPHROI_1',
+                                              'NormalROI_PZ_1',
+                                              'NormalROI_CGTZ_1'])
+  pairs = []
+  for c in sorted(getValidDirs(data)):
+    if 'Studies' in settings and not c in settings['Studies']:
+      continue
+
+    studyDir = os.path.join(data,c,'RESOURCES')
+    try:
+      series = sorted(os.listdir(studyDir))
+    except OSError:
+      continue
+
+    for s in series:
+      if s.startswith('.'):
+        continue
+
+      canonicalFile = os.path.join(studyDir,s,'Canonical',s+'.json')
+      try:
+        with open(canonicalFile) as f:
+          canonicalType = json.load(f)['CanonicalType']
+      except (OSError, IOError, ValueError, KeyError):
+        continue
+      if not canonicalType in settings['SeriesTypes']:
+        continue
+
+      segmentationsPath = os.path.join(studyDir,s,'Segmentations')
+      labels = []
+      for structure in allStructures:
+        for reader in settings['Readers']:
+          segFiles = sorted(glob.glob(segmentationsPath+'/'+reader+'-'+structure+'*'))
+          if len(segFiles):
+            labels.append({'Structure': structure, 'Reader': reader, 'File': segFiles[-1]})
+
+      if len(labels):
+        pairs.append({'Study': c, 'Series': s, 'CanonicalType': canonicalType,
+                      'Image': os.path.join(studyDir,s,'Reconstructions',s+'.nrrd'),
+                      'Labels': labels})
+  return pairs
+
+def makeReferenceGrid(image, spacing, size):
+  """Grid with the target spacing and size, same direction and center as the image"""
+  reference = sitk.Image([int(v) for v in size], sitk.sitkFloat32)
+  reference.SetSpacing([float(v) for v in spacing])
+  reference.SetDirection(image.GetDirection())
+  imageCenter = image.TransformContinuousIndexToPhysicalPoint([(v-1)/2. for v in image.GetSize()])
+  gridCenter = reference.TransformContinuousIndexToPhysicalPoint([(v-1)/2. for v in size])
+  reference.SetOrigin([o+ic-gc for o,ic,gc in zip(reference.GetOrigin(), imageCenter, gridCenter)])
+  return reference
+
+def resampleToGrid(volume, reference, interpolator, pixelType):
+  return sitk.Resample(volume, reference, sitk.Transform(), interpolator, 0, pixelType)
+
+def main(argv):
+
+  try:
+    parser = argparse.ArgumentParser(description="Pack reconstructions and segmentations into a chunked HDF5 training dataset")
+    parser.add_argument("-i", "--input-folder", dest="input_folder", metavar="PATH",
+                        required=True, help="Folder of input data (is expected to follow mpReview input hierarchy, see https://github.com/SlicerProstate/mpReview")
+    parser.add_argument("-s", "--settings", dest="settings_file",
+                        required=True, help="Parameters JSON file to drive the selection")
+    parser.add_argument("-o", "--output-file", dest="output_file", metavar="PATH",
+                        required=True, help="Output HDF5 file")
+    parser.add_argument("-c", "--chunk", dest="chunk", type=int, nargs=3, default=[64, 64, 8], metavar=("X", "Y", "Z"),
+                        help="Chunk size in voxels (default: 64 64 8)")
+    parser.add_argument("-v", dest="verbose", help="Verbose output", action="store_true")
+    args = parser.parse_args(argv)
+  except Exception as e:
+    logger.error("Failed with exception parsing command line arguments: "+str(e))
+    return
+
+  if args.verbose:
+    logger.setLevel(logging.DEBUG)
+  else:
+    logger.setLevel(logging.INFO)
+  logger.addHandler(logging.StreamHandler())
+
+  with open(args.settings_file) as settingsFile:
+    settings = json.loads(settingsFile.read())
+
+  spacing = settings.get('Spacing', DEFAULT_SPACING)
+  size = settings.get('Size', DEFAULT_SIZE)
+  shape = (size[2], size[1], size[0])
+  chunks = tuple(min(c, s) for c, s in zip(reversed(args.chunk), shape))
+
+  inventory = DatasetInventory(args.input_folder)
+  pairs = collectPairs(args.input_folder, settings)
+
+  indexRows = []
+  with h5py.File(args.output_file, 'w') as h5:
+    images = h5.create_dataset('images', shape=(0,)+shape, maxshape=(None,)+shape, dtype='float32',
+                               chunks=(1,)+chunks, compression='gzip', shuffle=True)
+    labels = h5.create_dataset('labels', shape=(0,)+shape, maxshape=(None,)+shape, dtype='uint8',
+                               chunks=(1,)+chunks, compression='gzip', shuffle=True)
+    h5.attrs['Spacing'] = spacing
+    h5.attrs['Size'] = size
+
+    for pair in pairs:
+      try:
+        imageInformation = inventory.getImageInformation(pair['Image'])
+      except (OSError, RuntimeError) as e:
+        logger.error('Failed to read '+pair['Image']+': '+str(e))
+        continue
+
+      # reject mismatched labels before decoding anything, the label geometry is
+      # replaced with the image geometry below, so size and spacing must match
+      pairLabels = []
+      for l in pair['Labels']:
+        try:
+          labelInformation = inventory.getImageInformation(l['File'])
+        except (OSError, RuntimeError) as e:
+          logger.error('Failed to read '+l['File']+': '+str(e))
+          continue
+        if gridsMatch(imageInformation, labelInformation):
+          pairLabels.append(l)
+        else:
+          logger.error('Image/label sizes do not match: '+l['File'])
+      if not len(pairLabels):
+        continue
+
+      image = sitk.ReadImage(pair['Image'])
+      reference = makeReferenceGrid(image, spacing, size)
+      imageRow = images.shape[0]
+      images.resize(imageRow+1, axis=0)
+      images[imageRow] = sitk.GetArrayFromImage(resampleToGrid(image, reference, sitk.sitkLinear, sitk.sitkFloat32))
+
+      for l in pairLabels:
+        label = sitk.ReadImage(str(l['File']))
+        # segmentations are stored on the reconstruction grid, see ComputeMeasurements
+        label.SetDirection(image.GetDirection())
+        label.SetSpacing(image.GetSpacing())
+        label.SetOrigin(image.GetOrigin())
+        labelArray = sitk.GetArrayFromImage(resampleToGrid(label, reference, sitk.sitkNearestNeighbor, sitk.sitkUInt8))
+        labelRow = labels.shape[0]
+        labels.resize(labelRow+1, axis=0)
+        labels[labelRow] = (labelArray > 0).astype(np.uint8)
+        indexRows.append([pair['Study'], pair['Series'], pair['CanonicalType'], l['Structure'], l['Reader'],
+                          imageRow, labelRow, pair['Image'], l['File']])
+
+      logger.debug('Packed '+pair['Study']+'/'+pair['Series'])
+
+    header = ['Study', 'Series', 'CanonicalType', 'Structure', 'Reader', 'ImageRow', 'LabelRow', 'ImageFile', 'LabelFile']
+    stringType = h5py.string_dtype(encoding='utf-8')
+    indexType = np.dtype([(h, np.int64 if h.endswith('Row') else stringType) for h in header])
+    h5.create_dataset('index', data=np.array([tuple(r) for r in indexRows], dtype=indexType))
+
+  with open(os.path.splitext(args.output_file)[0]+'.csv', 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(header)
+    writer.writerows(indexRows)
+
+  inventory.save()
+  logger.info('Packed %i labels for %i series into %s' % (len(indexRows), len(set(r[5] for r in indexRows)),
+                                                         args.output_file))
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -1,6 +1,7 @@
-import shutil, string, os, sys, glob, xml.dom.minidom, json
+import os, sys, glob, json, logging, argparse, errno, shutil
+from concurrent.futures import ThreadPoolExecutor
 
-# Given the location of data, an output directory and a JSON configuration 
+# Given the location of data, an output directory and a JSON configuration
 # file that has the following structure:
 #
 # Studies: <list>
@@ -9,167 +10,195 @@ import shutil, string, os, sys, glob, xml.dom.minidom, json
 # Readers: <list of reader IDs>
 #
 # find series that match the list (study and series type), select the latest
-# segmentation for specified structure and reader, and copy that together with
-# the volume reconstruction into the output directory
-
-data = sys.argv[1]
-
-settingsFile= sys.argv[2]
-
-outputDir = sys.argv[3]
-
-settingsData = open(settingsFile).read()
-settings = json.loads(settingsData)
-
-class MeasurementsManager:
-  def __init__(self):
-    self.measurementsContainer = {}
-
-  def recordMeasurement(self,study,series,struct,reader,mtype,mvalue):
-    mc = self.measurementsContainer
-    if not study in mc.keys():
-      mc[study] = {}
-    if not series in mc[study].keys():
-      mc[study][series] = {}
-    if not struct in mc[study][series].keys(): 
-      mc[study][series][struct] = {}
-    if not reader in mc[study][series][struct].keys():
-      mc[study][series][struct][reader] = {}
-    #if not reader in mc[study][series][struct][mtype].keys:
-    #  mc[study][series][struct][reader][mtype] = ''
-
-    mc[study][series][struct][reader][mtype] = mvalue
-
-  def getJSON(self):
-    return json.dumps(self.measurementsContainer)
-
-  def getCSV(self):
-    return
-    
-
-def getElementValue(dom,name):
-  elements = dom.getElementsByTagName('element')
-  for e in elements:
-    if e.getAttribute('name') == name:
-      return e.childNodes[0].nodeValue
+# segmentation for specified structure and reader, and export that together with
+# the volume reconstruction into the output directory.
+#
+# Each reconstruction is exported once, no matter how many structures reference
+# it. Files are hardlinked (or reflinked) when the output directory is on the
+# same filesystem as the data, and copied in parallel otherwise. The list of
+# exported files is written to manifest.json in the output directory.
+#
+# NOTE: hardlinked files share storage with the source, do not modify them in
+# place - use --mode copy if the exported files will be edited.
 
-  return None
+logger = logging.getLogger("mpReviewUtil:SelectSegmentations")
 
-def checkTagExistence(dom,tag):
-  elements = dom.getElementsByTagName('element')
-  for e in elements:
-    if e.getAttribute('tag') == tag:
-      return True
+MANIFEST_FILE_NAME = "manifest.json"
 
-  return False
- 
 def getValidDirs(dir):
-  #dirs = [f for f in os.listdir(dir) if (not f.startswith('.')) and (not os.path.isfile(f))]
   dirs = os.listdir(dir)
   dirs = [f for f in dirs if os.path.isdir(dir+'/'+f)]
   dirs = [f for f in dirs if not f.startswith('.')]
   return dirs
 
-def getCanonicalType(dom):
-  import re
-  desc = getElementValue(dom,'SeriesDescription')
-  if re.search('[a-zA-Z]',desc) == None:
-    return "sutract"
-  elif re.search('AX',desc) and re.search('T2',desc):
-    return "Axial T2"
-  elif re.search('Apparent Diffusion',desc):
-    # TODO: parse platform-specific b-values etc
-    return 'ADC'
-  elif re.search('Ax Dynamic',desc) or re.search('3D DCE',desc):
-    return 'DCE'
-  else:
-    return "Unknown"
-
-seriesDescription2Count = {}
-seriesDescription2Type = {}
+def reflink(src, dst):
+  # FICLONE from linux/fs.h, supported by btrfs, xfs and others
+  import fcntl
+  FICLONE = 0x40049409
+  with open(src, 'rb') as s, open(dst, 'wb') as d:
+    try:
+      fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+      d.close()
+      os.unlink(dst)
+      raise
+
+def exportFile(src, dst, mode):
+  """Place src at dst, returns the method that was used"""
+  if mode in ['auto', 'hardlink']:
+    try:
+      os.link(src, dst)
+      return 'hardlink'
+    except OSError as e:
+      if mode == 'hardlink' or e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+        raise
+  if mode == 'auto' and sys.platform.startswith('linux'):
+    try:
+      reflink(src, dst)
+      return 'reflink'
+    except (OSError, IOError):
+      pass
+  shutil.copyfile(src, dst)
+  return 'copy'
+
+def collectExports(data, settings, outputDir):
+  """Find the latest segmentations and the reconstructions they refer to"""
+  segmentations = []
+  reconstructions = {}
+  # the file name does not include the reader, the first reader found is exported
+  destinations = set()
+
+  # if no structures specified in the config file, consider all
+  allStructures = settings.get('Structures', ['WholeGland','PeripheralZone','TumorROI_PZ_1',
+                                              'TumorROI_CGTZ_1',
+                                              'BPHROI_1',
+                                              'NormalROI_PZ_1',
+                                              'NormalROI_CGTZ_1'])
+
+  for c in getValidDirs(data):
+
+    if 'Studies' in settings and not c in settings['Studies']:
+      continue
 
-studies = getValidDirs(data)
+    studyDir = os.path.join(data,c,'RESOURCES')
 
-totalSeries = 0
-totalStudies = 0
+    try:
+      series = os.listdir(studyDir)
+    except OSError:
+      continue
 
-mm = MeasurementsManager()
-mvalue = 0
+    for s in series:
+      if s.startswith('.'):
+        # handle '.DS_store'
+        continue
 
-# resample label to the image reference
-# should probably be done once during preprocessing
-resampleLabel = False
+      canonicalFile = os.path.join(studyDir,s,'Canonical',s+'.json')
+      try:
+        with open(canonicalFile) as f:
+          seriesAttributes = json.load(f)
+      except (OSError, IOError, ValueError):
+        continue
 
-for c in studies:
+      # check if the series type is of interest
+      canonicalType = seriesAttributes['CanonicalType']
+      if not canonicalType in settings['SeriesTypes']:
+        continue
 
-  try:
-    if not c in settings['Studies']:
-      continue
-  except:
-    # if Studies is not initialized, assume need to process all
-    pass
+      segmentationsPath = os.path.join(studyDir,s,'Segmentations')
+      imageFile = os.path.join(studyDir,s,'Reconstructions',s+'.nrrd')
+      destReconFileName = os.path.join(outputDir,c+'-'+s+'-'+canonicalType+'-Recon.nrrd')
 
-  studyDir = os.path.join(data,c,'RESOURCES')
+      for structure in allStructures:
+        for reader in settings['Readers']:
+          segFiles = glob.glob(segmentationsPath+'/'+reader+'-'+structure+'*')
 
-  try:
-    series = os.listdir(studyDir)
-  except:
-    continue
+          if not len(segFiles):
+            continue
+          segFiles.sort()
 
-  totalStudies = totalStudies+1
-  seriesPerStudy = 0
+          # consider only the most recent seg file for the given reader
+          segmentationFile = segFiles[-1]
 
-  for s in series:
-    if s.startswith('.'):
-      # handle '.DS_store'
-      continue
+          destSegFileName = os.path.join(outputDir,c+'-'+s+'-'+canonicalType+'-'+structure+'-Seg.nrrd')
 
-    canonicalPath = os.path.join(studyDir,s,'Canonical')
-    canonicalFile = os.path.join(canonicalPath,s+'.json')
-    seriesAttributes = json.loads(open(canonicalFile,'r').read())
+          if destSegFileName in destinations or os.path.exists(destSegFileName):
+            logger.error('File exists: '+destSegFileName)
+            continue
+          destinations.add(destSegFileName)
 
-    # check if the series type is of interest
-    if not seriesAttributes['CanonicalType'] in settings['SeriesTypes']:
-      continue
- 
-    # if no structures specified in the config file, consider all
-    allStructures = None
-    try:
-      allStructures = settings['Structures']
-    except:
-      allStructures = ['WholeGland','PeripheralZone','TumorROI_PZ_1',
-          'TumorROI_CGTZ_1',
-          'BPHROI_1',
-          'NormalROI_PZ_1',
-          'NormalROI_CGTZ_1']
-
-    for structure in allStructures:
-      # check if segmentation is available for this series
-      segmentationsPath = os.path.join(studyDir,s,'Segmentations')
-      
-      for reader in settings['Readers']:
-        segFiles = glob.glob(segmentationsPath+'/'+reader+'-'+structure+'*')
+          segmentations.append({'Study': c, 'Series': s, 'CanonicalType': canonicalType,
+                                'Structure': structure, 'Reader': reader,
+                                'Source': segmentationFile, 'Destination': destSegFileName,
+                                'Reconstruction': destReconFileName})
+          reconstructions[destReconFileName] = {'Study': c, 'Series': s, 'CanonicalType': canonicalType,
+                                                'Source': imageFile, 'Destination': destReconFileName}
 
-        if not len(segFiles):
-          continue
-        segFiles.sort()
+  return segmentations, list(reconstructions.values())
 
-        # consider only the most recent seg file for the given reader
-        segmentationFile = segFiles[-1]
+def main(argv):
 
-        imageFile = os.path.join(studyDir,s,'Reconstructions',s+'.nrrd')
+  try:
+    parser = argparse.ArgumentParser(description="Export the latest segmentations together with the reconstructions")
+    parser.add_argument("input_folder", metavar="INPUT",
+                        help="Folder of input data (is expected to follow mpReview input hierarchy, see https://github.com/SlicerProstate/mpReview")
+    parser.add_argument("settings_file", metavar="SETTINGS",
+                        help="Parameters JSON file to drive the selection")
+    parser.add_argument("output_folder", metavar="OUTPUT",
+                        help="Folder where the selected files will be exported")
+    parser.add_argument("-m", "--mode", dest="mode", choices=['auto', 'hardlink', 'copy'], default='auto',
+                        help="auto: hardlink or reflink when possible, copy otherwise (default: auto)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=8,
+                        help="Number of parallel copies (default: 8)")
+    parser.add_argument("-v", dest="verbose", help="Verbose output", action="store_true")
+    args = parser.parse_args(argv)
+  except Exception as e:
+    logger.error("Failed with exception parsing command line arguments: "+str(e))
+    return
 
-        destSegFileName = outputDir+'/'+c+'-'+s+'-'+seriesAttributes['CanonicalType']+'-'+structure+'-Seg.nrrd'
-        destReconFileName = outputDir+'/'+c+'-'+s+'-'+seriesAttributes['CanonicalType']+'-Recon.nrrd'
+  if args.verbose:
+    logger.setLevel(logging.DEBUG)
+  else:
+    logger.setLevel(logging.INFO)
+  logger.addHandler(logging.StreamHandler())
 
-        if os.path.exists(destSegFileName):
-          print 'ERROR: file exists: ',destSegFileName
-          continue
+  with open(args.settings_file) as settingsFile:
+    settings = json.loads(settingsFile.read())
 
-        shutil.copyfile(segmentationFile,destSegFileName)
-        shutil.copyfile(imageFile,destReconFileName)
+  outputDir = args.output_folder
+  if not os.path.exists(outputDir):
+    os.makedirs(outputDir)
 
-        print 'Copied',destSegFileName
-        print 'Copied',destReconFileName
+  segmentations, reconstructions = collectExports(args.input_folder, settings, outputDir)
 
-print 'WARNING: ADD RESAMPLING OF THE LABEL TO IMAGE!!!'
+  def stage(item):
+    if os.path.exists(item['Destination']):
+      # reconstruction exported by a previous run
+      item['Method'] = 'existing'
+      return item
+    try:
+      item['Method'] = exportFile(item['Source'], item['Destination'], args.mode)
+      logger.debug('Exported '+item['Destination']+' ('+item['Method']+')')
+    except (OSError, IOError) as e:
+      item['Method'] = None
+      item['Error'] = str(e)
+      logger.error('Failed to export '+item['Source']+': '+str(e))
+    return item
+
+  with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+    reconstructions = list(executor.map(stage, reconstructions))
+    segmentations = list(executor.map(stage, segmentations))
+
+  manifest = {'Input': os.path.abspath(args.input_folder),
+              'Settings': settings,
+              'Reconstructions': reconstructions,
+              'Segmentations': segmentations}
+  with open(os.path.join(outputDir, MANIFEST_FILE_NAME), 'w') as f:
+    json.dump(manifest, f, indent=2)
+
+  failed = [i for i in reconstructions+segmentations if i['Method'] is None]
+  logger.info('Exported %i segmentations and %i reconstructions, %i failed' %
+              (len(segmentations), len(reconstructions), len(failed)))
+  logger.warning('WARNING: ADD RESAMPLING OF THE LABEL TO IMAGE!!!')
+
+if __name__ == "__main__":
+  main(sys.argv[1:])